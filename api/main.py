@@ -3,22 +3,31 @@ from fastapi import FastAPI, HTTPException, BackgroundTasks
 from fastapi.responses import JSONResponse
 from fastapi.staticfiles import StaticFiles
 from pathlib import Path
+from typing import Any, Dict, List, Optional
 import os
 
 from api.models import (
+    EncodeOptions,
     EpisodeRequest,
-    EpisodeResponse,
+    JobResponse,
     ImageResponse,
     SRTResponse,
     VideoResponse,
     AudioResponse,
     HealthResponse,
+    ComfyStatsResponse,
+    FFmpegStatsResponse,
 )
+from comfy.scheduler import AffinityScheduler
+from comfy.transport import get_default_transport
 from services.episode_service import EpisodeService
 from services.image_service import ImageService
 from services.srt_service import SRTService
 from services.video_service import VideoService
 from services.audio_service import AudioService
+from services.jobs import JobManager
+from services import ffmpeg_runner
+from services.tts_backends import close_shared_backends
 
 app = FastAPI(
     title="AI 漫剧生成 API",
@@ -32,22 +41,66 @@ if static_dir.exists():
     app.mount("/static", StaticFiles(directory=str(static_dir)), name="static")
 
 # 从环境变量读取配置
+# 多个 ComfyUI 后端用逗号分隔（如 "http://gpu1:8188,http://gpu2:8188"），将按队列深度负载均衡
 COMFY_URL = os.getenv("COMFY_URL", "http://127.0.0.1:8188")
 # COMFY_ROOT 已不再需要，保留用于兼容性
+# 并发的 episode 任务按 checkpoint 亲和性排队提交，减少 ComfyUI 切换模型（设为 1 开启，多个模型混用时才有收益）
+COMFY_CHECKPOINT_AFFINITY = os.getenv("COMFY_CHECKPOINT_AFFINITY", "0") == "1"
+# 亲和性调度时每个 ComfyUI 队列中最多保留的任务数（运行中 + 等待中）
+COMFY_AFFINITY_INFLIGHT = int(os.getenv("COMFY_AFFINITY_INFLIGHT", "2"))
+# 整集音轨格式（"wav" 或 "aac"）：配音拼接为一条音轨，视频拼接时直接流复制；为空时每个镜头一个 MP3
+AUDIO_TRACK = os.getenv("AUDIO_TRACK") or None
 
 # 延迟初始化服务（在需要时创建）
-def get_episode_service():
+def get_episode_service(video_options: Optional[Dict[str, Any]] = None):
     """获取 episode 服务实例"""
-    return EpisodeService(COMFY_URL, None)
+    return EpisodeService(
+        COMFY_URL,
+        None,
+        checkpoint_affinity=COMFY_CHECKPOINT_AFFINITY,
+        affinity_inflight=COMFY_AFFINITY_INFLIGHT,
+        video_options=video_options,
+        audio_track=AUDIO_TRACK,
+    )
 
 def get_image_service():
     """获取图片服务实例"""
-    return ImageService(COMFY_URL, None)
+    return ImageService(
+        COMFY_URL,
+        None,
+        checkpoint_affinity=COMFY_CHECKPOINT_AFFINITY,
+        affinity_inflight=COMFY_AFFINITY_INFLIGHT,
+    )
 
 # 初始化不需要 ComfyUI 的服务
 srt_service = SRTService()
 video_service = VideoService()
-audio_service = AudioService()
+audio_service = AudioService(track_format=AUDIO_TRACK)
+
+
+def get_video_options(encode: Optional[EncodeOptions], quality: str = "final") -> Optional[Dict[str, Any]]:
+    """把请求中的编码参数和渲染质量转换为 VideoService 的参数，并检查编码档位、输出档位和渲染质量"""
+    if encode is None and quality == "final":
+        return None
+    options = {}
+    if encode is not None:
+        options = encode.model_dump(exclude={"threads"})
+        options["segment_threads"] = encode.threads
+    options["quality"] = quality
+    try:
+        VideoService(**options)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return options
+
+# 完整渲染任务在后台线程池中执行，RENDER_WORKERS 为同时渲染的 episode 数
+job_manager = JobManager(max_workers=int(os.getenv("RENDER_WORKERS", "2")))
+
+
+@app.on_event("shutdown")
+def shutdown():
+    """关闭服务时释放进程内共享的 TTS 后端（pyttsx3 工作进程）"""
+    close_shared_backends()
 
 
 @app.get("/")
@@ -75,41 +128,131 @@ async def health():
     return HealthResponse(status="ok", version="0.1.0")
 
 
-@app.post("/api/v1/episodes/render", response_model=EpisodeResponse)
-async def render_episode(request: EpisodeRequest):
-    """
-    完整渲染 episode（图片 + 字幕 + 音频 + 视频）
+@app.get("/api/v1/comfy/stats", response_model=ComfyStatsResponse)
+async def comfy_stats():
+    """ComfyUI 请求延迟统计、熔断状态和 checkpoint 调度统计"""
+    transport = get_default_transport()
+    return ComfyStatsResponse(
+        phases=transport.stats.snapshot(),
+        circuits=transport.circuit_states(),
+        schedulers=AffinityScheduler.all_stats(),
+    )
+
+
+@app.get("/api/v1/ffmpeg/stats", response_model=FFmpegStatsResponse)
+async def ffmpeg_stats():
+    """本进程内 ffmpeg 调用按用途累计的编码速度（阶段子进程中的调用只计入对应任务的 ffmpeg.totals）"""
+    return FFmpegStatsResponse(labels=ffmpeg_runner.stats.snapshot())
 
-    可以传入 episode_id 或完整的 episode_data
+
+@app.post("/api/v1/episodes/render", response_model=JobResponse, status_code=202)
+def render_episode(request: EpisodeRequest):
     """
-    try:
-        episode_service = get_episode_service()
-        
-        if request.episode_data:
-            episode_data = request.episode_data
-        elif request.episode_id:
-            episode_data = episode_service.load_episode(request.episode_id)
-        else:
-            raise HTTPException(status_code=400, detail="必须提供 episode_id 或 episode_data")
+    提交完整渲染任务（图片 + 字幕 + 音频 + 视频），立即返回任务 ID
 
-        result = episode_service.render_full_episode(episode_data, request.episode_id)
+    可以传入 episode_id 或完整的 episode_data；通过 GET /api/v1/jobs/{job_id} 查询进度和产物
+    """
+    video_options = get_video_options(request.encode, request.quality)
+    episode_service = get_episode_service(video_options)
 
-        return EpisodeResponse(
-            episode_id=result["episode_id"],
-            images=result["images"],
-            srt=result["srt"],
-            audio=result.get("audio", []),
-            video=result["video"],
-            message="Episode 渲染完成",
+    if request.episode_data:
+        episode_data = request.episode_data
+    elif request.episode_id:
+        try:
+            episode_data = episode_service.load_episode(request.episode_id)
+        except FileNotFoundError as e:
+            raise HTTPException(status_code=404, detail=str(e))
+    else:
+        raise HTTPException(status_code=400, detail="必须提供 episode_id 或 episode_data")
+
+    episode_id = request.episode_id or episode_data.get("episode_id", 1)
+    if request.quality == "draft":
+        # 预览不调用 ComfyUI 和 TTS，几秒内完成
+        job = job_manager.submit(
+            "episode_draft",
+            episode_service.render_draft,
+            episode_data,
+            request.episode_id,
+            params={"episode_id": episode_id, "quality": "draft", "encode": video_options},
         )
-    except FileNotFoundError as e:
-        raise HTTPException(status_code=404, detail=str(e))
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"渲染失败: {str(e)}")
+        return JobResponse(**job.to_dict())
+
+    job = job_manager.submit(
+        "episode_render",
+        episode_service.render_full_episode,
+        episode_data,
+        request.episode_id,
+        force=request.force,
+        hls=request.hls,
+        params={
+            "episode_id": episode_id,
+            "force": request.force,
+            "encode": video_options,
+            "hls_url": f"/api/v1/episodes/{episode_id}/hls/master.m3u8" if request.hls else None,
+        },
+    )
+    return JobResponse(**job.to_dict())
+
+
+@app.get("/api/v1/episodes/{episode_id}/hls/{file_path:path}")
+def episode_hls(episode_id: int, file_path: str):
+    """
+    HLS 播放列表和分片
+
+    渲染过程中播放列表持续增长，不允许缓存；写入 EXT-X-ENDLIST 后短时间缓存。
+    分片（包括软字幕的 WebVTT 分片）按内容哈希命名，可以长期缓存。
+    """
+    from fastapi.responses import FileResponse
+    # api/ -> 项目根目录（使用绝对路径）
+    hls_dir = (Path(__file__).resolve().parent.parent / "output" / "hls" / f"episode_{episode_id:03d}").resolve()
+    path = (hls_dir / file_path).resolve()
+    if hls_dir not in path.parents or not path.is_file():
+        raise HTTPException(status_code=404, detail=f"HLS 文件不存在: {file_path}")
+
+    if path.suffix == ".m3u8":
+        media_type = "application/vnd.apple.mpegurl"
+        text = path.read_text(encoding="utf-8")
+        if path.name == "master.m3u8" or "#EXT-X-ENDLIST" not in text:
+            cache_control = "no-cache"
+        else:
+            cache_control = "public, max-age=60"
+    elif path.suffix == ".ts":
+        media_type = "video/mp2t"
+        cache_control = "public, max-age=31536000, immutable"
+    elif path.suffix == ".vtt":
+        media_type = "text/vtt"
+        cache_control = "public, max-age=31536000, immutable"
+    else:
+        raise HTTPException(status_code=404, detail=f"HLS 文件不存在: {file_path}")
+    return FileResponse(path, media_type=media_type, headers={"Cache-Control": cache_control})
+
+
+@app.get("/api/v1/jobs", response_model=List[JobResponse])
+async def list_jobs():
+    """列出进行中和最近结束的任务"""
+    return [JobResponse(**job.to_dict()) for job in job_manager.list()]
+
+
+@app.get("/api/v1/jobs/{job_id}", response_model=JobResponse)
+async def get_job(job_id: str):
+    """查询任务状态：当前阶段、各 shot 进度、阶段耗时和产物路径"""
+    job = job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"任务不存在: {job_id}")
+    return JobResponse(**job.to_dict())
+
+
+@app.delete("/api/v1/jobs/{job_id}", response_model=JobResponse)
+def cancel_job(job_id: str):
+    """取消任务：杀掉正在运行的 ffmpeg/TTS 子进程，并取消已提交的 ComfyUI prompt"""
+    job = job_manager.cancel(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"任务不存在: {job_id}")
+    return JobResponse(**job.to_dict())
 
 
 @app.post("/api/v1/episodes/{episode_id}/images", response_model=ImageResponse)
-async def generate_images(episode_id: int):
+def generate_images(episode_id: int):
     """生成图片"""
     try:
         episode_service = get_episode_service()
@@ -126,7 +269,7 @@ async def generate_images(episode_id: int):
 
 
 @app.post("/api/v1/episodes/{episode_id}/srt", response_model=SRTResponse)
-async def generate_srt(episode_id: int):
+def generate_srt(episode_id: int):
     """生成字幕"""
     try:
         episode_service = get_episode_service()
@@ -141,16 +284,20 @@ async def generate_srt(episode_id: int):
 
 
 @app.post("/api/v1/episodes/{episode_id}/audio", response_model=AudioResponse)
-async def generate_audio(episode_id: int):
+def generate_audio(episode_id: int):
     """生成音频"""
     try:
         episode_service = get_episode_service()
         episode_data = episode_service.load_episode(episode_id)
         audio_files = audio_service.generate_audio(episode_data, episode_id)
+        audio_track = None
+        if audio_service.track_format is not None:
+            audio_track = audio_service.build_episode_track(episode_data, episode_id)
 
         return AudioResponse(
             audio_files=[str(f) for f in audio_files],
-            message=f"成功生成 {len(audio_files)} 个音频文件"
+            audio_track=str(audio_track) if audio_track else None,
+            message=f"成功生成 {len(audio_files)} 个音频文件" + ("和整集音轨" if audio_track else "")
         )
     except FileNotFoundError as e:
         raise HTTPException(status_code=404, detail=str(e))
@@ -159,9 +306,19 @@ async def generate_audio(episode_id: int):
 
 
 @app.post("/api/v1/episodes/{episode_id}/video", response_model=VideoResponse)
-async def render_video(episode_id: int):
-    """渲染视频"""
+def render_video(episode_id: int, encode: Optional[EncodeOptions] = None, quality: str = "final"):
+    """渲染视频（可选请求体为编码参数；quality=draft 时渲染快速预览，缺失的图片和配音用占位画面和静音代替）"""
+    video_options = get_video_options(encode, quality)
     try:
+        if quality == "draft":
+            episode_service = get_episode_service(video_options)
+            result = episode_service.render_draft(episode_service.load_episode(episode_id), episode_id)
+            return VideoResponse(
+                video_path=result["video"],
+                renditions=result["renditions"],
+                message=f"预览渲染完成（占位画面 {len(result['placeholders'])} 个镜头，静音 {len(result['silent'])} 个镜头）",
+            )
+
         episode_service = get_episode_service()
         episode_data = episode_service.load_episode(episode_id)
 
@@ -170,12 +327,16 @@ async def render_video(episode_id: int):
         project_root = Path(__file__).resolve().parent.parent
         images = []
         durations = []
-        for shot in episode_data["shots"]:
+        shot_audio = []
+        for index, shot in enumerate(episode_data["shots"]):
             # 使用 output 字段作为图片路径
             image_path = project_root / shot.get("image", shot.get("output", ""))
             if image_path.exists():
                 images.append(image_path)
                 durations.append(shot["duration"])
+                # 按镜头对齐配音，没有配音的镜头补静音
+                audio_path = audio_service.shot_audio_path(episode_id, shot.get("id", index + 1))
+                shot_audio.append(audio_path if audio_path.exists() else None)
 
         if not images:
             raise HTTPException(status_code=400, detail="未找到图片文件，请先生成图片")
@@ -185,26 +346,28 @@ async def render_video(episode_id: int):
         if not srt_path.exists():
             srt_path = srt_service.generate_srt(episode_data, episode_id)
 
-        # 检查是否有音频文件（如果存在则使用）
-        audio_files = None
-        audio_dir = project_root / "assets" / "audio"
-        if audio_dir.exists():
-            # 查找该 episode 的音频文件，按 shot_id 排序
-            episode_audio_files = sorted(
-                audio_dir.glob(f"episode_{episode_id:03d}_shot_*.mp3"),
-                key=lambda x: int(x.stem.split("_shot_")[1])  # 按 shot_id 排序
-            )
-            if episode_audio_files and len(episode_audio_files) == len(images):
-                audio_files = episode_audio_files
-                print(f"找到 {len(audio_files)} 个音频文件用于视频渲染")
-            elif episode_audio_files:
-                print(f"警告: 音频文件数量 ({len(episode_audio_files)}) 与图片数量 ({len(images)}) 不匹配")
+        # 整集音轨与全部镜头对齐，只在每个镜头都有图片时使用；否则按镜头合并已有的配音
+        audio_track = None
+        if len(images) == len(episode_data["shots"]):
+            audio_track = audio_service.load_episode_track(episode_data, episode_id)
+        audio_files = shot_audio if any(audio is not None for audio in shot_audio) else None
+        if audio_track is not None:
+            print(f"使用整集音轨: {audio_track}")
+        elif audio_files:
+            print(f"找到 {sum(1 for audio in shot_audio if audio is not None)} 个音频文件用于视频渲染")
 
         # 渲染视频
         video_path = project_root / "output" / f"episode_{episode_id:03d}.mp4"
-        video_path = video_service.render_video(images, durations, srt_path, video_path, audio_files=audio_files)
+        service = VideoService(**video_options) if video_options else video_service
+        outputs = service.render_renditions(
+            images, durations, srt_path, video_path, audio_files=audio_files, audio_track=audio_track
+        )
 
-        return VideoResponse(video_path=str(video_path), message="视频渲染完成")
+        return VideoResponse(
+            video_path=str(outputs[service.renditions[0].name]),
+            renditions={name: str(path) for name, path in outputs.items()},
+            message=f"视频渲染完成（{len(outputs)} 个输出档位）",
+        )
     except FileNotFoundError as e:
         raise HTTPException(status_code=404, detail=str(e))
     except Exception as e:
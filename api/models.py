@@ -3,10 +3,44 @@ from typing import List, Optional, Dict, Any
 from pydantic import BaseModel, Field
 
 
+class RenditionOptions(BaseModel):
+    """输出档位"""
+    name: str = Field(description="档位名（如 720p），第一个档位之外的文件名为 episode_XXX_<name>.mp4")
+    width: int = Field(description="宽度")
+    height: int = Field(description="高度")
+    crf: Optional[int] = Field(None, description="x264 CRF，默认取编码档位的值")
+    bitrate: Optional[str] = Field(None, description="峰值码率上限（如 4M）")
+    font_scale: float = Field(1.0, description="字幕字号倍数（字号已随分辨率等比缩放）")
+
+
+class EncodeOptions(BaseModel):
+    """视频编码参数"""
+    profile: str = Field("still", description="编码档位：still（静态画面优化）或 standard（逐帧编码）")
+    preset: Optional[str] = Field(None, description="x264 preset，默认取档位的值")
+    crf: Optional[int] = Field(None, description="x264 CRF，默认取档位的值")
+    tune: Optional[str] = Field(None, description="x264 tune（如 stillimage），默认取档位的值")
+    gop: Optional[int] = Field(None, description="关键帧最大间隔（帧），默认取档位的值")
+    threads: Optional[int] = Field(None, description="每个 ffmpeg 进程的编码线程数")
+    subtitles: str = Field(
+        "burn",
+        description="字幕方式：burn（烧录进画面）或 soft（mov_text 字幕轨 / HLS WebVTT，修改字幕只需重新封装）",
+    )
+    renditions: Optional[List[RenditionOptions]] = Field(
+        None, description="输出档位列表，一次解码同时输出全部档位；默认只输出 720x1280"
+    )
+
+
 class EpisodeRequest(BaseModel):
     """Episode 请求模型"""
     episode_id: Optional[int] = Field(None, description="Episode ID，如果不提供则从 JSON 中读取")
     episode_data: Optional[Dict[str, Any]] = Field(None, description="Episode JSON 数据")
+    force: bool = Field(False, description="忽略增量渲染清单，重建全部图片、配音和视频")
+    encode: Optional[EncodeOptions] = Field(None, description="视频编码参数")
+    hls: bool = Field(False, description="同时输出 HLS，渲染过程中即可通过 /api/v1/episodes/{episode_id}/hls/master.m3u8 播放")
+    quality: str = Field(
+        "final",
+        description="final（完整渲染）或 draft（快速预览：只用已有的图片和配音，缺失的用占位画面和静音，低分辨率、低帧率）",
+    )
 
 
 class EpisodeResponse(BaseModel):
@@ -33,13 +67,15 @@ class SRTResponse(BaseModel):
 
 class VideoResponse(BaseModel):
     """视频渲染响应模型"""
-    video_path: str = Field(description="视频文件路径")
+    video_path: str = Field(description="视频文件路径（第一个输出档位）")
+    renditions: Dict[str, str] = Field(default_factory=dict, description="各输出档位的视频文件路径")
     message: str = Field(description="处理结果消息")
 
 
 class AudioResponse(BaseModel):
     """音频生成响应模型"""
     audio_files: List[str] = Field(description="生成的音频文件路径列表")
+    audio_track: Optional[str] = Field(None, description="整集音轨路径（启用 AUDIO_TRACK 时），各镜头的位置见同名 .json 索引")
     message: str = Field(description="处理结果消息")
 
 
@@ -48,3 +84,39 @@ class HealthResponse(BaseModel):
     status: str = Field(description="服务状态")
     version: str = Field(description="服务版本")
 
+
+class ComfyStatsResponse(BaseModel):
+    """ComfyUI 传输层统计响应模型"""
+    phases: Dict[str, Dict[str, float]] = Field(description="按阶段（submit/history/view/queue）统计的请求次数、错误数和延迟")
+    circuits: Dict[str, str] = Field(description="各 ComfyUI 后端的熔断器状态（closed/open/half_open）")
+    schedulers: Dict[str, Dict[str, int]] = Field(
+        default_factory=dict,
+        description="各 ComfyUI 后端的 checkpoint 亲和性调度统计（放行数、模型切换数、节省的切换数）",
+    )
+
+
+class FFmpegStatsResponse(BaseModel):
+    """ffmpeg 编码速度统计响应模型"""
+    labels: Dict[str, Dict[str, Any]] = Field(
+        description="按用途（segment/concat/frame/hls/audio 等）统计的运行次数、失败次数、输出媒体时长、耗时和速度（实时倍数）"
+    )
+
+
+class JobResponse(BaseModel):
+    """后台渲染任务状态响应模型"""
+    job_id: str = Field(description="任务 ID")
+    kind: str = Field(description="任务类型")
+    params: Dict[str, Any] = Field(default_factory=dict, description="任务参数")
+    status: str = Field(description="任务状态（queued/running/succeeded/failed/cancelled）")
+    stage: Optional[str] = Field(None, description="当前执行的阶段（images/srt/audio/video）")
+    stages: Dict[str, Dict[str, Any]] = Field(default_factory=dict, description="各阶段的状态、开始/结束时间和耗时（秒）")
+    shots: Dict[str, Dict[str, Any]] = Field(default_factory=dict, description="各 shot 的进度（图片/音频状态和采样进度）")
+    ffmpeg: Dict[str, Any] = Field(
+        default_factory=dict,
+        description="正在运行的 ffmpeg 进度（running）和按用途累计的编码速度（totals）",
+    )
+    artifacts: Optional[Dict[str, Any]] = Field(None, description="任务完成后的产物路径（图片、字幕、音频、视频）")
+    error: Optional[str] = Field(None, description="失败原因")
+    created_at: float = Field(description="创建时间（Unix 时间戳）")
+    started_at: Optional[float] = Field(None, description="开始时间（Unix 时间戳）")
+    finished_at: Optional[float] = Field(None, description="结束时间（Unix 时间戳）")
@@ -1,9 +1,19 @@
 # comfy package
 from .client import ComfyUIClient
-from .workflow import inject
+from .pool import ComfyUIPool
+from .scheduler import AffinityScheduler
+from .transport import HTTPTransport, Timeouts, get_default_transport
+from .workflow import CompiledWorkflow, inject, load_template
 
 __all__ = [
+    "AffinityScheduler",
     "ComfyUIClient",
+    "CompiledWorkflow",
+    "ComfyUIPool",
+    "HTTPTransport",
+    "Timeouts",
+    "get_default_transport",
     "inject",
+    "load_template",
 ]
 
@@ -0,0 +1,100 @@
+"""把多个 shot 合并成一个 ComfyUI prompt"""
+from typing import Dict, Any, List, Tuple
+
+from .workflow import CompiledWorkflow
+
+# 每个 shot 各不相同、不影响能否合批的占位符
+PER_ITEM_PLACEHOLDERS = ("prompt", "seed", "output")
+
+
+def batch_group_key(values: Dict[str, Any]) -> Tuple:
+    """
+    合批分组 key：除 prompt/seed/output 外的占位符值全部相同的 shot 才能放进同一个 prompt
+
+    模板中的 checkpoint 和分辨率对所有 shot 相同，通过 workflow_params 覆盖时会体现在这里。
+    """
+    return tuple(sorted(
+        (name, repr(value)) for name, value in values.items() if name not in PER_ITEM_PLACEHOLDERS
+    ))
+
+
+def _links(inputs: Dict[str, Any]):
+    """节点 inputs 中指向其他节点的连线 [node_id, output_index]"""
+    for name, value in inputs.items():
+        if isinstance(value, list) and len(value) == 2 and isinstance(value[0], str):
+            yield name, value
+
+
+def build_batch(
+    template: CompiledWorkflow,
+    items: List[Dict[str, Any]],
+) -> Tuple[Dict[str, Any], Dict[str, List[int]]]:
+    """
+    为一组兼容的 shot 构建一个 prompt
+
+    - 各 shot 只有 seed/output 不同：使用 seed 偏移批次，把 EmptyLatentImage 的 batch_size
+      设为 shot 数，以第一个 shot 的 seed 为基准（ComfyUI 按批次序号派生每张图的噪声），
+      一次采样得到全部图片
+    - prompt 也不同：逐 shot 复制依赖这些占位符的节点（文本编码、采样、解码、保存），
+      checkpoint 加载、负面提示词等共享节点只保留一份，每个 shot 使用自己的正向条件
+
+    Args:
+        template: 编译后的 workflow 模板
+        items: 每个 shot 的占位符取值（同 CompiledWorkflow.render 的参数）
+
+    Returns:
+        (workflow, {SaveImage 节点 id: 按输出顺序对应的 items 下标列表})
+    """
+    rendered = [template.render(**values) for values in items]
+    prompt0 = rendered[0]["prompt"]
+    save_nodes = [node_id for node_id, node in prompt0.items() if node.get("class_type") == "SaveImage"]
+    latent_nodes = [
+        node_id for node_id, node in prompt0.items()
+        if node.get("class_type") == "EmptyLatentImage" and "batch_size" in node.get("inputs", {})
+    ]
+
+    if len(items) == 1:
+        return rendered[0], {node_id: [0] for node_id in save_nodes}
+
+    same_conditioning = all(
+        {k: v for k, v in values.items() if k not in ("seed", "output")}
+        == {k: v for k, v in items[0].items() if k not in ("seed", "output")}
+        for values in items
+    )
+    if same_conditioning and len(latent_nodes) == 1 and len(save_nodes) == 1:
+        prompt = dict(prompt0)
+        latent = prompt[latent_nodes[0]]
+        prompt[latent_nodes[0]] = {**latent, "inputs": {**latent["inputs"], "batch_size": len(items)}}
+        return {**rendered[0], "prompt": prompt}, {save_nodes[0]: list(range(len(items)))}
+
+    # 找出取值随 shot 变化的占位符所在节点，以及所有下游节点
+    varying = {
+        name for name in template.slots
+        if name == "output" or any(values.get(name) != items[0].get(name) for values in items)
+    }
+    per_item = {node_id for name in varying for node_id, _ in template.slots[name]}
+    changed = True
+    while changed:
+        changed = False
+        for node_id, node in prompt0.items():
+            if node_id in per_item:
+                continue
+            if any(link[0] in per_item for _, link in _links(node.get("inputs", {}))):
+                per_item.add(node_id)
+                changed = True
+
+    prompt: Dict[str, Any] = {node_id: node for node_id, node in prompt0.items() if node_id not in per_item}
+    outputs: Dict[str, List[int]] = {}
+    for index, workflow in enumerate(rendered):
+        for node_id in per_item:
+            node = workflow["prompt"][node_id]
+            inputs = dict(node["inputs"])
+            for name, link in _links(inputs):
+                if link[0] in per_item:
+                    inputs[name] = [f"{link[0]}_{index}", link[1]]
+            new_id = f"{node_id}_{index}"
+            prompt[new_id] = {**node, "inputs": inputs}
+            if node.get("class_type") == "SaveImage":
+                outputs[new_id] = [index]
+
+    return {**rendered[0], "prompt": prompt}, outputs
@@ -1,26 +1,101 @@
+import json
 import time
-import requests
+import uuid
 from pathlib import Path
-from typing import Optional
+from typing import Optional, Dict, Any, Callable, Iterator, List, Tuple, TYPE_CHECKING
+
+from .transport import HTTPTransport, get_default_transport
+
+if TYPE_CHECKING:
+    from .scheduler import AffinityScheduler
+
+try:
+    # websockets 随 uvicorn[standard] 一起安装；不可用时退回 /history 轮询
+    from websockets.sync.client import connect as ws_connect
+    from websockets.exceptions import WebSocketException
+except ImportError:
+    ws_connect = None
+    WebSocketException = Exception
+
+
+ProgressCallback = Callable[[int, int], None]
+
 
 class ComfyUIClient:
-    def __init__(self, base_url: str, comfy_root: Optional[str] = None):
+    # /history 轮询的指数退避参数（仅在 WebSocket 不可用时使用）
+    POLL_INITIAL_INTERVAL = 0.1
+    POLL_MAX_INTERVAL = 2.0
+    POLL_BACKOFF = 2.0
+    # WebSocket 握手超时（秒）
+    WS_OPEN_TIMEOUT = 5
+    # 等待事件时检查提交失败的间隔（秒）
+    FAILURE_CHECK_INTERVAL = 1.0
+
+    def __init__(
+        self,
+        base_url: str,
+        comfy_root: Optional[str] = None,
+        use_websocket: bool = True,
+        transport: Optional[HTTPTransport] = None,
+        scheduler: Optional["AffinityScheduler"] = None,
+    ):
         """
         初始化 ComfyUI 客户端
-        
+
         Args:
             base_url: ComfyUI 服务地址（如 "http://127.0.0.1:8188"）
             comfy_root: ComfyUI 根目录（已废弃，保留用于兼容性，不再使用）
+            use_websocket: 是否通过 /ws 事件等待任务完成（失败时自动回退到轮询）
+            transport: HTTP 传输层，默认使用进程内共享的连接池
+            scheduler: checkpoint 亲和性调度器，提供时 submit 先进入调度队列再由调度器提交
         """
         self.base_url = base_url.rstrip('/')
+        self.use_websocket = use_websocket
+        self.transport = transport or get_default_transport()
+        self.scheduler = scheduler
+        # ComfyUI 按 client_id 推送执行事件，每个客户端实例使用独立的 id
+        self.client_id = uuid.uuid4().hex
+        # 调度器提交失败的任务：prompt_id -> 异常，等待时抛出
+        self._failures: Dict[str, BaseException] = {}
+        # 调度器提交失败时的处理 (prompt_id, workflow, 异常)，None 时标记任务失败；后端池用它改投其他节点
+        self.on_submit_failed: Optional[Callable[[str, Dict[str, Any], BaseException], None]] = None
 
-    def submit(self, workflow):
+    def submit(self, workflow, prompt_id: Optional[str] = None):
         """
         提交 workflow 到 ComfyUI
-        
+
+        配置了调度器时只进入调度队列，返回预先分配的 prompt_id，可以立即等待。
+
+        Args:
+            workflow: workflow 对象，可以是完整对象（包含 "prompt" 键）或直接是 prompt 字典
+            prompt_id: 预先分配的任务 ID（如改投其他节点的任务沿用原 ID），None 表示自动分配
+
+        Returns:
+            prompt_id
+        """
+        if self.scheduler is not None:
+            return self.scheduler.submit(self, workflow, prompt_id=prompt_id)
+        return self.submit_now(workflow, prompt_id=prompt_id)
+
+    def submit_failed(self, prompt_id: str, workflow, error: BaseException):
+        """调度器提交失败时调用：交给 on_submit_failed 处理，未设置时标记任务失败"""
+        if self.on_submit_failed is None:
+            self.mark_failed(prompt_id, error)
+            return
+        try:
+            self.on_submit_failed(prompt_id, workflow, error)
+        except Exception as e:
+            print(f"警告: 处理提交失败的任务出错: {e}")
+            self.mark_failed(prompt_id, error)
+
+    def submit_now(self, workflow, prompt_id: Optional[str] = None):
+        """
+        立即提交 workflow 到 ComfyUI（绕过调度器）
+
         Args:
             workflow: workflow 对象，可以是完整对象（包含 "prompt" 键）或直接是 prompt 字典
-            
+            prompt_id: 预先分配的任务 ID，None 表示由 ComfyUI 分配
+
         Returns:
             prompt_id
         """
@@ -29,52 +104,300 @@ class ComfyUIClient:
             prompt_data = workflow["prompt"]
         else:
             prompt_data = workflow
-        
-        r = requests.post(
-            f"{self.base_url}/prompt",
-            json={"prompt": prompt_data},
-            timeout=10
-        )
+
+        body = {"prompt": prompt_data, "client_id": self.client_id}
+        if prompt_id is not None:
+            body["prompt_id"] = prompt_id
+        # 服务端可能已经收下 prompt 只是响应丢失，重发会重复排队，只在连接没有建立时重试
+        r = self.transport.post(f"{self.base_url}/prompt", "submit", idempotent=False, json=body)
         r.raise_for_status()
         return r.json()["prompt_id"]
 
+    def mark_failed(self, prompt_id: str, error: BaseException):
+        """标记任务失败（如调度器提交失败），正在等待该任务的调用方会收到 RuntimeError"""
+        self._failures[prompt_id] = error
+
+    def _raise_if_failed(self, prompt_ids):
+        for prompt_id in prompt_ids:
+            error = self._failures.pop(prompt_id, None)
+            if error is not None:
+                raise RuntimeError(f"ComfyUI 任务失败 ({prompt_id}): {error}") from error
+
+    def cancel(self, prompt_id: str):
+        """
+        取消任务：尚在调度队列中的直接移除，ComfyUI 队列中等待的删除，正在执行的中断
+
+        正在等待该任务的调用方会收到 RuntimeError。
+
+        Args:
+            prompt_id: ComfyUI 任务 ID
+        """
+        self.mark_failed(prompt_id, RuntimeError("任务已取消"))
+        if self.scheduler is not None and self.scheduler.cancel(prompt_id):
+            return
+
+        r = self.transport.post(f"{self.base_url}/queue", "queue", json={"delete": [prompt_id]})
+        r.raise_for_status()
+        r = self.transport.get(f"{self.base_url}/queue", "queue")
+        r.raise_for_status()
+        # queue_running 的每一项为 [number, prompt_id, prompt, extra, outputs]
+        running = [entry[1] for entry in r.json().get("queue_running", [])]
+        if prompt_id in running:
+            r = self.transport.post(f"{self.base_url}/interrupt", "interrupt", json={"prompt_id": prompt_id})
+            r.raise_for_status()
+
+    def wait_for_completion(
+        self,
+        prompt_id: str,
+        timeout: Optional[float] = None,
+        on_progress: Optional[ProgressCallback] = None,
+    ) -> Dict[str, Any]:
+        """
+        等待任务完成并返回其 history 记录
+
+        优先监听 /ws 的 executing/executed/progress 事件，任务结束后立即返回；
+        WebSocket 不可用时回退到指数退避的 /history 轮询。
+
+        Args:
+            prompt_id: ComfyUI 任务 ID
+            timeout: 最长等待时间（秒），None 表示使用传输层的任务时限
+            on_progress: 进度回调 (value, max)，仅 WebSocket 模式下触发
+
+        Returns:
+            history 中该任务的记录（包含 "outputs"）
+        """
+        callback = None
+        if on_progress is not None:
+            callback = lambda _pid, value, max_value: on_progress(value, max_value)
+        for _, entry in self.iter_completed([prompt_id], timeout=timeout, on_progress=callback):
+            return entry
+
+    def iter_completed(
+        self,
+        prompt_ids: List[str],
+        timeout: Optional[float] = None,
+        on_progress: Optional[Callable[[str, int, int], None]] = None,
+        use_websocket: Optional[bool] = None,
+    ) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        """
+        按完成顺序逐个产出任务的 history 记录
+
+        所有任务共用一条 /ws 连接（ComfyUI 每个 clientId 只保留一条连接），
+        WebSocket 不可用或中途断开时，剩余任务回退到 /history 轮询。
+
+        Args:
+            prompt_ids: ComfyUI 任务 ID 列表
+            timeout: 全部任务的最长等待时间（秒），None 表示按任务数乘以传输层的任务时限
+            on_progress: 进度回调 (prompt_id, value, max)，仅 WebSocket 模式下触发
+            use_websocket: 是否使用 /ws，None 时使用初始化参数；这个客户端已有 /ws 连接在等待其他任务时
+                应传 False（新连接会顶替旧连接，旧连接收不到事件）
+
+        Yields:
+            (prompt_id, history 记录)
+        """
+        pending = list(prompt_ids)
+        if timeout is None and self.transport.timeouts.job is not None:
+            # 任务在队列中依次执行，总时限随任务数增长
+            timeout = self.transport.timeouts.job * max(len(pending), 1)
+        deadline = time.monotonic() + timeout if timeout is not None else None
+
+        if use_websocket is None:
+            use_websocket = self.use_websocket
+        if use_websocket and ws_connect is not None and pending:
+            try:
+                for prompt_id, entry in self._iter_websocket(pending, deadline, on_progress):
+                    pending.remove(prompt_id)
+                    self._notify_scheduler()
+                    yield prompt_id, entry
+            except (OSError, WebSocketException) as e:
+                if self._expired(deadline):
+                    raise TimeoutError(f"等待任务超时: {pending}") from e
+                print(f"警告: WebSocket 不可用，回退到轮询: {e}")
+
+        for prompt_id, entry in self._poll_history(pending, deadline):
+            self._notify_scheduler()
+            yield prompt_id, entry
+
+    def _notify_scheduler(self):
+        if self.scheduler is not None:
+            self.scheduler.notify_completed()
+
+    def _ws_url(self) -> str:
+        """根据 base_url 构建 /ws 地址"""
+        if self.base_url.startswith("https://"):
+            ws_base = "wss://" + self.base_url[len("https://"):]
+        elif self.base_url.startswith("http://"):
+            ws_base = "ws://" + self.base_url[len("http://"):]
+        else:
+            ws_base = self.base_url
+        return f"{ws_base}/ws?clientId={self.client_id}"
+
+    @staticmethod
+    def _expired(deadline: Optional[float]) -> bool:
+        return deadline is not None and time.monotonic() >= deadline
+
+    def _fetch_history(self, prompt_id: str) -> Optional[Dict[str, Any]]:
+        """获取任务的 history 记录，任务未完成时返回 None"""
+        r = self.transport.get(f"{self.base_url}/history/{prompt_id}", "history")
+        if r.status_code != 200:
+            return None
+        return r.json().get(prompt_id)
+
+    def _iter_websocket(
+        self,
+        prompt_ids: List[str],
+        deadline: Optional[float],
+        on_progress: Optional[Callable[[str, int, int], None]],
+    ) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        """
+        通过 WebSocket 事件等待任务完成
+
+        事件表明已完成但 history 尚未写入的任务不会产出，留给调用方轮询。
+        """
+        prompt_ids = list(prompt_ids)
+        waiting = set(prompt_ids)
+        with ws_connect(self._ws_url(), open_timeout=self.WS_OPEN_TIMEOUT, max_size=None) as ws:
+            # ComfyUI 注册连接后会先推送一条 status 消息，收到它之后的事件才不会丢失
+            while True:
+                message = ws.recv(timeout=self.WS_OPEN_TIMEOUT)
+                if isinstance(message, str) and json.loads(message).get("type") == "status":
+                    break
+
+            # 连接建立前任务可能已经完成，先查一次 history 避免错过事件
+            for prompt_id in prompt_ids:
+                entry = self._fetch_history(prompt_id)
+                if entry is not None:
+                    waiting.discard(prompt_id)
+                    yield prompt_id, entry
+
+            while waiting:
+                self._raise_if_failed(waiting)
+                recv_timeout = self.FAILURE_CHECK_INTERVAL
+                if deadline is not None:
+                    recv_timeout = min(recv_timeout, max(deadline - time.monotonic(), 0))
+                try:
+                    message = ws.recv(timeout=recv_timeout)
+                except TimeoutError:
+                    if self._expired(deadline):
+                        raise TimeoutError(f"等待任务超时: {sorted(waiting)}")
+                    continue
+
+                # 二进制消息是预览图，忽略
+                if isinstance(message, bytes):
+                    continue
+
+                event = json.loads(message)
+                event_type = event.get("type")
+                data = event.get("data") or {}
+                prompt_id = data.get("prompt_id")
+                if prompt_id not in waiting:
+                    continue
+
+                if event_type == "progress":
+                    if on_progress is not None:
+                        on_progress(prompt_id, data.get("value", 0), data.get("max", 0))
+                elif event_type in ("execution_error", "execution_interrupted"):
+                    raise RuntimeError(
+                        f"ComfyUI 任务执行失败 ({event_type}): {data.get('exception_message', prompt_id)}"
+                    )
+                elif event_type == "executing" and data.get("node") is None:
+                    # node 为 None 表示整个 prompt 执行结束，此时 history 已写入
+                    waiting.discard(prompt_id)
+                    entry = self._fetch_history(prompt_id)
+                    if entry is not None:
+                        yield prompt_id, entry
+
+    def _poll_history(
+        self,
+        prompt_ids: List[str],
+        deadline: Optional[float],
+    ) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        """以指数退避轮询 /history 直到全部任务完成"""
+        pending = list(prompt_ids)
+        interval = self.POLL_INITIAL_INTERVAL
+        while pending:
+            self._raise_if_failed(pending)
+            for prompt_id in list(pending):
+                entry = self._fetch_history(prompt_id)
+                if entry is not None:
+                    pending.remove(prompt_id)
+                    # 有任务完成时重置退避，队列中的下一个任务可能很快结束
+                    interval = self.POLL_INITIAL_INTERVAL
+                    yield prompt_id, entry
+            if not pending:
+                break
+            if self._expired(deadline):
+                raise TimeoutError(f"等待任务超时: {pending}")
+            sleep_for = interval
+            if deadline is not None:
+                sleep_for = min(sleep_for, max(deadline - time.monotonic(), 0))
+            time.sleep(sleep_for)
+            interval = min(interval * self.POLL_BACKOFF, self.POLL_MAX_INTERVAL)
+
     def collect_and_cleanup(
         self,
         prompt_id: str,
         target_dir: str,
         expected_filename: Optional[str] = None,
+        timeout: Optional[float] = None,
+        on_progress: Optional[ProgressCallback] = None,
     ):
         """
         通过 HTTP API 收集图片（不依赖本地文件系统）
-        
+
         Args:
             prompt_id: ComfyUI 任务 ID
             target_dir: 目标目录
             expected_filename: 期望的文件名（如 "shot_1.png"），如果提供则重命名
-            
+            timeout: 最长等待时间（秒），None 表示使用传输层的任务时限
+            on_progress: 进度回调 (value, max)
+
         Returns:
             收集到的文件路径列表
         """
-        history_url = f"{self.base_url}/history/{prompt_id}"
-
         # 1. 等待任务完成
-        while True:
-            r = requests.get(history_url)
-            if r.status_code == 200:
-                history = r.json()
-                if prompt_id in history:
-                    break
-            time.sleep(1)
+        history = self.wait_for_completion(prompt_id, timeout=timeout, on_progress=on_progress)
+
+        return self.download_outputs(history, target_dir, expected_filename, prompt_id=prompt_id)
 
-        outputs = history[prompt_id]["outputs"]
+    def download_outputs(
+        self,
+        history: Dict[str, Any],
+        target_dir: str,
+        expected_filename: Optional[str] = None,
+        prompt_id: Optional[str] = None,
+        filename_map: Optional[Dict[str, List[str]]] = None,
+    ):
+        """
+        下载 history 记录中的全部输出图片
+
+        Args:
+            history: wait_for_completion 返回的 history 记录
+            target_dir: 目标目录
+            expected_filename: 期望的文件名（如 "shot_1.png"），如果提供则重命名
+            prompt_id: 任务 ID（单节点客户端不需要，与 ComfyUIPool 保持接口一致）
+            filename_map: {输出节点 id: 按输出顺序的文件名列表}，用于把合批 prompt 的图片
+                拆回各自的文件；提供时只下载其中列出的图片
+
+        Returns:
+            收集到的文件路径列表
+        """
+        outputs = history["outputs"]
         collected = []
 
-        for node in outputs.values():
-            for img in node.get("images", []):
+        for node_id, node in outputs.items():
+            images = node.get("images", [])
+            names: List[Optional[str]] = [expected_filename] * len(images)
+            if filename_map is not None:
+                names = list(filename_map.get(node_id, []))[:len(images)]
+                if len(names) < len(filename_map.get(node_id, [])):
+                    raise RuntimeError(f"节点 {node_id} 输出的图片数量不足: {len(images)}")
+
+            for img, name in zip(images, names):
                 filename = img["filename"]
                 subfolder = img.get("subfolder", "")
                 image_type = img.get("type", "output")  # output, input, temp
-                
+
                 # 2. 通过 HTTP API 下载图片
                 # ComfyUI 的图片查看 API: /view?filename=xxx&subfolder=xxx&type=output
                 view_params = {
@@ -83,29 +406,31 @@ class ComfyUIClient:
                 }
                 if subfolder:
                     view_params["subfolder"] = subfolder
-                
+
                 view_url = f"{self.base_url}/view"
-                img_response = requests.get(view_url, params=view_params, stream=True)
+                img_response = self.transport.get(view_url, "view", params=view_params, stream=True)
                 img_response.raise_for_status()
-                
+
                 # 3. 确定目标文件名
-                if expected_filename:
-                    dst = Path(target_dir) / expected_filename
+                if name:
+                    dst = Path(target_dir) / name
                 else:
                     dst = Path(target_dir) / filename
-                
+
                 # 确保目标目录存在
                 dst.parent.mkdir(parents=True, exist_ok=True)
-                
-                # 4. 保存图片
-                with open(dst, "wb") as f:
+
+                # 4. 保存图片（先写临时文件再替换，不会截断与缓存共享 inode 的旧文件）
+                tmp = dst.with_name(f".{dst.name}.part")
+                with open(tmp, "wb") as f:
                     for chunk in img_response.iter_content(chunk_size=8192):
                         f.write(chunk)
-                
+                tmp.replace(dst)
+
                 # 5. 验证文件已保存
                 if not dst.exists() or dst.stat().st_size == 0:
                     raise RuntimeError(f"下载失败: {dst}")
-                
+
                 collected.append(dst)
 
         return collected
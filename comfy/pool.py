@@ -0,0 +1,364 @@
+"""多 ComfyUI 后端池：按队列深度路由，自动剔除和恢复故障节点"""
+import queue
+import threading
+import time
+import requests
+from typing import Optional, Dict, Any, Callable, Iterator, List, Tuple
+
+from .client import ComfyUIClient, ProgressCallback
+from .scheduler import AffinityScheduler
+from .transport import HTTPTransport, get_default_transport
+
+
+class PromptRerouted(RuntimeError):
+    """调度器提交失败的任务已改投其他节点，原节点上的等待应转到新节点"""
+
+
+class ComfyNode:
+    """池中的单个 ComfyUI 节点及其健康状态"""
+
+    def __init__(self, client: ComfyUIClient):
+        self.client = client
+        self.healthy = True
+        self.consecutive_failures = 0
+        self.ejected_at = 0.0
+        # 最近一次 /queue 轮询得到的队列深度，以及之后本地提交的任务数
+        self.queue_depth = 0
+        self.queue_checked_at = 0.0
+        self.submitted_since_check = 0
+
+    @property
+    def base_url(self) -> str:
+        return self.client.base_url
+
+    @property
+    def load(self) -> int:
+        load = self.queue_depth + self.submitted_since_check
+        if self.client.scheduler is not None:
+            # 还在亲和性调度队列中、尚未提交到 ComfyUI 的任务
+            load += self.client.scheduler.pending_count()
+        return load
+
+
+class ComfyUIPool:
+    """
+    多个 ComfyUI 后端组成的池，接口与 ComfyUIClient 一致
+
+    每次提交路由到队列最短的健康节点；连续失败 max_failures 次的节点被剔除，
+    剔除 probe_interval 秒后通过 /queue 探测，成功则恢复。任务结果从实际执行的节点收集。
+    启用亲和性调度时提交先进入节点的调度队列，放行时提交失败的任务同样计入节点健康状态并改投其他节点。
+    """
+
+    # 等待的任务仍在调度队列中（可能即将改投）时，重新等待前的间隔（秒）
+    REROUTE_CHECK_INTERVAL = 0.1
+
+    def __init__(
+        self,
+        base_urls: List[str],
+        max_failures: int = 3,
+        probe_interval: float = 30.0,
+        queue_poll_interval: float = 0.5,
+        use_websocket: bool = True,
+        transport: Optional[HTTPTransport] = None,
+        checkpoint_affinity: bool = False,
+        affinity_inflight: int = 2,
+    ):
+        """
+        初始化后端池
+
+        Args:
+            base_urls: ComfyUI 服务地址列表
+            max_failures: 连续失败多少次后剔除节点
+            probe_interval: 被剔除节点的探测间隔（秒）
+            queue_poll_interval: /queue 深度缓存时间（秒），避免批量提交时反复轮询
+            use_websocket: 是否通过 /ws 事件等待任务完成
+            transport: HTTP 传输层，默认使用进程内共享的连接池
+            checkpoint_affinity: 是否为每个节点启用共享的 checkpoint 亲和性调度器
+            affinity_inflight: 亲和性调度时每个节点的 ComfyUI 队列中最多保留的任务数
+        """
+        urls = [url.strip() for url in base_urls if url and url.strip()]
+        if not urls:
+            raise ValueError("ComfyUI 后端地址列表不能为空")
+        self.transport = transport or get_default_transport()
+        self.nodes = [
+            ComfyNode(ComfyUIClient(
+                url,
+                use_websocket=use_websocket,
+                transport=self.transport,
+                scheduler=AffinityScheduler.shared(url, max_inflight=affinity_inflight) if checkpoint_affinity else None,
+            ))
+            for url in urls
+        ]
+        self.max_failures = max_failures
+        self.probe_interval = probe_interval
+        self.queue_poll_interval = queue_poll_interval
+        self._owners: Dict[str, ComfyNode] = {}
+        self._lock = threading.Lock()
+        for node in self.nodes:
+            if node.client.scheduler is not None:
+                node.client.on_submit_failed = (
+                    lambda prompt_id, workflow, error, node=node: self._reroute(node, prompt_id, workflow, error)
+                )
+
+    @property
+    def base_url(self) -> str:
+        return ",".join(node.base_url for node in self.nodes)
+
+    def _record_success(self, node: ComfyNode):
+        with self._lock:
+            node.consecutive_failures = 0
+            if not node.healthy:
+                print(f"ComfyUI 节点已恢复: {node.base_url}")
+            node.healthy = True
+
+    def _record_failure(self, node: ComfyNode, error: Exception):
+        with self._lock:
+            node.consecutive_failures += 1
+            if node.healthy and node.consecutive_failures >= self.max_failures:
+                node.healthy = False
+                node.ejected_at = time.monotonic()
+                print(f"警告: ComfyUI 节点连续失败 {node.consecutive_failures} 次，已剔除: {node.base_url} ({error})")
+            elif not node.healthy:
+                # 探测失败，重新计时
+                node.ejected_at = time.monotonic()
+
+    def _refresh_queue_depth(self, node: ComfyNode):
+        """通过 /queue 获取节点的队列深度（带缓存），失败计入节点健康状态"""
+        now = time.monotonic()
+        if node.healthy and now - node.queue_checked_at < self.queue_poll_interval:
+            return
+        try:
+            r = self.transport.get(f"{node.base_url}/queue", "queue", read_timeout=2, max_retries=0)
+            r.raise_for_status()
+            status = r.json()
+        except (requests.RequestException, ValueError) as e:
+            self._record_failure(node, e)
+            return
+        with self._lock:
+            node.queue_depth = len(status.get("queue_running", [])) + len(status.get("queue_pending", []))
+            node.queue_checked_at = now
+            node.submitted_since_check = 0
+        self._record_success(node)
+
+    def _candidates(self) -> List[ComfyNode]:
+        """返回按负载排序的可用节点；到期的被剔除节点会先被探测"""
+        now = time.monotonic()
+        for node in self.nodes:
+            if node.healthy or now - node.ejected_at >= self.probe_interval:
+                self._refresh_queue_depth(node)
+        healthy = [node for node in self.nodes if node.healthy]
+        return sorted(healthy, key=lambda node: node.load)
+
+    def healthy_nodes(self) -> List[str]:
+        """当前健康节点的地址列表"""
+        return [node.base_url for node in self.nodes if node.healthy]
+
+    def submit(self, workflow):
+        """
+        提交 workflow 到负载最低的健康节点
+
+        Args:
+            workflow: workflow 对象，可以是完整对象（包含 "prompt" 键）或直接是 prompt 字典
+
+        Returns:
+            prompt_id
+        """
+        return self._submit(workflow)
+
+    def _submit(self, workflow, prompt_id: Optional[str] = None, exclude: Optional[ComfyNode] = None) -> str:
+        last_error = None
+        for node in self._candidates():
+            if node is exclude:
+                continue
+            try:
+                submitted = node.client.submit(workflow, prompt_id=prompt_id)
+            except requests.RequestException as e:
+                self._record_failure(node, e)
+                last_error = e
+                continue
+            self._record_success(node)
+            with self._lock:
+                node.submitted_since_check += 1
+                self._owners[submitted] = node
+            return submitted
+        raise RuntimeError(f"没有可用的 ComfyUI 节点: {last_error}")
+
+    def _reroute(self, node: ComfyNode, prompt_id: str, workflow, error: BaseException):
+        """
+        调度器在 node 上提交失败：计入节点健康状态，沿用 prompt_id 改投其他节点
+
+        没有其他可用节点（或任务已取消）时把任务标记为失败；改投成功时通知原节点上的等待方转到新节点。
+        """
+        if isinstance(error, requests.RequestException):
+            self._record_failure(node, error)
+        with self._lock:
+            owned = self._owners.get(prompt_id) is node
+        if not owned:
+            node.client.mark_failed(prompt_id, error)
+            return
+        try:
+            self._submit(workflow, prompt_id=prompt_id, exclude=node)
+        except RuntimeError as e:
+            print(f"警告: ComfyUI 任务无法改投其他节点 ({prompt_id}): {e}")
+            node.client.mark_failed(prompt_id, error)
+            return
+        print(f"警告: ComfyUI 节点提交失败，任务已改投其他节点: {node.base_url} ({error})")
+        node.client.mark_failed(prompt_id, PromptRerouted(f"任务已改投其他节点: {prompt_id}"))
+
+    def _moved(self, node: ComfyNode, prompt_ids: List[str], error: BaseException) -> bool:
+        """
+        在 node 上等待 prompt_ids 出错时，判断是否应按任务的当前归属重新等待
+
+        任务已改投其他节点，或仍在 node 的调度队列中（提交失败后会改投）时返回 True。
+        """
+        if isinstance(error, RuntimeError) and isinstance(error.__cause__, PromptRerouted):
+            return True
+        if not isinstance(error, requests.RequestException):
+            return False
+        with self._lock:
+            if any(self._owners.get(prompt_id) is not node for prompt_id in prompt_ids):
+                return True
+        scheduler = node.client.scheduler
+        if scheduler is not None and any(scheduler.holds(prompt_id) for prompt_id in prompt_ids):
+            time.sleep(self.REROUTE_CHECK_INTERVAL)
+            return True
+        return False
+
+    @staticmethod
+    def _remaining(deadline: Optional[float]) -> Optional[float]:
+        return None if deadline is None else max(deadline - time.monotonic(), 0)
+
+    def cancel(self, prompt_id: str):
+        """在执行该任务的节点上取消任务，参数同 ComfyUIClient.cancel"""
+        node = self._owner(prompt_id)
+        node.client.cancel(prompt_id)
+        with self._lock:
+            self._owners.pop(prompt_id, None)
+
+    def _owner(self, prompt_id: str) -> ComfyNode:
+        with self._lock:
+            node = self._owners.get(prompt_id)
+        if node is None:
+            raise KeyError(f"未知的 prompt_id: {prompt_id}")
+        return node
+
+    def wait_for_completion(
+        self,
+        prompt_id: str,
+        timeout: Optional[float] = None,
+        on_progress: Optional[ProgressCallback] = None,
+    ) -> Dict[str, Any]:
+        """在执行该任务的节点上等待任务完成（任务改投其他节点时转到新节点），参数同 ComfyUIClient.wait_for_completion"""
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        while True:
+            node = self._owner(prompt_id)
+            try:
+                entry = node.client.wait_for_completion(
+                    prompt_id, timeout=self._remaining(deadline), on_progress=on_progress
+                )
+            except Exception as e:
+                if self._moved(node, [prompt_id], e):
+                    continue
+                if isinstance(e, requests.RequestException):
+                    self._record_failure(node, e)
+                raise
+            self._record_success(node)
+            return entry
+
+    def iter_completed(
+        self,
+        prompt_ids: List[str],
+        timeout: Optional[float] = None,
+        on_progress: Optional[Callable[[str, int, int], None]] = None,
+    ) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        """
+        按完成顺序逐个产出任务的 history 记录，各节点并行等待（任务改投其他节点时转到新节点）
+
+        参数同 ComfyUIClient.iter_completed
+        """
+        if not prompt_ids:
+            return
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        results: "queue.Queue[Tuple[str, Any, Optional[Exception]]]" = queue.Queue()
+        # 正在用 /ws 等待的节点：每个客户端只能有一条 /ws 连接，同一节点上的其他等待改用轮询
+        ws_nodes = set()
+        ws_lock = threading.Lock()
+
+        def watch_all(ids: List[str]):
+            groups: Dict[int, Tuple[ComfyNode, List[str]]] = {}
+            for prompt_id in ids:
+                node = self._owner(prompt_id)
+                groups.setdefault(id(node), (node, []))[1].append(prompt_id)
+            for node, group in groups.values():
+                threading.Thread(target=watch, args=(node, group), daemon=True).start()
+
+        def watch(node: ComfyNode, ids: List[str]):
+            waiting = list(ids)
+            with ws_lock:
+                use_websocket = id(node) not in ws_nodes
+                ws_nodes.add(id(node))
+
+            def release():
+                if use_websocket:
+                    with ws_lock:
+                        ws_nodes.discard(id(node))
+
+            try:
+                for prompt_id, entry in node.client.iter_completed(
+                    ids,
+                    timeout=self._remaining(deadline),
+                    on_progress=on_progress,
+                    use_websocket=None if use_websocket else False,
+                ):
+                    waiting.remove(prompt_id)
+                    results.put((prompt_id, entry, None))
+                self._record_success(node)
+            except Exception as e:
+                if self._moved(node, waiting, e):
+                    release()
+                    watch_all(waiting)
+                    return
+                if isinstance(e, requests.RequestException):
+                    self._record_failure(node, e)
+                results.put(("", None, e))
+            release()
+
+        watch_all(list(prompt_ids))
+
+        for _ in range(len(prompt_ids)):
+            prompt_id, entry, error = results.get()
+            if error is not None:
+                raise error
+            yield prompt_id, entry
+
+    def collect_and_cleanup(
+        self,
+        prompt_id: str,
+        target_dir: str,
+        expected_filename: Optional[str] = None,
+        timeout: Optional[float] = None,
+        on_progress: Optional[ProgressCallback] = None,
+    ):
+        """从执行该任务的节点收集图片，参数同 ComfyUIClient.collect_and_cleanup"""
+        history = self.wait_for_completion(prompt_id, timeout=timeout, on_progress=on_progress)
+        return self.download_outputs(history, target_dir, expected_filename, prompt_id=prompt_id)
+
+    def download_outputs(
+        self,
+        history: Dict[str, Any],
+        target_dir: str,
+        expected_filename: Optional[str] = None,
+        prompt_id: Optional[str] = None,
+        filename_map: Optional[Dict[str, List[str]]] = None,
+    ):
+        """从执行该任务的节点下载输出图片，参数同 ComfyUIClient.download_outputs"""
+        if prompt_id is None:
+            # ComfyUI history 记录的 "prompt" 字段为 [number, prompt_id, prompt, extra, outputs]
+            prompt_id = history["prompt"][1]
+        node = self._owner(prompt_id)
+        collected = node.client.download_outputs(
+            history, target_dir, expected_filename, prompt_id=prompt_id, filename_map=filename_map
+        )
+        with self._lock:
+            self._owners.pop(prompt_id, None)
+        return collected
@@ -0,0 +1,220 @@
+"""按 checkpoint 亲和性排序提交的调度器，减少 ComfyUI 切换模型"""
+import threading
+import uuid
+from typing import Optional, Dict, Any, List, Tuple, TYPE_CHECKING
+
+from .transport import get_default_transport
+
+if TYPE_CHECKING:
+    from .client import ComfyUIClient
+
+
+def workflow_checkpoints(workflow: Dict[str, Any]) -> Tuple[str, ...]:
+    """workflow 中 CheckpointLoaderSimple 加载的模型名（排序后的元组）"""
+    prompt = workflow["prompt"] if "prompt" in workflow else workflow
+    return tuple(sorted(
+        str(node.get("inputs", {}).get("ckpt_name"))
+        for node in prompt.values()
+        if node.get("class_type") == "CheckpointLoaderSimple"
+    ))
+
+
+class _Pending:
+    def __init__(self, client: "ComfyUIClient", workflow: Dict[str, Any], prompt_id: str):
+        self.client = client
+        self.workflow = workflow
+        self.prompt_id = prompt_id
+        self.checkpoints = workflow_checkpoints(workflow)
+        # 因为亲和性被后来者插队的次数
+        self.skipped = 0
+
+
+class AffinityScheduler:
+    """
+    在 ComfyUIClient.submit 前排队的调度器（每个 ComfyUI 后端共享一个实例）
+
+    提交先进入本地队列，后台线程只在 ComfyUI 队列深度低于 max_inflight 时放行；
+    放行时优先选择与上一个放行的 prompt 使用相同 checkpoint 的任务，使同一模型的任务
+    连续执行。一个任务最多被插队 max_skips 次，之后必须放行，避免任何 episode 饿死。
+    prompt_id 在入队时由客户端生成并随 /prompt 提交，调用方可以立即开始等待。
+    """
+
+    _shared: Dict[str, "AffinityScheduler"] = {}
+    _shared_lock = threading.Lock()
+
+    def __init__(
+        self,
+        base_url: str,
+        max_inflight: int = 2,
+        max_skips: int = 8,
+        poll_interval: float = 0.2,
+    ):
+        """
+        初始化调度器
+
+        Args:
+            base_url: ComfyUI 服务地址
+            max_inflight: 允许同时留在 ComfyUI 队列中的任务数（运行中 + 等待中）
+            max_skips: 单个任务最多被插队的次数（公平性上限）
+            poll_interval: ComfyUI 队列已满时轮询 /queue 的间隔（秒）
+        """
+        self.base_url = base_url.rstrip('/')
+        self.max_inflight = max_inflight
+        self.max_skips = max_skips
+        self.poll_interval = poll_interval
+        self.transport = get_default_transport()
+
+        self._pending: List[_Pending] = []
+        self._cond = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+        # 已放行、提交请求（或失败处理）尚未结束的任务
+        self._submitting: set = set()
+        self._last_checkpoints: Optional[Tuple[str, ...]] = None
+        self._last_arrival: Optional[Tuple[str, ...]] = None
+        self._stats = {"submitted": 0, "released": 0, "swaps": 0, "fifo_swaps": 0, "forced": 0}
+
+    @classmethod
+    def shared(cls, base_url: str, **kwargs: Any) -> "AffinityScheduler":
+        """
+        获取后端共享的调度器，同一 ComfyUI 的所有 episode 任务在一个队列中排序
+
+        Args:
+            base_url: ComfyUI 服务地址
+            **kwargs: 调度器参数（同 __init__），调度器已存在时更新为新的取值
+        """
+        key = base_url.rstrip('/')
+        with cls._shared_lock:
+            if key not in cls._shared:
+                cls._shared[key] = cls(key, **kwargs)
+            else:
+                for name, value in kwargs.items():
+                    setattr(cls._shared[key], name, value)
+            return cls._shared[key]
+
+    @classmethod
+    def all_stats(cls) -> Dict[str, Dict[str, int]]:
+        with cls._shared_lock:
+            schedulers = list(cls._shared.values())
+        return {scheduler.base_url: scheduler.stats() for scheduler in schedulers}
+
+    def submit(self, client: "ComfyUIClient", workflow: Dict[str, Any], prompt_id: Optional[str] = None) -> str:
+        """
+        把 workflow 放入本地队列，返回预先分配的 prompt_id
+
+        Args:
+            client: 发起提交的客户端（放行时用它提交，事件推送到它的 client_id；失败时交给它的 submit_failed）
+            workflow: 待提交的 workflow
+            prompt_id: 任务 ID，None 表示新分配
+
+        Returns:
+            prompt_id
+        """
+        item = _Pending(client, workflow, prompt_id or uuid.uuid4().hex)
+        with self._cond:
+            # 按到达顺序（FIFO）提交时会发生的模型切换次数，用于计算节省的切换
+            if self._last_arrival is not None and item.checkpoints != self._last_arrival:
+                self._stats["fifo_swaps"] += 1
+            self._last_arrival = item.checkpoints
+            self._stats["submitted"] += 1
+            self._pending.append(item)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="comfy-affinity-scheduler", daemon=True)
+                self._thread.start()
+            self._cond.notify()
+        return item.prompt_id
+
+    def cancel(self, prompt_id: str) -> bool:
+        """从本地队列移除尚未放行的任务，返回是否移除成功"""
+        with self._cond:
+            for item in self._pending:
+                if item.prompt_id == prompt_id:
+                    self._pending.remove(item)
+                    return True
+        return False
+
+    def notify_completed(self):
+        """客户端观察到任务完成时调用，调度线程立即检查是否可以放行下一个任务"""
+        with self._cond:
+            self._cond.notify()
+
+    def holds(self, prompt_id: str) -> bool:
+        """任务是否还在调度器中（尚未放行，或提交请求和失败处理尚未结束）"""
+        with self._cond:
+            return prompt_id in self._submitting or any(item.prompt_id == prompt_id for item in self._pending)
+
+    def pending_count(self) -> int:
+        with self._cond:
+            return len(self._pending)
+
+    def stats(self) -> Dict[str, int]:
+        """调度统计：放行数、实际模型切换数、FIFO 下的切换数和节省的切换数"""
+        with self._cond:
+            stats = dict(self._stats)
+            stats["pending"] = len(self._pending)
+        stats["swaps_avoided"] = max(stats["fifo_swaps"] - stats["swaps"], 0)
+        return stats
+
+    def _pick(self) -> Optional[_Pending]:
+        """选择下一个放行的任务（调用方持有锁）"""
+        if not self._pending:
+            return None
+        # 1. 被插队次数达到上限的任务优先
+        choice = next((item for item in self._pending if item.skipped >= self.max_skips), None)
+        if choice is not None:
+            self._stats["forced"] += 1
+        # 2. 与当前已加载模型相同的最早任务
+        if choice is None:
+            choice = next(
+                (item for item in self._pending if item.checkpoints == self._last_checkpoints),
+                self._pending[0],
+            )
+        index = self._pending.index(choice)
+        for item in self._pending[:index]:
+            item.skipped += 1
+        del self._pending[index]
+
+        if self._last_checkpoints is not None and choice.checkpoints != self._last_checkpoints:
+            self._stats["swaps"] += 1
+        self._last_checkpoints = choice.checkpoints
+        self._stats["released"] += 1
+        return choice
+
+    def _queue_depth(self) -> int:
+        try:
+            r = self.transport.get(f"{self.base_url}/queue", "queue", read_timeout=2, max_retries=0)
+            r.raise_for_status()
+            status = r.json()
+        except Exception as e:
+            # 拿不到队列深度时照常放行，由提交请求本身暴露错误
+            print(f"警告: 获取 ComfyUI 队列深度失败: {e}")
+            return 0
+        return len(status.get("queue_running", [])) + len(status.get("queue_pending", []))
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+
+            free = self.max_inflight - self._queue_depth()
+            if free <= 0:
+                # 等待任务完成通知；其他进程的任务完成时没有通知，靠超时轮询兜底
+                with self._cond:
+                    self._cond.wait(self.poll_interval)
+                continue
+
+            for _ in range(free):
+                with self._cond:
+                    item = self._pick()
+                    if item is not None:
+                        self._submitting.add(item.prompt_id)
+                if item is None:
+                    break
+                try:
+                    item.client.submit_now(item.workflow, prompt_id=item.prompt_id)
+                except Exception as e:
+                    print(f"警告: 提交 ComfyUI 任务失败: {e}")
+                    item.client.submit_failed(item.prompt_id, item.workflow, e)
+                finally:
+                    with self._cond:
+                        self._submitting.discard(item.prompt_id)
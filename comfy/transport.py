@@ -0,0 +1,260 @@
+"""ComfyUI HTTP 传输层：连接池、分阶段超时、抖动重试、熔断和延迟统计"""
+import random
+import threading
+import time
+from dataclasses import dataclass
+from typing import Optional, Dict, Any
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
+
+
+class CircuitOpenError(requests.ConnectionError):
+    """熔断器打开时拒绝请求"""
+
+
+@dataclass
+class Timeouts:
+    """分阶段超时（秒）"""
+    connect: float = 3.05
+    read: float = 30.0
+    # 单个任务从提交到完成的总时限，None 表示不限制
+    job: Optional[float] = 900.0
+
+
+class CircuitBreaker:
+    """
+    按后端计数的熔断器
+
+    连续失败 failure_threshold 次后打开，reset_timeout 秒内直接拒绝请求；
+    之后进入半开状态放行一个探测请求，成功则关闭，失败则重新打开。
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 15.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half_open"
+        return "open"
+
+    def allow(self) -> bool:
+        with self._lock:
+            state = self.state
+            if state == "closed":
+                return True
+            if state == "half_open" and not self._probing:
+                self._probing = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self._probing or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+            self._probing = False
+
+
+class LatencyStats:
+    """按阶段（submit/history/view/queue 等）统计请求次数、耗时和错误数"""
+
+    def __init__(self):
+        self._phases: Dict[str, Dict[str, float]] = {}
+        self._lock = threading.Lock()
+
+    def record(self, phase: str, seconds: float, ok: bool = True, retried: bool = False):
+        with self._lock:
+            stats = self._phases.setdefault(
+                phase, {"count": 0, "errors": 0, "retries": 0, "total_seconds": 0.0, "max_seconds": 0.0}
+            )
+            stats["count"] += 1
+            stats["total_seconds"] += seconds
+            stats["max_seconds"] = max(stats["max_seconds"], seconds)
+            if not ok:
+                stats["errors"] += 1
+            if retried:
+                stats["retries"] += 1
+
+    def snapshot(self) -> Dict[str, Dict[str, float]]:
+        with self._lock:
+            result = {}
+            for phase, stats in self._phases.items():
+                result[phase] = dict(stats)
+                result[phase]["avg_seconds"] = stats["total_seconds"] / stats["count"] if stats["count"] else 0.0
+            return result
+
+    def reset(self):
+        with self._lock:
+            self._phases.clear()
+
+
+class HTTPTransport:
+    """
+    基于 requests.Session 的共享 HTTP 传输
+
+    复用 keep-alive 连接，对 5xx 和连接错误做带抖动的指数退避重试，
+    每个后端独立熔断，并记录每个阶段的请求延迟。
+    """
+
+    RETRY_STATUS = {500, 502, 503, 504}
+
+    def __init__(
+        self,
+        pool_size: int = 16,
+        timeouts: Optional[Timeouts] = None,
+        max_retries: int = 3,
+        backoff_base: float = 0.2,
+        backoff_max: float = 5.0,
+        failure_threshold: int = 5,
+        reset_timeout: float = 15.0,
+    ):
+        """
+        初始化传输层
+
+        Args:
+            pool_size: 每个后端的连接池大小，应不小于并发下载/提交的线程数
+            timeouts: 分阶段超时配置
+            max_retries: 单个请求的最大重试次数
+            backoff_base: 重试退避基数（秒）
+            backoff_max: 单次退避上限（秒）
+            failure_threshold: 熔断前允许的连续失败次数
+            reset_timeout: 熔断打开后多久进入半开状态（秒）
+        """
+        self.timeouts = timeouts or Timeouts()
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.stats = LatencyStats()
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        self._breakers: Dict[str, CircuitBreaker] = {}
+        self._lock = threading.Lock()
+
+    def breaker(self, url: str) -> CircuitBreaker:
+        """获取 url 所在后端的熔断器"""
+        parts = urlsplit(url)
+        key = f"{parts.scheme}://{parts.netloc}"
+        with self._lock:
+            if key not in self._breakers:
+                self._breakers[key] = CircuitBreaker(self.failure_threshold, self.reset_timeout)
+            return self._breakers[key]
+
+    def circuit_states(self) -> Dict[str, str]:
+        with self._lock:
+            return {key: breaker.state for key, breaker in self._breakers.items()}
+
+    @staticmethod
+    def _not_sent(error: Exception) -> bool:
+        """连接没有建立（连接超时、连接被拒绝），请求不可能到达服务端"""
+        if isinstance(error, requests.ConnectTimeout):
+            return True
+        reason = getattr(error.args[0], "reason", None) if error.args else None
+        return isinstance(reason, NewConnectionError)
+
+    def _backoff(self, attempt: int) -> float:
+        # full jitter：在 [0, min(max, base * 2^attempt)] 内均匀取值
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    def request(
+        self,
+        method: str,
+        url: str,
+        phase: str,
+        read_timeout: Optional[float] = None,
+        max_retries: Optional[int] = None,
+        idempotent: bool = True,
+        **kwargs: Any,
+    ) -> requests.Response:
+        """
+        发送请求
+
+        Args:
+            method: HTTP 方法
+            url: 完整 URL
+            phase: 统计用的阶段名（如 "submit"、"history"、"view"）
+            read_timeout: 覆盖默认读超时
+            max_retries: 覆盖默认重试次数（健康探测等场景传 0）
+            idempotent: 请求是否可以重复发送。为 False 时（如 POST /prompt，重复发送会重复排队）
+                只在连接没有建立时重试，读超时、连接中断和 5xx 都不重试
+            **kwargs: 透传给 requests.Session.request
+
+        Returns:
+            响应对象（5xx 重试耗尽后返回最后一次响应，由调用方决定是否 raise_for_status）
+        """
+        breaker = self.breaker(url)
+        timeout = (self.timeouts.connect, read_timeout if read_timeout is not None else self.timeouts.read)
+        retries = self.max_retries if max_retries is None else max_retries
+
+        attempt = 0
+        while True:
+            if not breaker.allow():
+                self.stats.record(phase, 0.0, ok=False)
+                raise CircuitOpenError(f"ComfyUI 熔断中，暂停请求: {url}")
+
+            start = time.monotonic()
+            try:
+                response = self.session.request(method, url, timeout=timeout, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                elapsed = time.monotonic() - start
+                breaker.record_failure()
+                self.stats.record(phase, elapsed, ok=False, retried=attempt > 0)
+                if attempt >= retries or not (idempotent or self._not_sent(e)):
+                    raise
+                print(f"警告: {phase} 请求失败，第 {attempt + 1} 次重试: {e}")
+            else:
+                elapsed = time.monotonic() - start
+                ok = response.status_code not in self.RETRY_STATUS
+                self.stats.record(phase, elapsed, ok=ok, retried=attempt > 0)
+                if ok:
+                    breaker.record_success()
+                    return response
+                breaker.record_failure()
+                if attempt >= retries or not idempotent:
+                    return response
+                response.close()
+                print(f"警告: {phase} 请求返回 {response.status_code}，第 {attempt + 1} 次重试")
+
+            time.sleep(self._backoff(attempt))
+            attempt += 1
+
+    def get(self, url: str, phase: str, **kwargs: Any) -> requests.Response:
+        return self.request("GET", url, phase, **kwargs)
+
+    def post(self, url: str, phase: str, **kwargs: Any) -> requests.Response:
+        return self.request("POST", url, phase, **kwargs)
+
+
+_default_transport: Optional[HTTPTransport] = None
+_default_lock = threading.Lock()
+
+
+def get_default_transport() -> HTTPTransport:
+    """进程内共享的默认传输层（API 每个请求都会新建 ComfyUIClient，共享它才能复用连接）"""
+    global _default_transport
+    with _default_lock:
+        if _default_transport is None:
+            _default_transport = HTTPTransport()
+        return _default_transport
@@ -1,8 +1,108 @@
-from typing import Dict, Any
-import copy
+from typing import Dict, Any, List, Tuple, Union
+import json
+import re
+import threading
 from pathlib import Path
 
 
+# 占位符形如 "__PROMPT__"、"__SEED__"、"__WIDTH__"，名称对应 render() 的小写参数名
+PLACEHOLDER_RE = re.compile(r"^__([A-Z][A-Z0-9_]*)__$")
+
+
+class CompiledWorkflow:
+    """
+    预编译的 workflow 模板
+
+    编译时扫描一次全部节点，记录每个占位符所在的 (node_id, input 名)；
+    render 时只复制并修改这些节点，其余节点与模板共享（调用方不应原地修改返回值中的节点）。
+    """
+
+    def __init__(self, workflow: Dict[str, Any]):
+        """
+        编译 workflow
+
+        Args:
+            workflow: workflow JSON 对象（包含 "prompt" 键）
+        """
+        self.workflow = workflow
+        # 占位符名（小写） -> [(node_id, input 名), ...]
+        self.slots: Dict[str, List[Tuple[str, str]]] = {}
+        for node_id, node in workflow["prompt"].items():
+            for input_name, value in node.get("inputs", {}).items():
+                if not isinstance(value, str):
+                    continue
+                match = PLACEHOLDER_RE.match(value)
+                if match:
+                    self.slots.setdefault(match.group(1).lower(), []).append((node_id, input_name))
+
+    @property
+    def placeholders(self) -> List[str]:
+        """模板中出现的占位符名（小写）"""
+        return list(self.slots)
+
+    def render(self, strict: bool = True, **values: Any) -> Dict[str, Any]:
+        """
+        用给定的值填充占位符，生成可提交的 workflow
+
+        Args:
+            strict: 为 True 时模板中的占位符必须全部提供，否则保留未提供的占位符原样
+            **values: 占位符的值，如 prompt="...", seed=1, output="assets/images/shot_1.png", width=720
+
+        Returns:
+            填充后的 workflow
+        """
+        missing = [name for name in self.slots if name not in values]
+        if strict and missing:
+            raise KeyError(f"workflow 缺少占位符的值: {', '.join(missing)}")
+
+        if "output" in values:
+            # 移除扩展名，ComfyUI 会自动添加序号和扩展名
+            values["output"] = str(Path(values["output"]).with_suffix(''))
+
+        prompt = dict(self.workflow["prompt"])
+        patched_inputs: Dict[str, Dict[str, Any]] = {}
+        for name, slots in self.slots.items():
+            if name not in values:
+                continue
+            for node_id, input_name in slots:
+                if node_id not in patched_inputs:
+                    node = prompt[node_id]
+                    patched_inputs[node_id] = dict(node["inputs"])
+                    prompt[node_id] = {**node, "inputs": patched_inputs[node_id]}
+                patched_inputs[node_id][input_name] = values[name]
+
+        return {**self.workflow, "prompt": prompt}
+
+
+_template_cache: Dict[Path, Tuple[int, CompiledWorkflow]] = {}
+_template_lock = threading.Lock()
+
+
+def load_template(path: Union[str, Path]) -> CompiledWorkflow:
+    """
+    加载并编译 workflow 模板文件，按文件 mtime 缓存，文件修改后自动重新编译
+
+    Args:
+        path: workflow JSON 文件路径
+
+    Returns:
+        编译后的模板
+    """
+    path = Path(path).resolve()
+    mtime = path.stat().st_mtime_ns
+    with _template_lock:
+        cached = _template_cache.get(path)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+
+    with open(path, "r", encoding="utf-8") as f:
+        compiled = CompiledWorkflow(json.load(f))
+
+    with _template_lock:
+        _template_cache[path] = (mtime, compiled)
+    return compiled
+
+
 def inject(
     workflow: Dict[str, Any],
     prompt: str,
@@ -19,27 +119,6 @@ def inject(
         output: 输出文件路径前缀
 
     Returns:
-        注入后的 workflow
+        注入后的 workflow（不修改原始对象）
     """
-    # 深拷贝避免修改原始对象
-    workflow = copy.deepcopy(workflow)
-
-    for node in workflow["prompt"].values():
-        inputs = node.get("inputs", {})
-
-        # 检查并替换 prompt
-        if inputs.get("text") == "__PROMPT__":
-            inputs["text"] = prompt
-
-        # 检查并替换 seed（检查值而不是键）
-        if inputs.get("seed") == "__SEED__":
-            inputs["seed"] = seed
-
-        # 检查并替换 output（检查值而不是键）
-        if inputs.get("filename_prefix") == "__OUTPUT__":
-            # 移除扩展名，ComfyUI 会自动添加序号和扩展名
-            output_path = Path(output)
-            inputs["filename_prefix"] = str(output_path.with_suffix(''))
-
-    return workflow
-
+    return CompiledWorkflow(workflow).render(strict=False, prompt=prompt, seed=seed, output=output)
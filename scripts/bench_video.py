@@ -0,0 +1,113 @@
+"""
+视频渲染基准测试
+
+用同一组合成输入（ffmpeg testsrc2 生成的图片、每个镜头两句字幕、可选正弦波配音）分别以
+单进程 filter_complex 方式（mode="filter"）、分片并行逐帧编码（standard 档位）、分片并行
+静态画面编码（still 档位）和快速预览（quality="draft"）渲染（不使用片段缓存），比较耗时并校验输出时长。
+
+用法:
+    python -m scripts.bench_video --shots 24 --duration 5 --workers 4
+"""
+import argparse
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+from pathlib import Path
+
+from services.srt_service import format_srt
+from services.video_service import VideoService, probe_duration
+
+
+def make_inputs(work_dir: Path, shots: int, duration: float, audio: bool):
+    """生成合成的图片、字幕和配音"""
+    images = []
+    audio_files = []
+    cues = []
+    for i in range(shots):
+        image = work_dir / f"shot_{i + 1}.png"
+        subprocess.run(
+            [
+                "ffmpeg", "-y", "-v", "error",
+                "-f", "lavfi", "-i", f"testsrc2=size=1024x1536:rate=1,hue=h={i * 37 % 360}",
+                "-frames:v", "1", str(image),
+            ],
+            check=True,
+        )
+        images.append(image)
+        if audio:
+            audio_file = work_dir / f"shot_{i + 1}.mp3"
+            subprocess.run(
+                [
+                    "ffmpeg", "-y", "-v", "error",
+                    "-f", "lavfi", "-i", f"sine=frequency={220 + i * 20}:duration={duration * 0.8}",
+                    str(audio_file),
+                ],
+                check=True,
+            )
+            audio_files.append(audio_file)
+        start = i * duration
+        cues.append((start + 0.2, start + duration / 2, f"第 {i + 1} 个镜头的第一句字幕"))
+        cues.append((start + duration / 2, start + duration - 0.2, f"第 {i + 1} 个镜头的第二句字幕"))
+
+    srt_path = work_dir / "bench.srt"
+    srt_path.write_text(format_srt(cues), encoding="utf-8")
+    return images, [duration] * shots, srt_path, audio_files or None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="比较单进程与分片并行的视频渲染耗时")
+    parser.add_argument("--shots", type=int, default=24, help="镜头数")
+    parser.add_argument("--duration", type=float, default=5.0, help="每个镜头的时长（秒）")
+    parser.add_argument("--workers", type=int, default=None, help="并行编码的 ffmpeg 进程数，默认 CPU 核数的一半")
+    parser.add_argument("--threads", type=int, default=None, help="每个 ffmpeg 进程的编码线程数")
+    parser.add_argument("--no-audio", action="store_true", help="不生成配音")
+    parser.add_argument("--keep", action="store_true", help="保留临时目录")
+    args = parser.parse_args()
+
+    work_dir = Path(tempfile.mkdtemp(prefix="bench_video_"))
+    try:
+        images, durations, srt_path, audio_files = make_inputs(
+            work_dir, args.shots, args.duration, not args.no_audio
+        )
+        expected = sum(durations)
+        print(f"输入: {args.shots} 个镜头，共 {expected:.1f}s，CPU 核数 {os.cpu_count()}")
+
+        runs = [
+            ("filter", "filter", VideoService(cache_max_bytes=0, profile="standard")),
+            ("standard", "segments", VideoService(args.workers, args.threads, cache_max_bytes=0, profile="standard")),
+            ("still", "segments", VideoService(args.workers, args.threads, cache_max_bytes=0, profile="still")),
+            ("draft", "segments", VideoService(args.workers, args.threads, cache_max_bytes=0, quality="draft")),
+        ]
+        results = {}
+        for name, mode, service in runs:
+            output_path = work_dir / f"bench_{name}.mp4"
+            t0 = time.perf_counter()
+            c0 = os.times()
+            service.render_video(images, durations, srt_path, output_path, audio_files=audio_files, mode=mode)
+            seconds = time.perf_counter() - t0
+            c1 = os.times()
+            # ffmpeg 子进程消耗的 CPU 时间
+            cpu = (c1.children_user - c0.children_user) + (c1.children_system - c0.children_system)
+            actual = probe_duration(output_path)
+            results[name] = seconds
+            detail = ""
+            if mode == "segments":
+                detail = f"（{service.segment_workers} 个进程 x {service.segment_threads} 线程）"
+            print(
+                f"{name:>8}: {seconds:7.2f}s，CPU {cpu:7.2f}s，"
+                f"输出时长 {actual:.3f}s（期望 {expected:.3f}s）{detail}"
+            )
+
+        for name in ("standard", "still", "draft"):
+            print(f"{name} 相对 filter 加速比: {results['filter'] / results[name]:.2f}x")
+    finally:
+        if args.keep:
+            print(f"临时目录: {work_dir}")
+        else:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
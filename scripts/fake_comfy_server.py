@@ -0,0 +1,336 @@
+"""
+本地假 ComfyUI 服务
+
+实现与 ComfyUI 相同的 HTTP 与 WebSocket 协议子集（/prompt、/queue、/history、/view、/ws），
+用于在没有 GPU 的环境下联调 ComfyUIClient。
+
+用法:
+    python -m scripts.fake_comfy_server --port 8188 --delay 0.5
+"""
+import argparse
+import base64
+import hashlib
+import json
+import queue
+import socket
+import struct
+import threading
+import time
+import uuid
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Any, Optional
+from urllib.parse import urlparse, parse_qs
+
+WS_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+
+def make_png(width: int = 8, height: int = 8, rgb=(128, 128, 128)) -> bytes:
+    """生成纯色 PNG 图片"""
+    def chunk(tag: bytes, data: bytes) -> bytes:
+        return struct.pack(">I", len(data)) + tag + data + struct.pack(">I", zlib.crc32(tag + data))
+
+    row = b"\x00" + bytes(rgb) * width
+    return (
+        b"\x89PNG\r\n\x1a\n"
+        + chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0))
+        + chunk(b"IDAT", zlib.compress(row * height))
+        + chunk(b"IEND", b"")
+    )
+
+
+class FakeComfyUI:
+    """假 ComfyUI 的状态：队列、history、输出文件和 WebSocket 连接"""
+
+    def __init__(self, delay: float = 0.5, steps: int = 4, swap_delay: float = 0.0, ws_register_delay: float = 0.0):
+        self.delay = delay
+        self.steps = steps
+        # 切换 checkpoint 时模拟的模型加载时间
+        self.swap_delay = swap_delay
+        # WebSocket 握手完成到注册连接之间的延迟，这段时间内推送的事件会丢失（与 ComfyUI 相同）
+        self.ws_register_delay = ws_register_delay
+        self.loaded_checkpoint: Optional[str] = None
+        self.model_swaps = 0
+        self.pending: "queue.Queue[Dict[str, Any]]" = queue.Queue()
+        self.queue_pending: Dict[str, Dict[str, Any]] = {}
+        self.running: Optional[Dict[str, Any]] = None
+        self.history: Dict[str, Any] = {}
+        self.files: Dict[str, bytes] = {}
+        self.sockets: Dict[str, socket.socket] = {}
+        self.lock = threading.Lock()
+        self.counter = 0
+        self.interrupted = threading.Event()
+        threading.Thread(target=self._worker, daemon=True).start()
+
+    def enqueue(self, prompt: Dict[str, Any], client_id: Optional[str], prompt_id: Optional[str] = None) -> Dict[str, Any]:
+        with self.lock:
+            self.counter += 1
+            item = {
+                "prompt_id": prompt_id or uuid.uuid4().hex,
+                "number": self.counter,
+                "prompt": prompt,
+                "client_id": client_id,
+            }
+            self.queue_pending[item["prompt_id"]] = item
+        self.pending.put(item)
+        return item
+
+    def queue_status(self) -> Dict[str, Any]:
+        with self.lock:
+            running = [self.running] if self.running else []
+            pending = list(self.queue_pending.values())
+        to_entry = lambda it: [it["number"], it["prompt_id"], it["prompt"], {"client_id": it["client_id"]}, []]
+        return {
+            "queue_running": [to_entry(it) for it in running],
+            "queue_pending": [to_entry(it) for it in pending],
+        }
+
+    def send(self, client_id: Optional[str], event_type: str, data: Dict[str, Any]):
+        """向指定客户端（或全部客户端）推送事件"""
+        payload = json.dumps({"type": event_type, "data": data}).encode("utf-8")
+        with self.lock:
+            targets = [self.sockets[client_id]] if client_id in self.sockets else (
+                [] if client_id else list(self.sockets.values())
+            )
+        for sock in targets:
+            try:
+                send_frame(sock, 0x1, payload)
+            except OSError:
+                pass
+
+    def _worker(self):
+        while True:
+            item = self.pending.get()
+            prompt_id = item["prompt_id"]
+            with self.lock:
+                if prompt_id not in self.queue_pending:
+                    continue  # 已被取消
+                del self.queue_pending[prompt_id]
+                self.running = item
+            self.interrupted.clear()
+            client_id = item["client_id"]
+            self.send(client_id, "execution_start", {"prompt_id": prompt_id})
+
+            outputs = {}
+            for node_id, node in item["prompt"].items():
+                if self.interrupted.is_set():
+                    break
+                self.send(client_id, "executing", {"node": node_id, "prompt_id": prompt_id})
+                if node.get("class_type") == "CheckpointLoaderSimple":
+                    ckpt_name = node["inputs"].get("ckpt_name")
+                    if ckpt_name != self.loaded_checkpoint:
+                        if self.loaded_checkpoint is not None:
+                            self.model_swaps += 1
+                        self.loaded_checkpoint = ckpt_name
+                        time.sleep(self.swap_delay)
+                if node.get("class_type") == "KSampler":
+                    for step in range(1, self.steps + 1):
+                        time.sleep(self.delay / self.steps)
+                        if self.interrupted.is_set():
+                            break
+                        self.send(client_id, "progress", {"value": step, "max": self.steps, "prompt_id": prompt_id, "node": node_id})
+                if node.get("class_type") == "SaveImage":
+                    outputs[node_id] = {"images": self._save_images(item["prompt"], node)}
+                    self.send(client_id, "executed", {"node": node_id, "output": outputs[node_id], "prompt_id": prompt_id})
+
+            if self.interrupted.is_set():
+                with self.lock:
+                    self.history[prompt_id] = {
+                        "prompt": [item["number"], prompt_id, item["prompt"], {}, []],
+                        "outputs": {},
+                        "status": {"status_str": "error", "completed": False, "messages": []},
+                    }
+                    self.running = None
+                self.send(client_id, "execution_interrupted", {"prompt_id": prompt_id, "node_id": None})
+                continue
+
+            with self.lock:
+                self.history[prompt_id] = {
+                    "prompt": [item["number"], prompt_id, item["prompt"], {}, []],
+                    "outputs": outputs,
+                    "status": {"status_str": "success", "completed": True, "messages": []},
+                }
+                self.running = None
+            self.send(client_id, "executing", {"node": None, "prompt_id": prompt_id})
+
+    def _save_images(self, prompt: Dict[str, Any], node: Dict[str, Any]):
+        prefix = str(node["inputs"].get("filename_prefix", "ComfyUI")).replace("/", "_")
+        batch_size = 1
+        for other in prompt.values():
+            if other.get("class_type") == "EmptyLatentImage":
+                batch_size = int(other["inputs"].get("batch_size", 1))
+        images = []
+        with self.lock:
+            for _ in range(batch_size):
+                filename = f"{prefix}_{len(self.files) + 1:05d}_.png"
+                self.files[filename] = make_png()
+                images.append({"filename": filename, "subfolder": "", "type": "output"})
+        return images
+
+
+def send_frame(sock: socket.socket, opcode: int, payload: bytes):
+    """发送一个未分片、无掩码的 WebSocket 帧"""
+    header = bytes([0x80 | opcode])
+    length = len(payload)
+    if length < 126:
+        header += bytes([length])
+    elif length < 65536:
+        header += bytes([126]) + struct.pack(">H", length)
+    else:
+        header += bytes([127]) + struct.pack(">Q", length)
+    sock.sendall(header + payload)
+
+
+def recv_frame(rfile):
+    """读取一个客户端帧，返回 (opcode, payload)，连接关闭时返回 (None, b"")"""
+    head = rfile.read(2)
+    if len(head) < 2:
+        return None, b""
+    opcode = head[0] & 0x0F
+    masked = head[1] & 0x80
+    length = head[1] & 0x7F
+    if length == 126:
+        length = struct.unpack(">H", rfile.read(2))[0]
+    elif length == 127:
+        length = struct.unpack(">Q", rfile.read(8))[0]
+    mask = rfile.read(4) if masked else b"\x00\x00\x00\x00"
+    data = rfile.read(length)
+    return opcode, bytes(b ^ mask[i % 4] for i, b in enumerate(data))
+
+
+def make_handler(state: FakeComfyUI):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        # 头和正文分两次写出，关闭 Nagle 避免 keep-alive 连接上的 40ms 延迟确认
+        disable_nagle_algorithm = True
+
+        def log_message(self, format, *args):
+            pass
+
+        def _json(self, obj: Any, status: int = 200):
+            body = json.dumps(obj).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _read_json(self) -> Dict[str, Any]:
+            length = int(self.headers.get("Content-Length", 0))
+            return json.loads(self.rfile.read(length) or b"{}")
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            if url.path == "/ws":
+                return self._websocket(parse_qs(url.query).get("clientId", [None])[0])
+            if url.path == "/queue":
+                return self._json(state.queue_status())
+            if url.path.startswith("/history/"):
+                prompt_id = url.path[len("/history/"):]
+                with state.lock:
+                    entry = state.history.get(prompt_id)
+                return self._json({prompt_id: entry} if entry else {})
+            if url.path == "/view":
+                filename = parse_qs(url.query).get("filename", [""])[0]
+                data = state.files.get(filename)
+                if data is None:
+                    return self._json({"error": "not found"}, 404)
+                self.send_response(200)
+                self.send_header("Content-Type", "image/png")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+                return
+            self._json({"error": "not found"}, 404)
+
+        def do_POST(self):
+            url = urlparse(self.path)
+            if url.path == "/prompt":
+                body = self._read_json()
+                item = state.enqueue(body["prompt"], body.get("client_id"), body.get("prompt_id"))
+                return self._json({"prompt_id": item["prompt_id"], "number": item["number"], "node_errors": {}})
+            if url.path == "/queue":
+                body = self._read_json()
+                with state.lock:
+                    for prompt_id in body.get("delete", []):
+                        state.queue_pending.pop(prompt_id, None)
+                    if body.get("clear"):
+                        state.queue_pending.clear()
+                return self._json({})
+            if url.path == "/interrupt":
+                body = self._read_json()
+                with state.lock:
+                    running = state.running
+                if running and body.get("prompt_id") in (None, running["prompt_id"]):
+                    state.interrupted.set()
+                return self._json({})
+            self._json({"error": "not found"}, 404)
+
+        def _websocket(self, client_id: Optional[str]):
+            key = self.headers.get("Sec-WebSocket-Key", "")
+            accept = base64.b64encode(hashlib.sha1((key + WS_GUID).encode()).digest()).decode()
+            self.send_response(101)
+            self.send_header("Upgrade", "websocket")
+            self.send_header("Connection", "Upgrade")
+            self.send_header("Sec-WebSocket-Accept", accept)
+            self.end_headers()
+            self.wfile.flush()
+
+            client_id = client_id or uuid.uuid4().hex
+            if state.ws_register_delay:
+                time.sleep(state.ws_register_delay)
+            with state.lock:
+                state.sockets[client_id] = self.connection
+            state.send(client_id, "status", {"sid": client_id, "status": {"exec_info": {"queue_remaining": state.pending.qsize()}}})
+            try:
+                while True:
+                    opcode, payload = recv_frame(self.rfile)
+                    if opcode is None or opcode == 0x8:
+                        try:
+                            send_frame(self.connection, 0x8, payload[:2])
+                        except OSError:
+                            pass
+                        break
+                    if opcode == 0x9:
+                        send_frame(self.connection, 0xA, payload)
+            finally:
+                with state.lock:
+                    if state.sockets.get(client_id) is self.connection:
+                        del state.sockets[client_id]
+                self.close_connection = True
+
+    return Handler
+
+
+def serve(
+    host: str = "127.0.0.1",
+    port: int = 8188,
+    delay: float = 0.5,
+    swap_delay: float = 0.0,
+    ws_register_delay: float = 0.0,
+) -> ThreadingHTTPServer:
+    """在后台线程启动假 ComfyUI 服务，返回 server（port=0 时自动分配端口）"""
+    state = FakeComfyUI(delay=delay, swap_delay=swap_delay, ws_register_delay=ws_register_delay)
+    server = ThreadingHTTPServer((host, port), make_handler(state))
+    server.daemon_threads = True
+    server.state = state
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="本地假 ComfyUI 服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8188)
+    parser.add_argument("--delay", type=float, default=0.5, help="每个 prompt 的模拟执行时间（秒）")
+    parser.add_argument("--swap-delay", type=float, default=0.0, help="切换 checkpoint 的模拟加载时间（秒）")
+    parser.add_argument("--ws-register-delay", type=float, default=0.0, help="WebSocket 握手后注册连接的延迟（秒）")
+    args = parser.parse_args()
+
+    server = serve(args.host, args.port, args.delay, args.swap_delay, args.ws_register_delay)
+    print(f"假 ComfyUI 已启动: http://{args.host}:{server.server_address[1]}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
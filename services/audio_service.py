@@ -1,16 +1,63 @@
 """角色配音服务"""
 import json
-import pyttsx3
+import os
+import re
+import unicodedata
+import numpy as np
 from pathlib import Path
-from typing import Dict, Any, List, Optional
+from typing import Dict, Any, List, Optional, Union
 import tempfile
 import subprocess
 
+from . import pcm
+from .ffmpeg_runner import run_ffmpeg
+from .image_cache import ContentCache, file_sha256
+from .jobs import JobCancelled, check_cancelled, report_shot
+from .render_manifest import fingerprint
+from .tts_backends import TTSItem, TTSResult, read_audio, shared_backend
+
+
+def normalize_text(text: str) -> str:
+    """TTS 缓存键使用的文本：NFKC 规范化（全角/半角统一）、去掉首尾空白、连续空白合并为一个空格"""
+    return re.sub(r"\s+", " ", unicodedata.normalize("NFKC", text)).strip()
+
 
 class AudioService:
     """角色配音服务"""
 
-    def __init__(self):
+    # 缓存的 TTS 片段格式：16 位有符号小端 PCM，单声道
+    PCM_RATE = 22050
+    PCM_BYTES_PER_SECOND = PCM_RATE * 2
+    # 合成方式变化时递增，使已缓存的片段失效
+    CLIP_CACHE_VERSION = 2
+    # 整集音轨格式 -> 扩展名：wav 为无损 PCM；aac 编码一次，视频拼接时直接流复制
+    TRACK_FORMATS = {"wav": ".wav", "aac": ".m4a"}
+
+    def __init__(
+        self,
+        clip_cache_dir: Optional[Union[str, Path]] = None,
+        clip_cache_max_bytes: int = 512 * 1024 ** 2,
+        tts_workers: Optional[int] = None,
+        track_format: Optional[str] = None,
+        backend: Optional[str] = None,
+    ):
+        """
+        初始化服务
+
+        Args:
+            clip_cache_dir: TTS 片段缓存目录，默认 <项目根目录>/cache/tts
+            clip_cache_max_bytes: TTS 片段缓存总大小上限（字节），为 0 时禁用缓存
+            tts_workers: 同时合成的台词数（pyttsx3 工作进程数），默认取环境变量 TTS_WORKERS，
+                未设置时为 CPU 核数的一半（最多 4）
+            track_format: 整集音轨格式（见 TRACK_FORMATS），设置时 shot 配音保存为无损 WAV，
+                由 build_episode_track 拼接为一条整集音轨；默认为 None，每个 shot 一个 MP3
+            backend: TTS 后端的注册名（见 tts_backends.BACKENDS），默认取声音配置中的 "backend"，
+                未配置时为 "auto"（macOS 使用 say，其他系统使用 pyttsx3）。后端在进程内共享
+                （见 tts_backends.shared_backend），由 close_shared_backends 释放
+        """
+        if track_format is not None and track_format not in self.TRACK_FORMATS:
+            raise ValueError(f"未知的整集音轨格式: {track_format}（可选: {', '.join(self.TRACK_FORMATS)}）")
+        self.track_format = track_format
         # services/ -> 项目根目录（使用绝对路径）
         self.project_root = Path(__file__).resolve().parent.parent
         self.config_path = self.project_root / "config" / "voice_config.json"
@@ -19,10 +66,17 @@ class AudioService:
         
         # 加载声音配置
         self.voice_config = self._load_voice_config()
-        
-        # 初始化 TTS 引擎
-        self.engine = None
-        self._init_engine()
+
+        # TTS 片段缓存：按规范化文本、声音配置和 TTS 引擎缓存未调整语速的原始 PCM，
+        # 同一句台词（跨 episode 的口头禅等）只合成一次，不同的目标时长共用同一个片段
+        self.clip_cache = None
+        if clip_cache_max_bytes > 0:
+            self.clip_cache = ContentCache(
+                clip_cache_dir or self.project_root / "cache" / "tts", clip_cache_max_bytes, suffix=".pcm"
+            )
+
+        self.tts_workers = tts_workers or int(os.getenv("TTS_WORKERS", "0")) or max(1, min(4, (os.cpu_count() or 2) // 2))
+        self.backend = shared_backend(backend or self.voice_config.get("backend", "auto"), workers=self.tts_workers)
 
     def _load_voice_config(self) -> Dict[str, Any]:
         """加载声音配置文件"""
@@ -32,6 +86,7 @@ class AudioService:
         else:
             # 返回默认配置
             return {
+                "backend": "auto",
                 "default": {
                     "rate": 150,
                     "volume": 0.9,
@@ -40,26 +95,6 @@ class AudioService:
                 "characters": {}
             }
 
-    def _init_engine(self):
-        """初始化 TTS 引擎"""
-        try:
-            # 在 macOS 上，尝试使用 nsss（系统默认）或 say 驱动
-            import platform
-            if platform.system() == "Darwin":  # macOS
-                try:
-                    self.engine = pyttsx3.init("nsss")  # macOS 系统 TTS
-                except:
-                    self.engine = pyttsx3.init()  # 回退到默认
-            else:
-                self.engine = pyttsx3.init()
-            
-            # 设置默认参数
-            default_config = self.voice_config.get("default", {})
-            self.engine.setProperty("rate", default_config.get("rate", 150))
-            self.engine.setProperty("volume", default_config.get("volume", 0.9))
-        except Exception as e:
-            raise RuntimeError(f"无法初始化 TTS 引擎: {e}")
-
     def _get_voice_config_for_character(self, character: Dict[str, Any]) -> Dict[str, Any]:
         """获取角色的声音配置"""
         # 支持 voice_id 或 voice_name 字段
@@ -74,447 +109,187 @@ class AudioService:
             "voice_name": "Ting-Ting"
         })
 
-    def _apply_voice_settings(self, config: Dict[str, Any]):
-        """应用声音设置到引擎（用于 pyttsx3）"""
-        if self.engine is None:
-            return
-        
-        if "rate" in config:
-            self.engine.setProperty("rate", config["rate"])
-        if "volume" in config:
-            self.engine.setProperty("volume", config["volume"])
-        
-        # 设置声音（优先使用 voice_name，如果没有则尝试 voice_id）
-        voice_name = config.get("voice_name")
-        if voice_name:
-            # 尝试通过名称匹配
-            voices = self.engine.getProperty("voices")
-            if voices and len(voices) > 0:
-                for voice in voices:
-                    if voice_name.lower() in voice.name.lower() or voice.name.lower() in voice_name.lower():
-                        self.engine.setProperty("voice", voice.id)
-                        break
-        
-        # 兼容旧的 voice_id 配置
-        elif config.get("voice_id") is not None:
-            voices = self.engine.getProperty("voices")
-            if voices and len(voices) > 0:
-                voice_id = config["voice_id"]
-                if isinstance(voice_id, int) and 0 <= voice_id < len(voices):
-                    self.engine.setProperty("voice", voices[voice_id].id)
-                elif isinstance(voice_id, str):
-                    # 尝试通过名称匹配
-                    for voice in voices:
-                        if voice_id.lower() in voice.name.lower():
-                            self.engine.setProperty("voice", voice.id)
-                            break
-
-    def _text_to_speech(self, text: str, output_path: Path, config: Dict[str, Any], target_duration: Optional[float] = None):
+    def voice_config_for_shot(self, episode_data: Dict[str, Any], shot: Dict[str, Any]) -> Dict[str, Any]:
         """
-        将文本转换为语音并保存到文件
-        
+        获取 shot 使用的声音配置
+
         Args:
-            text: 要转换的文本
-            output_path: 输出文件路径
+            episode_data: episode JSON 数据
+            shot: 镜头信息字典
+
+        Returns:
+            指定了说话者（speaker）且配置中存在时使用说话者的配置，否则使用角色的配置
+        """
+        speaker = shot.get("speaker")
+        if speaker and speaker in self.voice_config.get("characters", {}):
+            return self.voice_config["characters"][speaker]
+        return self._get_voice_config_for_character(episode_data.get("character", {}))
+
+    def shot_audio_path(self, episode_id: int, shot_id: Any) -> Path:
+        """shot 配音文件的路径（启用整集音轨时为 WAV，否则为 MP3）"""
+        suffix = ".wav" if self.track_format else ".mp3"
+        return self.audio_dir / f"episode_{episode_id:03d}_shot_{shot_id}{suffix}"
+
+    def track_path(self, episode_id: int) -> Path:
+        """整集音轨的路径"""
+        return self.audio_dir / f"episode_{episode_id:03d}_audio{self.TRACK_FORMATS[self.track_format]}"
+
+    def track_index_path(self, episode_id: int) -> Path:
+        """整集音轨索引（各 shot 在音轨中的位置）的路径"""
+        return self.audio_dir / f"episode_{episode_id:03d}_audio.json"
+
+    @property
+    def tts_backend(self) -> str:
+        """TTS 后端标识（参与片段缓存键）"""
+        return self.backend.identity
+
+    def clip_cache_key(self, text: str, config: Dict[str, Any]) -> str:
+        """
+        TTS 片段的缓存键
+
+        Args:
+            text: 台词
             config: 声音配置
-            target_duration: 目标时长（秒），如果提供则调整音频速度以匹配
+
+        Returns:
+            规范化文本、生效的声音参数和 TTS 引擎的指纹
         """
-        if not text or not text.strip():
-            raise ValueError("文本内容不能为空")
-        
-        import platform
-        import time
-        
-        # 在 macOS 上，直接使用 say 命令更可靠
-        if platform.system() == "Darwin":  # macOS
-            self._text_to_speech_macos(text, output_path, config)
-        else:
-            # 其他系统使用 pyttsx3
-            self._text_to_speech_pyttsx3(text, output_path, config)
-        
-        # 如果指定了目标时长，调整音频速度
-        if target_duration and target_duration > 0:
-            try:
-                self._adjust_audio_duration(output_path, target_duration)
-            except Exception as e:
-                # 如果调整时长失败，记录警告但继续（至少音频已经生成了）
-                print(f"警告: 调整音频时长失败: {e}")
-                import traceback
-                print(traceback.format_exc())
-    
-    def _text_to_speech_macos(self, text: str, output_path: Path, config: Dict[str, Any]):
-        """使用 macOS say 命令生成语音（更可靠）"""
-        import subprocess
-        import time
-        
-        # 使用临时 WAV 文件
-        with tempfile.NamedTemporaryFile(suffix=".aiff", delete=False) as tmp_file:
-            tmp_aiff = Path(tmp_file.name)
-        
-        try:
-            # 构建 say 命令
-            # say -v 声音名称 -r 语速 -o 输出文件 "文本"
-            cmd = ["say"]
-            
-            # 设置声音（优先使用 voice_name，如果没有则尝试从 voice_id 获取）
-            voice_name = config.get("voice_name")
-            
-            if not voice_name and config.get("voice_id") is not None:
-                # 尝试从 voice_id 获取声音名称（兼容旧配置）
-                try:
-                    engine = pyttsx3.init("nsss")
-                    voices = engine.getProperty("voices")
-                    if voices:
-                        voice_id = config["voice_id"]
-                        if isinstance(voice_id, int) and 0 <= voice_id < len(voices):
-                            voice_name = voices[voice_id].name
-                        elif isinstance(voice_id, str):
-                            for voice in voices:
-                                if voice_id.lower() in voice.name.lower():
-                                    voice_name = voice.name
-                                    break
-                    engine.stop()
-                except:
-                    pass
-            
-            if voice_name:
-                cmd.extend(["-v", voice_name])
-            
-            # 设置语速（say 的 -r 参数，默认是 200）
-            rate = config.get("rate", 150)
-            # 将 pyttsx3 的 rate (150) 转换为 say 的 rate (约 200)
-            say_rate = int(rate * 200 / 150)
-            cmd.extend(["-r", str(say_rate)])
-            
-            # 输出文件
-            cmd.extend(["-o", str(tmp_aiff)])
-            
-            # 文本内容
-            cmd.append(text)
-            
-            # 执行 say 命令
-            result = subprocess.run(cmd, check=True, capture_output=True, text=True)
-            
-            # 等待文件生成
-            max_wait = 10
-            waited = 0
-            while waited < max_wait:
-                if tmp_aiff.exists() and tmp_aiff.stat().st_size > 0:
-                    break
-                time.sleep(0.2)
-                waited += 0.2
-            
-            if not tmp_aiff.exists() or tmp_aiff.stat().st_size == 0:
-                raise RuntimeError(f"AIFF 文件生成失败: {tmp_aiff}")
-            
-            # 转换为 MP3
-            if output_path.suffix.lower() == ".mp3":
-                self._convert_aiff_to_mp3(tmp_aiff, output_path)
-            else:
-                # 转换为 WAV
-                self._convert_aiff_to_wav(tmp_aiff, output_path)
-        finally:
-            if tmp_aiff.exists():
-                tmp_aiff.unlink()
-    
-    def _text_to_speech_pyttsx3(self, text: str, output_path: Path, config: Dict[str, Any]):
-        """使用 pyttsx3 生成语音（非 macOS 系统）"""
-        engine = None
-        try:
-            engine = pyttsx3.init()
-            
-            # 应用声音设置
-            if "rate" in config:
-                engine.setProperty("rate", config["rate"])
-            if "volume" in config:
-                engine.setProperty("volume", config["volume"])
-            
-            # 设置声音
-            if config.get("voice_id") is not None:
-                voices = engine.getProperty("voices")
-                if voices and len(voices) > 0:
-                    voice_id = config["voice_id"]
-                    if isinstance(voice_id, int) and 0 <= voice_id < len(voices):
-                        engine.setProperty("voice", voices[voice_id].id)
-                    elif isinstance(voice_id, str):
-                        for voice in voices:
-                            if voice_id.lower() in voice.name.lower():
-                                engine.setProperty("voice", voice.id)
-                                break
-            
-            # 使用临时 WAV 文件
-            with tempfile.NamedTemporaryFile(suffix=".wav", delete=False) as tmp_file:
-                tmp_wav = Path(tmp_file.name)
-            
-            try:
-                engine.save_to_file(text, str(tmp_wav))
-                engine.runAndWait()
-                
-                import time
-                time.sleep(0.5)
-                
-                if not tmp_wav.exists() or tmp_wav.stat().st_size == 0:
-                    raise RuntimeError(f"WAV 文件生成失败: {tmp_wav}")
-                
-                if output_path.suffix.lower() == ".mp3":
-                    self._convert_wav_to_mp3(tmp_wav, output_path)
-                else:
-                    import shutil
-                    shutil.copy2(tmp_wav, output_path)
-            finally:
-                if tmp_wav.exists():
-                    tmp_wav.unlink()
-        finally:
-            if engine is not None:
-                try:
-                    engine.stop()
-                except:
-                    pass
-    
-    def _convert_aiff_to_mp3(self, aiff_path: Path, mp3_path: Path):
-        """将 AIFF 转换为 MP3"""
-        self._convert_audio_to_mp3(aiff_path, mp3_path)
-    
-    def _convert_aiff_to_wav(self, aiff_path: Path, wav_path: Path):
-        """将 AIFF 转换为 WAV"""
-        try:
-            cmd = [
-                "ffmpeg",
-                "-y",
-                "-i", str(aiff_path),
-                str(wav_path)
-            ]
-            subprocess.run(cmd, check=True, capture_output=True, text=True)
-        except subprocess.CalledProcessError as e:
-            error_msg = e.stderr if isinstance(e.stderr, str) else (e.stderr.decode() if e.stderr else str(e))
-            raise RuntimeError(f"AIFF 转 WAV 失败: {error_msg}")
-    
-    def _convert_audio_to_mp3(self, audio_path: Path, mp3_path: Path):
-        """通用的音频转 MP3 方法"""
-        try:
-            if not audio_path.exists():
-                raise RuntimeError(f"源文件不存在: {audio_path}")
-            
-            cmd = [
-                "ffmpeg",
-                "-y",
-                "-i", str(audio_path),
-                "-codec:a", "libmp3lame",
-                "-q:a", "2",
-                "-ar", "22050",
-                "-ac", "1",
-                "-b:a", "64k",
-                str(mp3_path)
-            ]
-            result = subprocess.run(cmd, check=True, capture_output=True, text=True)
-            
-            import time
-            time.sleep(0.2)
-            
-            if not mp3_path.exists():
-                raise RuntimeError(f"MP3 文件未生成: {mp3_path}")
-            
-            mp3_size = mp3_path.stat().st_size
-            if mp3_size == 0:
-                raise RuntimeError(f"MP3 文件为空: {mp3_path}")
-            
-            if mp3_size < 1024:
-                raise RuntimeError(f"MP3 文件太小 ({mp3_size} bytes): {mp3_path}")
-        except subprocess.CalledProcessError as e:
-            error_msg = e.stderr if isinstance(e.stderr, str) else (e.stderr.decode() if e.stderr else str(e))
-            raise RuntimeError(f"音频转换失败: {error_msg}")
-        except FileNotFoundError:
-            raise RuntimeError("ffmpeg 未找到，请确保已安装 ffmpeg")
-
-    def _convert_wav_to_mp3(self, wav_path: Path, mp3_path: Path):
-        """使用 ffmpeg 将 WAV 转换为 MP3"""
-        self._convert_audio_to_mp3(wav_path, mp3_path)
-    
-    def _generate_silence(self, duration: float) -> Optional[Path]:
+        voice = {
+            "rate": config.get("rate", 150),
+            "volume": config.get("volume"),
+            "voice_name": config.get("voice_name"),
+            "voice_id": config.get("voice_id"),
+        }
+        return fingerprint("tts", self.CLIP_CACHE_VERSION, self.tts_backend, normalize_text(text), voice)
+
+    def _synthesize_lines(self, items: List[TTSItem]) -> List[TTSResult]:
         """
-        生成指定时长的静音音频
-        
+        取得台词未调整语速的 PCM：先查片段缓存，其余（同样的台词只算一次）一次交给 TTS 后端批量合成
+
         Args:
-            duration: 静音时长（秒）
-            
+            items: (台词, 声音配置) 列表
+
         Returns:
-            生成的静音音频文件路径
+            与 items 一一对应的 int16 数组（PCM_RATE 采样率，单声道），合成失败的台词为异常对象
         """
-        with tempfile.NamedTemporaryFile(suffix=".mp3", delete=False) as tmp_file:
-            silence_path = Path(tmp_file.name)
-        
-        try:
-            # 使用 ffmpeg 生成静音
-            cmd = [
-                "ffmpeg",
-                "-y",
-                "-f", "lavfi",
-                "-i", f"anullsrc=channel_layout=mono:sample_rate=22050",
-                "-t", str(duration),
-                "-codec:a", "libmp3lame",
-                "-q:a", "2",
-                "-ar", "22050",
-                "-ac", "1",
-                "-b:a", "64k",
-                str(silence_path)
-            ]
-            subprocess.run(cmd, check=True, capture_output=True, text=True)
-            
-            if silence_path.exists() and silence_path.stat().st_size > 0:
-                return silence_path
+        results: List[Optional[TTSResult]] = [None] * len(items)
+        # 缓存键 -> 需要合成的台词位置
+        missing: Dict[str, List[int]] = {}
+        hits = 0
+        for position, (text, config) in enumerate(items):
+            key = self.clip_cache_key(text, config)
+            if key in missing:
+                missing[key].append(position)
+                continue
+            clip = self._cache_get(key)
+            if clip is not None:
+                results[position] = clip
+                hits += 1
             else:
-                silence_path.unlink(missing_ok=True)
-                return None
-        except Exception as e:
-            print(f"警告: 生成静音失败: {e}")
-            if silence_path.exists():
-                silence_path.unlink(missing_ok=True)
+                missing[key] = [position]
+
+        if missing:
+            clips = self.backend.synthesize_batch(
+                [items[positions[0]] for positions in missing.values()], self.PCM_RATE
+            )
+            for (key, positions), clip in zip(missing.items(), clips):
+                if not isinstance(clip, Exception):
+                    if len(clip) == 0:
+                        clip = RuntimeError(f"TTS 输出为空: {items[positions[0]][0]}")
+                    else:
+                        self._cache_put(key, clip)
+                for position in positions:
+                    results[position] = clip
+
+        if self.clip_cache is not None:
+            print(f"配音缓存: 命中 {hits} 句，合成 {len(missing)} 句（TTS 后端 {self.tts_backend}）")
+        return results
+
+    def _cache_get(self, key: str) -> Optional[np.ndarray]:
+        """从片段缓存取出 PCM，未命中（或禁用缓存）时为 None"""
+        if self.clip_cache is None:
             return None
-    
-    def _concat_audio_segments(self, segments: List[Path], output_path: Path, target_duration: Optional[float] = None):
+        # 与缓存目录在同一文件系统上，命中时硬链接
+        with tempfile.NamedTemporaryFile(prefix=".clip_", suffix=".pcm", dir=self.audio_dir, delete=False) as tmp_file:
+            pcm_path = Path(tmp_file.name)
+        try:
+            if not self.clip_cache.get(key, pcm_path):
+                return None
+            return pcm.from_bytes(pcm_path.read_bytes())
+        finally:
+            pcm_path.unlink(missing_ok=True)
+
+    def _cache_put(self, key: str, samples: np.ndarray):
+        """把 PCM 放入片段缓存"""
+        if self.clip_cache is None:
+            return
+        with tempfile.NamedTemporaryFile(prefix=".clip_", suffix=".pcm", dir=self.audio_dir, delete=False) as tmp_file:
+            tmp_file.write(pcm.to_bytes(samples))
+            pcm_path = Path(tmp_file.name)
+        try:
+            self.clip_cache.put(key, pcm_path)
+        finally:
+            pcm_path.unlink(missing_ok=True)
+
+    def _encode_pcm(self, samples: np.ndarray, output_path: Path):
         """
-        将多个音频段拼接成一个音频文件
-        
+        把一个 shot 的 PCM 编码为 MP3（每个 shot 只编码这一次）；输出为 WAV 时直接写入，不调用 ffmpeg
+
         Args:
-            segments: 音频段路径列表
-            output_path: 输出文件路径
-            target_duration: 目标总时长（秒），如果提供则调整速度
+            samples: int16 数组（PCM_RATE 采样率，单声道）
+            output_path: 输出 MP3 或 WAV 路径
         """
-        if not segments:
-            raise ValueError("音频段列表不能为空")
-        
-        # 如果只有一个段，直接复制
-        if len(segments) == 1:
-            import shutil
-            shutil.copy2(segments[0], output_path)
-            if target_duration:
-                self._adjust_audio_duration(output_path, target_duration)
+        if output_path.suffix.lower() == ".wav":
+            pcm.write_wav(output_path, samples, self.PCM_RATE)
             return
-        
-        # 创建文件列表
-        with tempfile.NamedTemporaryFile(mode='w', suffix='.txt', delete=False) as f:
-            concat_list_path = Path(f.name)
-            for seg in segments:
-                f.write(f"file '{seg.absolute()}'\n")
-        
+        pcm_path = output_path.with_name(f".{output_path.stem}.pcm")
+        pcm_path.write_bytes(pcm.to_bytes(samples))
+        cmd = [
+            "ffmpeg",
+            "-y",
+            "-f", "s16le",
+            "-ar", str(self.PCM_RATE),
+            "-ac", "1",
+            "-i", str(pcm_path),
+            "-codec:a", "libmp3lame",
+            "-q:a", "2",
+            "-ar", "22050",
+            "-ac", "1",
+            "-b:a", "64k",
+            str(output_path),
+        ]
         try:
-            # 使用 ffmpeg concat 拼接
-            cmd = [
-                "ffmpeg",
-                "-y",
-                "-f", "concat",
-                "-safe", "0",
-                "-i", str(concat_list_path),
-                "-codec:a", "libmp3lame",
-                "-q:a", "2",
-                "-ar", "22050",
-                "-ac", "1",
-                "-b:a", "64k",
-                str(output_path)
-            ]
-            subprocess.run(cmd, check=True, capture_output=True, text=True)
-            
-            # 如果指定了目标时长，调整速度
-            if target_duration:
-                self._adjust_audio_duration(output_path, target_duration)
+            run_ffmpeg(cmd, label="audio", duration=pcm.duration(samples, self.PCM_RATE))
+        except subprocess.CalledProcessError as e:
+            raise RuntimeError(f"音频编码失败: {e}")
         finally:
-            if concat_list_path.exists():
-                concat_list_path.unlink()
-    
-    def _adjust_audio_duration(self, audio_path: Path, target_duration: float):
+            pcm_path.unlink(missing_ok=True)
+
+    def _fit_duration(self, samples: np.ndarray, target_duration: float) -> np.ndarray:
         """
-        调整音频时长以匹配目标时长
-        
+        调整语速以匹配目标时长（保持音高）
+
         Args:
-            audio_path: 音频文件路径
+            samples: int16 数组
             target_duration: 目标时长（秒）
+
+        Returns:
+            调整后的 int16 数组；时长已经匹配（误差在 0.1 秒内）或目标时长无效时原样返回
         """
-        import subprocess
-        import tempfile
-        
-        # 获取当前音频时长
-        try:
-            cmd = [
-                "ffprobe",
-                "-v", "error",
-                "-show_entries", "format=duration",
-                "-of", "default=noprint_wrappers=1:nokey=1",
-                str(audio_path)
-            ]
-            result = subprocess.run(cmd, check=True, capture_output=True, text=True)
-            current_duration = float(result.stdout.strip())
-        except Exception as e:
-            print(f"警告: 无法获取音频时长，跳过速度调整: {e}")
-            return
-        
-        # 如果时长已经匹配（误差在 0.1 秒内），不需要调整
-        if abs(current_duration - target_duration) < 0.1:
-            return
-        
-        # 计算需要的速度调整比例
-        speed_ratio = current_duration / target_duration
-        
-        # atempo 滤镜的范围是 0.5 到 2.0，如果超出范围需要链式使用
-        if speed_ratio < 0.5:
-            # 太慢，需要多次应用 atempo
-            # 例如：0.25 = 0.5 * 0.5，需要两次
-            # 计算需要多少个 atempo 才能达到目标速度
-            num_filters = 1
-            while (0.5 ** num_filters) > speed_ratio:
-                num_filters += 1
-            tempo_value = speed_ratio ** (1.0 / num_filters)
-            # 确保每个 atempo 值在 0.5-2.0 范围内
-            if tempo_value < 0.5:
-                num_filters += 1
-                tempo_value = speed_ratio ** (1.0 / num_filters)
-            filter_complex = ",".join([f"atempo={tempo_value:.3f}"] * num_filters)
-        elif speed_ratio > 2.0:
-            # 太快，需要多次应用 atempo
-            # 计算需要多少个 atempo 才能达到目标速度
-            num_filters = 1
-            while (2.0 ** num_filters) < speed_ratio:
-                num_filters += 1
-            tempo_value = speed_ratio ** (1.0 / num_filters)
-            # 确保每个 atempo 值在 0.5-2.0 范围内
-            if tempo_value > 2.0:
-                num_filters += 1
-                tempo_value = speed_ratio ** (1.0 / num_filters)
-            filter_complex = ",".join([f"atempo={tempo_value:.3f}"] * num_filters)
-        else:
-            filter_complex = f"atempo={speed_ratio:.3f}"
-        
-        # 使用临时文件
-        with tempfile.NamedTemporaryFile(suffix=".mp3", delete=False) as tmp_file:
-            tmp_output = Path(tmp_file.name)
-        
-        try:
-            cmd = [
-                "ffmpeg",
-                "-y",
-                "-i", str(audio_path),
-                "-filter:a", filter_complex,
-                "-codec:a", "libmp3lame",
-                "-q:a", "2",
-                str(tmp_output)
-            ]
-            subprocess.run(cmd, check=True, capture_output=True, text=True)
-            
-            # 替换原文件
-            import shutil
-            shutil.move(str(tmp_output), str(audio_path))
-        except subprocess.CalledProcessError as e:
-            error_msg = e.stderr if isinstance(e.stderr, str) else (e.stderr.decode() if e.stderr else str(e))
-            print(f"警告: 音频速度调整失败: {error_msg}")
-            if tmp_output.exists():
-                tmp_output.unlink()
-            # 不抛出异常，保留原始音频文件
-            return
-        except Exception as e:
-            print(f"警告: 音频速度调整出错: {e}")
-            if tmp_output.exists():
-                tmp_output.unlink()
-            # 不抛出异常，保留原始音频文件
-            return
+        if not target_duration or target_duration <= 0:
+            return samples
+        if abs(pcm.duration(samples, self.PCM_RATE) - target_duration) < 0.1:
+            return samples
+        return pcm.fit_length(samples, int(round(target_duration * self.PCM_RATE)), self.PCM_RATE)
+
+    @staticmethod
+    def _is_silence(subtitle_text: str) -> bool:
+        """是否是静音内容（只有省略号、破折号等）"""
+        subtitle_clean = subtitle_text.strip()
+        return (
+            subtitle_clean in ["……", "...", "…", "——", "--", "—", ""] or
+            subtitle_clean.replace("…", "").replace(".", "").replace("—", "").replace("-", "").strip() == ""
+        )
 
     def generate_audio(
         self,
@@ -524,6 +299,9 @@ class AudioService:
         """
         为 episode 生成配音音频文件
 
+        全部 shot 的台词一次交给 TTS 后端批量合成（后端内部并行或在一次引擎调用中合成多句）；
+        变速、静音和拼接都在内存中的 PCM 上完成，每个 shot 只调用一次 ffmpeg 编码 MP3。
+
         Args:
             episode_data: episode JSON 数据
             episode_id: episode ID，如果不提供则从 episode_data 中读取
@@ -534,83 +312,204 @@ class AudioService:
         if episode_id is None:
             episode_id = episode_data.get("episode_id", 1)
 
-        character = episode_data.get("character", {})
-        voice_config = self._get_voice_config_for_character(character)
-        
         audio_files = []
-        
-        for shot in episode_data.get("shots", []):
-            shot_id = shot.get("id", len(audio_files) + 1)
+        # 需要合成的台词：(文本, 声音配置)
+        speech: List[TTSItem] = []
+        shot_lines = []
+        for index, shot in enumerate(episode_data.get("shots", [])):
+            shot_id = shot.get("id", index + 1)
             subtitles = shot.get("subtitles", [])
             shot_duration = shot.get("duration", 0)
-            
+
             if not subtitles:
                 continue
-            
-            # 检查是否有指定的说话者
-            speaker = shot.get("speaker")
-            if speaker and speaker in self.voice_config.get("characters", {}):
-                # 使用指定说话者的声音配置
-                shot_voice_config = self.voice_config["characters"][speaker]
-            else:
-                # 使用角色默认声音配置
-                shot_voice_config = voice_config
-            
+
+            # 指定了说话者时使用说话者的声音配置，否则使用角色默认声音配置
+            shot_voice_config = self.voice_config_for_shot(episode_data, shot)
+
             # 计算每个字幕的时长（与 SRT 生成逻辑保持一致）
             per_line_duration = shot_duration / max(len(subtitles), 1)
-            
-            # 为每个字幕生成音频段，然后拼接
-            audio_segments = []
-            for i, subtitle_text in enumerate(subtitles):
-                # 检查是否是静音内容（只有省略号、破折号等）
-                subtitle_clean = subtitle_text.strip()
-                is_silence = (
-                    subtitle_clean in ["……", "...", "…", "——", "--", "—", ""] or
-                    subtitle_clean.replace("…", "").replace(".", "").replace("—", "").replace("-", "").strip() == ""
-                )
-                
-                if is_silence:
-                    # 生成静音音频段
-                    segment_duration = per_line_duration * 0.9  # 与 SRT 逻辑保持一致
-                    silence_path = self._generate_silence(segment_duration)
-                    if silence_path:
-                        audio_segments.append(silence_path)
+            line_duration = per_line_duration * 0.9  # 与 SRT 逻辑保持一致
+            # 台词总时长与 shot 时长相差 0.1 秒以上时整体拉伸到 shot 时长：
+            # 直接按拉伸后的时长调整每句台词，每句只做一次变速
+            total = line_duration * len(subtitles)
+            if shot_duration and abs(total - shot_duration) >= 0.1:
+                line_duration *= shot_duration / total
+
+            # 每句台词在 speech 中的位置，静音内容为 None
+            lines = []
+            for subtitle_text in subtitles:
+                if self._is_silence(subtitle_text):
+                    lines.append(None)
                 else:
-                    # 生成语音音频段
-                    segment_path = self.audio_dir / f"episode_{episode_id:03d}_shot_{shot_id}_seg_{i}.mp3"
-                    try:
-                        self._text_to_speech(
-                            subtitle_text,
-                            segment_path,
-                            shot_voice_config,
-                            target_duration=per_line_duration * 0.9
-                        )
-                        if segment_path.exists():
-                            audio_segments.append(segment_path)
-                    except Exception as e:
-                        print(f"警告: 为字幕 '{subtitle_text}' 生成音频失败: {e}")
-                        # 生成静音作为替代
-                        silence_path = self._generate_silence(per_line_duration * 0.9)
-                        if silence_path:
-                            audio_segments.append(silence_path)
-            
-            # 如果生成了音频段，拼接成一个完整的音频文件
-            if audio_segments:
-                audio_filename = f"episode_{episode_id:03d}_shot_{shot_id}.mp3"
-                audio_path = self.audio_dir / audio_filename
-                
-                try:
-                    self._concat_audio_segments(audio_segments, audio_path, target_duration=shot_duration)
-                    audio_files.append(audio_path)
-                except Exception as e:
-                    print(f"错误: 拼接音频段失败: {e}")
-                    import traceback
-                    print(traceback.format_exc())
-                
-                # 清理临时音频段文件
-                for seg in audio_segments:
-                    if seg.exists() and seg != audio_path:
-                        seg.unlink()
-        
+                    lines.append(len(speech))
+                    speech.append((subtitle_text, shot_voice_config))
+            shot_lines.append((shot_id, shot_duration, line_duration, lines))
+
+        check_cancelled()
+        clips = self._synthesize_lines(speech) if speech else []
+
+        for shot_id, shot_duration, line_duration, lines in shot_lines:
+            check_cancelled()
+            parts = []
+            for position in lines:
+                clip = clips[position] if position is not None else None
+                if isinstance(clip, Exception):
+                    print(f"警告: 为字幕 '{speech[position][0]}' 生成音频失败: {clip}")
+                if clip is None or isinstance(clip, Exception):
+                    # 静音内容，或生成失败时用静音代替
+                    parts.append(pcm.silence(line_duration, self.PCM_RATE))
+                else:
+                    parts.append(self._fit_duration(clip, line_duration))
+
+            # 在内存中拼接，整个 shot 只编码一次
+            samples = self._fit_duration(np.concatenate(parts), shot_duration)
+            if len(samples) == 0:
+                continue
+
+            audio_path = self.shot_audio_path(episode_id, shot_id)
+            try:
+                self._encode_pcm(samples, audio_path)
+                audio_files.append(audio_path)
+                report_shot(shot_id, audio="done")
+            except JobCancelled:
+                raise
+            except Exception as e:
+                print(f"错误: 编码 shot 音频失败: {e}")
+                import traceback
+                print(traceback.format_exc())
+
         return audio_files
 
+    def build_episode_track(self, episode_data: Dict[str, Any], episode_id: Optional[int] = None) -> Path:
+        """
+        把各 shot 的配音按镜头时长拼接为一条整集音轨，并写入记录各 shot 位置的索引
+
+        shot 的起点为 round(镜头累计开始时间 × PCM_RATE)，配音比镜头短时补静音、长时截断，
+        没有配音的 shot 为静音，shot 边界精确到采样，误差不随镜头数累积。aac 格式只在这里编码一次，
+        视频拼接时直接流复制。
+
+        Args:
+            episode_data: episode JSON 数据
+            episode_id: episode ID，如果不提供则从 episode_data 中读取
+
+        Returns:
+            整集音轨路径（索引见 track_index_path）
+        """
+        if self.track_format is None:
+            raise ValueError("未启用整集音轨（track_format）")
+        if episode_id is None:
+            episode_id = episode_data.get("episode_id", 1)
+
+        chunks = []
+        shots = []
+        start = 0.0
+        start_sample = 0
+        for index, shot in enumerate(episode_data.get("shots", [])):
+            check_cancelled()
+            shot_id = shot.get("id", index + 1)
+            duration = float(shot.get("duration", 0))
+            start += duration
+            end_sample = int(round(start * self.PCM_RATE))
+            audio_path = self.shot_audio_path(episode_id, shot_id)
+            samples = None
+            if audio_path.exists():
+                try:
+                    samples = read_audio(audio_path, self.PCM_RATE)
+                except (ValueError, RuntimeError) as e:
+                    print(f"警告: 读取 shot {shot_id} 的配音失败，使用静音: {e}")
+            chunks.append(pcm.fit_samples(samples if samples is not None else pcm.silence(0, self.PCM_RATE), end_sample - start_sample))
+            shots.append({
+                "id": shot_id,
+                "duration": shot.get("duration"),
+                "start": start_sample / self.PCM_RATE,
+                "start_sample": start_sample,
+                "samples": end_sample - start_sample,
+                "audio": file_sha256(audio_path) if samples is not None else None,
+            })
+            start_sample = end_sample
+        samples = np.concatenate(chunks) if chunks else pcm.silence(0, self.PCM_RATE)
+
+        track_path = self.track_path(episode_id)
+        tmp_wav = self.audio_dir / f".{track_path.stem}.{os.getpid()}.wav"
+        try:
+            pcm.write_wav(tmp_wav, samples, self.PCM_RATE)
+            if self.track_format == "wav":
+                os.replace(tmp_wav, track_path)
+            else:
+                cmd = [
+                    "ffmpeg",
+                    "-y",
+                    "-i", str(tmp_wav),
+                    "-c:a", "aac",
+                    "-b:a", "128k",
+                    "-ar", "44100",
+                    "-ac", "2",
+                    "-movflags", "+faststart",
+                    str(track_path),
+                ]
+                try:
+                    run_ffmpeg(cmd, label="audio", duration=pcm.duration(samples, self.PCM_RATE))
+                except subprocess.CalledProcessError as e:
+                    raise RuntimeError(f"整集音轨编码失败: {e}")
+        finally:
+            tmp_wav.unlink(missing_ok=True)
+
+        index_path = self.track_index_path(episode_id)
+        tmp_index = index_path.with_name(f".{index_path.name}.{os.getpid()}.tmp")
+        with open(tmp_index, "w", encoding="utf-8") as f:
+            json.dump(
+                {
+                    "track": track_path.name,
+                    "format": self.track_format,
+                    "sample_rate": self.PCM_RATE,
+                    "duration": len(samples) / self.PCM_RATE,
+                    "shots": shots,
+                },
+                f,
+                ensure_ascii=False,
+                indent=2,
+            )
+        os.replace(tmp_index, index_path)
+        return track_path
+
+    def load_episode_track(self, episode_data: Dict[str, Any], episode_id: Optional[int] = None) -> Optional[Path]:
+        """
+        取得与当前 episode 和 shot 配音一致的整集音轨
+
+        Args:
+            episode_data: episode JSON 数据
+            episode_id: episode ID，如果不提供则从 episode_data 中读取
+
+        Returns:
+            音轨路径；未启用整集音轨、音轨或索引不存在、镜头或配音在音轨生成后有变化时为 None
+        """
+        if self.track_format is None:
+            return None
+        if episode_id is None:
+            episode_id = episode_data.get("episode_id", 1)
+        track_path = self.track_path(episode_id)
+        index_path = self.track_index_path(episode_id)
+        if not track_path.exists() or not index_path.exists():
+            return None
+        try:
+            with open(index_path, "r", encoding="utf-8") as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if index.get("track") != track_path.name:
+            return None
+
+        entries = index.get("shots", [])
+        episode_shots = episode_data.get("shots", [])
+        if len(entries) != len(episode_shots):
+            return None
+        for position, (entry, shot) in enumerate(zip(entries, episode_shots)):
+            shot_id = shot.get("id", position + 1)
+            if entry.get("id") != shot_id or entry.get("duration") != shot.get("duration"):
+                return None
+            audio_path = self.shot_audio_path(episode_id, shot_id)
+            current = file_sha256(audio_path) if audio_path.exists() else None
+            if entry.get("audio") != current:
+                return None
+        return track_path
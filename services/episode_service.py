@@ -1,29 +1,71 @@
 """Episode 完整流程服务"""
+import contextvars
 import json
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import Dict, Any, Optional
+from typing import Dict, Any, Optional, List, Union
 
 from .image_service import ImageService
 from .srt_service import SRTService
 from .video_service import VideoService
 from .audio_service import AudioService
+from .jobs import JobCancelled
+from .render_manifest import RenderManifest, fingerprint
+from .stage_graph import Stage, StageGraph
+
+
+def _generate_audio(
+    episode_data: Dict[str, Any],
+    episode_id: int,
+    audio_service: Optional[AudioService] = None,
+    track_format: Optional[str] = None,
+) -> List[Path]:
+    """音频阶段（可在独立进程中执行，此时在子进程中创建 AudioService）：失败时返回空列表，视频不带音轨"""
+    try:
+        return (audio_service or AudioService(track_format=track_format)).generate_audio(episode_data, episode_id)
+    except JobCancelled:
+        raise
+    except Exception as e:
+        # 如果音频生成失败，记录错误但继续处理
+        print(f"警告: 音频生成失败: {e}")
+        return []
 
 
 class EpisodeService:
     """Episode 完整流程服务"""
 
-    def __init__(self, comfy_url: str = "http://127.0.0.1:8188", comfy_root: str = None):
+    def __init__(
+        self,
+        comfy_url: Union[str, List[str]] = "http://127.0.0.1:8188",
+        comfy_root: str = None,
+        checkpoint_affinity: bool = False,
+        affinity_inflight: int = 2,
+        audio_executor: str = "thread",
+        video_options: Optional[Dict[str, Any]] = None,
+        audio_track: Optional[str] = None,
+    ):
         """
         初始化服务
 
         Args:
-            comfy_url: ComfyUI 服务地址
+            comfy_url: ComfyUI 服务地址；传入地址列表（或逗号分隔的字符串）时使用多后端池
             comfy_root: ComfyUI 根目录（已废弃，保留用于兼容性，不再使用）
+            checkpoint_affinity: 是否按 checkpoint 亲和性调度 ComfyUI 提交（见 ImageService）
+            affinity_inflight: 亲和性调度时每个 ComfyUI 队列中最多保留的任务数
+            audio_executor: 音频阶段的执行方式，"thread" 在当前进程的线程中执行（复用进程内共享的
+                TTS 后端，合成本身在 TTS 工作进程中进行），"process" 在独立进程中执行（每次渲染都重新
+                启动 TTS 后端）
+            video_options: 传给 VideoService 的编码参数（如 profile、preset、crf、tune、gop、renditions）
+            audio_track: 整集音轨格式（"wav" 或 "aac"，见 AudioService.TRACK_FORMATS）。设置时配音拼接为
+                一条整集音轨，视频片段只编码画面，拼接时音轨直接流复制（同时输出 HLS 时仍按镜头合并配音）
         """
-        self.image_service = ImageService(comfy_url, comfy_root)
+        self.audio_executor = audio_executor
+        self.image_service = ImageService(
+            comfy_url, comfy_root, checkpoint_affinity=checkpoint_affinity, affinity_inflight=affinity_inflight
+        )
         self.srt_service = SRTService()
-        self.video_service = VideoService()
-        self.audio_service = AudioService()
+        self.video_service = VideoService(**(video_options or {}))
+        self.audio_service = AudioService(track_format=audio_track)
         # services/ -> 项目根目录（使用绝对路径）
         self.project_root = Path(__file__).resolve().parent.parent
 
@@ -31,58 +73,300 @@ class EpisodeService:
         self,
         episode_data: Dict[str, Any],
         episode_id: Optional[int] = None,
+        force: bool = False,
+        hls: bool = False,
     ) -> Dict[str, Any]:
         """
-        完整渲染 episode（图片 + 字幕 + 音频 + 视频）
+        完整渲染 episode（图片 + 字幕 + 音频 + 视频，视频按 VideoService 的输出档位各生成一个文件）
+
+        增量渲染：output/episode_XXX.manifest.json 记录每个 shot 的图片/音频以及整集视频的输入指纹，
+        只重建输入发生变化或文件缺失的产物（如只修改了一句字幕，只重新生成该 shot 的配音和视频）。
 
         Args:
             episode_data: episode JSON 数据
             episode_id: episode ID，如果不提供则从 episode_data 中读取
+            force: 忽略清单，重建全部产物
+            hls: 同时输出 HLS（见 hls_dir），视频阶段每编码完一个镜头播放列表就增长一段
 
         Returns:
-            渲染结果字典，包含图片、字幕、音频、视频路径
+            渲染结果字典，包含图片、字幕、音频、视频路径，各阶段耗时和本次重建的产物
         """
         if episode_id is None:
             episode_id = episode_data.get("episode_id", 1)
 
-        # 1. 生成图片
-        image_paths = self.image_service.generate_images(episode_data)
+        output_dir = self.project_root / "output"
+        manifest = RenderManifest(output_dir / f"episode_{episode_id:03d}.manifest.json")
+        # 没有 id 的 shot 按在整集中的位置编号并写入 shot：图片和配音只重建部分 shot 时，
+        # generate_images/generate_audio 按子集中的位置编号会与整集的编号错开
+        episode_data = {
+            **episode_data,
+            "shots": [{**shot, "id": shot.get("id", index + 1)} for index, shot in enumerate(episode_data["shots"])],
+        }
+        shots = [(shot["id"], shot) for shot in episode_data["shots"]]
+
+        # 图片：prompt 输入（模板、prompt、seed、workflow_params）；音频：字幕、说话者、声音配置和时长
+        image_fps = self.image_service.shot_fingerprints(episode_data)
+        audio_fps = {
+            shot_id: fingerprint(
+                shot.get("subtitles", []),
+                shot.get("speaker"),
+                self.audio_service.voice_config_for_shot(episode_data, shot),
+                shot.get("duration"),
+            )
+            for shot_id, shot in shots
+        }
+        stale_images = [
+            (shot_id, shot) for shot_id, shot in shots
+            if force or not manifest.is_fresh(
+                f"shot:{shot_id}:image", image_fps[shot_id], self.image_service.shot_image_path(shot)
+            )
+        ]
+        stale_audio = [
+            (shot_id, shot) for shot_id, shot in shots
+            if shot.get("subtitles") and (force or not manifest.is_fresh(
+                f"shot:{shot_id}:audio", audio_fps[shot_id], self.audio_service.shot_audio_path(episode_id, shot_id)
+            ))
+        ]
+        print(
+            f"增量渲染: 需要重建 {len(stale_images)}/{len(shots)} 张图片、"
+            f"{len(stale_audio)}/{sum(1 for _, shot in shots if shot.get('subtitles'))} 段配音"
+        )
+
+        def build_images() -> List[Path]:
+            # 每张图片一到就在线程池中缩放补边到渲染分辨率（结果进入缓存），与其余图片的生成重叠
+            context = contextvars.copy_context()
+            with ThreadPoolExecutor(max_workers=self.video_service.frame_workers, thread_name_prefix="frame") as pool:
+                frames = []
+
+                def prepare(path: Path):
+                    frames.append(pool.submit(context.copy().run, self.video_service.prepare_frame, path))
+
+                stale_ids = {shot_id for shot_id, _ in stale_images}
+                for shot_id, shot in shots:
+                    if shot_id not in stale_ids and self.image_service.shot_image_path(shot).exists():
+                        prepare(self.image_service.shot_image_path(shot))
+                if stale_images:
+                    self.image_service.generate_images(
+                        {**episode_data, "shots": [shot for _, shot in stale_images]}, on_image=prepare
+                    )
+                    for shot_id, shot in stale_images:
+                        if self.image_service.shot_image_path(shot).exists():
+                            manifest.record(f"shot:{shot_id}:image", image_fps[shot_id])
+                for future in frames:
+                    try:
+                        future.result()
+                    except JobCancelled:
+                        raise
+                    except Exception as e:
+                        # 预处理只是加速，失败时视频阶段会重新缩放
+                        print(f"警告: 图片预处理失败: {e}")
+            paths = [self.image_service.shot_image_path(shot) for _, shot in shots]
+            return [path for path in paths if path.exists()]
+
+        # 重建前删除过期的配音，生成失败的 shot 不会误用旧文件
+        for shot_id, _ in stale_audio:
+            manifest.invalidate(f"shot:{shot_id}:audio")
+            self.audio_service.shot_audio_path(episode_id, shot_id).unlink(missing_ok=True)
+        stale_audio_data = {**episode_data, "shots": [shot for _, shot in stale_audio]}
+
+        def record_audio() -> List[Path]:
+            for shot_id, _ in stale_audio:
+                if self.audio_service.shot_audio_path(episode_id, shot_id).exists():
+                    manifest.record(f"shot:{shot_id}:audio", audio_fps[shot_id])
+            paths = [self.audio_service.shot_audio_path(episode_id, shot_id) for shot_id, shot in shots if shot.get("subtitles")]
+            return [path for path in paths if path.exists()]
+
+        video_path = output_dir / f"episode_{episode_id:03d}.mp4"
+        hls_dir = self.hls_dir(episode_id)
+        rebuilt = {
+            "images": [shot_id for shot_id, _ in stale_images],
+            "audio": [shot_id for shot_id, _ in stale_audio],
+            "video": False,
+        }
+
+        def build_audio_track() -> Optional[Path]:
+            # HLS 分片按镜头合并配音，不使用整集音轨；音轨与各 shot 配音一致时沿用
+            if self.audio_service.track_format is None or hls:
+                return None
+            return (
+                self.audio_service.load_episode_track(episode_data, episode_id)
+                or self.audio_service.build_episode_track(episode_data, episode_id)
+            )
+
+        def build_video() -> Dict[str, Path]:
+            srt_path = graph.results["srt"]
+            audio_paths = graph.results["audio_manifest"]
+            audio_track = graph.results["audio_track"]
+            # 视频的输入：实际使用的每个 shot 的图片/音频指纹、时长和字幕内容
+            video_fp = fingerprint(
+                [
+                    (
+                        shot_id,
+                        image_fps[shot_id] if self.image_service.shot_image_path(shot).exists() else None,
+                        audio_fps[shot_id] if self.audio_service.shot_audio_path(episode_id, shot_id) in audio_paths else None,
+                        shot.get("duration"),
+                    )
+                    for shot_id, shot in shots
+                ],
+                Path(srt_path).read_text(encoding="utf-8"),
+                self.video_service.render_params(),
+                self.audio_service.track_format if audio_track is not None else None,
+            )
+            outputs = self.video_service.rendition_paths(video_path)
+            expected = list(outputs.values()) + ([hls_dir / "master.m3u8"] if hls else [])
+            if not force and manifest.is_fresh("video", video_fp) and all(p.exists() for p in expected):
+                return outputs
+            manifest.invalidate("video")
+            outputs = self._render_video(
+                episode_data, episode_id, srt_path, audio_paths, video_path, hls_dir if hls else None, audio_track
+            )
+            manifest.record("video", video_fp)
+            rebuilt["video"] = True
+            return outputs
+
+        if not stale_audio:
+            # 配音全部沿用时不必启动 TTS 进程
+            audio_stage = Stage("audio", list)
+        elif self.audio_executor == "process":
+            # 进程阶段的参数需要 pickle，AudioService（持有 TTS 引擎）在子进程中重新创建，不复用共享的 TTS 后端
+            audio_stage = Stage(
+                "audio",
+                _generate_audio,
+                args=(stale_audio_data, episode_id, None, self.audio_service.track_format),
+                executor="process",
+            )
+        else:
+            audio_stage = Stage("audio", _generate_audio, args=(stale_audio_data, episode_id, self.audio_service))
+
+        # 图片（远程 GPU）、字幕和音频（本地 CPU）互不依赖，并发执行；视频等三者都完成后开始。
+        # 在渲染任务中执行时，各阶段的耗时记录到任务状态，取消时正在执行的阶段全部停止
+        graph = StageGraph([
+            Stage("images", build_images),
+            Stage("srt", self.srt_service.generate_srt, args=(episode_data, episode_id)),
+            audio_stage,
+            # 在主进程中记录配音指纹，并收集全部 shot 的配音（包括沿用的）
+            Stage("audio_manifest", record_audio, deps=("audio",)),
+            # 启用整集音轨时把各 shot 配音拼接为一条音轨
+            Stage("audio_track", build_audio_track, deps=("audio_manifest",)),
+            Stage("video", build_video, deps=("images", "srt", "audio_manifest", "audio_track")),
+        ])
+        results = graph.run()
+        print(f"阶段耗时: {graph.timings}，关键路径: {' -> '.join(graph.critical_path())}")
+
+        image_paths = results["images"]
+        audio_paths = results["audio_manifest"]
+        renditions = results["video"]
+        return {
+            "episode_id": episode_id,
+            "images": [str(p) for p in image_paths],
+            "srt": str(results["srt"]),
+            "audio": [str(p) for p in audio_paths] if audio_paths else [],
+            "audio_track": str(results["audio_track"]) if results["audio_track"] else None,
+            "video": str(renditions[self.video_service.renditions[0].name]),
+            "renditions": {name: str(path) for name, path in renditions.items()},
+            "hls": str(hls_dir / "master.m3u8") if hls else None,
+            "stages": graph.timings,
+            "critical_path": graph.critical_path(),
+            "rebuilt": rebuilt,
+        }
+
+    def render_draft(self, episode_data: Dict[str, Any], episode_id: Optional[int] = None) -> Dict[str, Any]:
+        """
+        快速预览：只用已经存在的图片和配音渲染整集的低质量视频，不调用 ComfyUI 和 TTS
+
+        缺少图片的镜头使用占位画面，缺少配音的镜头为静音，镜头时长和字幕与完整渲染相同。
+        不读写增量渲染清单，输出写入 output/episode_XXX_draft.mp4，不覆盖完整渲染的视频。
+
+        Args:
+            episode_data: episode JSON 数据
+            episode_id: episode ID，如果不提供则从 episode_data 中读取
+
+        Returns:
+            渲染结果字典，包含字幕、视频路径，以及使用占位画面和静音的 shot
+        """
+        if episode_id is None:
+            episode_id = episode_data.get("episode_id", 1)
+        # 已经按 draft 质量创建的 VideoService（如请求中指定了编码参数）直接使用
+        video_service = self.video_service if self.video_service.quality == "draft" else VideoService(quality="draft")
 
-        # 2. 生成字幕
         srt_path = self.srt_service.generate_srt(episode_data, episode_id)
+        images = []
+        durations = []
+        shot_audio = []
+        placeholders = []
+        silent = []
+        for index, shot in enumerate(episode_data["shots"]):
+            shot_id = shot.get("id", index + 1)
+            image_path = self.image_service.shot_image_path(shot)
+            if not image_path.exists():
+                image_path = video_service.placeholder_frame()
+                placeholders.append(shot_id)
+            audio_path = self.audio_service.shot_audio_path(episode_id, shot_id)
+            if not audio_path.exists():
+                audio_path = None
+                if shot.get("subtitles"):
+                    silent.append(shot_id)
+            images.append(image_path)
+            durations.append(shot["duration"])
+            shot_audio.append(audio_path)
+
+        video_path = self.project_root / "output" / f"episode_{episode_id:03d}_draft.mp4"
+        renditions = video_service.render_renditions(
+            images, durations, srt_path, video_path,
+            audio_files=shot_audio if any(audio is not None for audio in shot_audio) else None,
+        )
+        return {
+            "episode_id": episode_id,
+            "quality": "draft",
+            "srt": str(srt_path),
+            "audio": [str(p) for p in shot_audio if p is not None],
+            "video": str(renditions[video_service.renditions[0].name]),
+            "renditions": {name: str(path) for name, path in renditions.items()},
+            "placeholders": placeholders,
+            "silent": silent,
+        }
 
-        # 3. 生成音频
-        try:
-            audio_paths = self.audio_service.generate_audio(episode_data, episode_id)
-        except Exception as e:
-            # 如果音频生成失败，记录错误但继续处理
-            print(f"警告: 音频生成失败: {e}")
-            audio_paths = []
+    def _render_video(
+        self,
+        episode_data: Dict[str, Any],
+        episode_id: int,
+        srt_path: Path,
+        audio_paths: List[Path],
+        video_path: Path,
+        hls_dir: Optional[Path] = None,
+        audio_track: Optional[Path] = None,
+    ) -> Dict[str, Path]:
+        """
+        视频阶段：收集已生成的图片，渲染全部输出档位（如果生成了音频，则合并音频轨道）
 
-        # 4. 准备视频渲染参数
+        整集音轨按全部镜头的时长排列，有镜头缺少图片时时间轴对不上，改为按镜头合并配音。
+        """
         images = []
         durations = []
-        for shot in episode_data["shots"]:
+        shot_audio = []
+        available_audio = set(audio_paths)
+        for index, shot in enumerate(episode_data["shots"]):
             # 使用 output 字段作为图片路径
             image_path = self.project_root / shot.get("image", shot.get("output", ""))
             if image_path.exists():
                 images.append(image_path)
                 durations.append(shot["duration"])
+                # 按镜头对齐配音，没有配音的镜头在片段中补静音
+                audio_path = self.audio_service.shot_audio_path(episode_id, shot.get("id", index + 1))
+                shot_audio.append(audio_path if audio_path in available_audio else None)
 
-        # 5. 渲染视频（如果生成了音频，则合并音频轨道）
-        video_path = self.project_root / "output" / f"episode_{episode_id:03d}.mp4"
-        video_path = self.video_service.render_video(
+        if len(images) != len(episode_data["shots"]):
+            audio_track = None
+        return self.video_service.render_renditions(
             images, durations, srt_path, video_path,
-            audio_files=audio_paths if audio_paths else None
+            audio_files=shot_audio if audio_paths else None,
+            hls_dir=hls_dir,
+            audio_track=audio_track,
         )
 
-        return {
-            "episode_id": episode_id,
-            "images": [str(p) for p in image_paths],
-            "srt": str(srt_path),
-            "audio": [str(p) for p in audio_paths] if audio_paths else [],
-            "video": str(video_path),
-        }
+    def hls_dir(self, episode_id: int) -> Path:
+        """episode 的 HLS 输出目录（master.m3u8 和各档位的播放列表、分片）"""
+        return self.project_root / "output" / "hls" / f"episode_{episode_id:03d}"
 
     def load_episode(self, episode_id: int) -> Dict[str, Any]:
         """
@@ -0,0 +1,203 @@
+"""受管的 ffmpeg 运行器：解析 -progress 输出、保留有限的 stderr、统计编码速度"""
+import subprocess
+import threading
+import time
+import uuid
+from collections import deque
+from typing import Dict, Any, Callable, List, Optional
+
+from .jobs import current_job
+
+
+class FFmpegError(subprocess.CalledProcessError):
+    """ffmpeg 以非零退出码结束，stderr 为最后若干行输出"""
+
+    # 错误信息中附带的 stderr 行数
+    MESSAGE_LINES = 20
+
+    def __str__(self) -> str:
+        tail = "\n".join((self.stderr or "").splitlines()[-self.MESSAGE_LINES:])
+        return f"ffmpeg 执行失败（退出码 {self.returncode}）:\n{tail}"
+
+
+class FFmpegProgress:
+    """一次 -progress 汇报"""
+
+    def __init__(
+        self,
+        label: str,
+        out_time: float,
+        duration: Optional[float] = None,
+        speed: Optional[float] = None,
+        fps: Optional[float] = None,
+        frame: Optional[int] = None,
+        done: bool = False,
+    ):
+        self.label = label
+        self.out_time = out_time
+        self.duration = duration
+        self.speed = speed
+        self.fps = fps
+        self.frame = frame
+        self.done = done
+
+    @property
+    def ratio(self) -> Optional[float]:
+        """完成比例（不知道总时长时为 None）"""
+        if not self.duration:
+            return None
+        return min(1.0, self.out_time / self.duration)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "label": self.label,
+            "out_time": round(self.out_time, 3),
+            "duration": self.duration,
+            "progress": None if self.ratio is None else round(self.ratio, 3),
+            "speed": self.speed,
+            "fps": self.fps,
+            "frame": self.frame,
+        }
+
+
+class FFmpegStats:
+    """按用途（label）累计 ffmpeg 的运行次数、失败次数、输出的媒体时长和耗时，用于容量规划"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._labels: Dict[str, Dict[str, float]] = {}
+
+    def record(self, label: str, media_seconds: float, wall_seconds: float, ok: bool = True):
+        with self._lock:
+            entry = self._labels.setdefault(
+                label, {"runs": 0, "failures": 0, "media_seconds": 0.0, "wall_seconds": 0.0}
+            )
+            entry["runs"] += 1
+            if not ok:
+                entry["failures"] += 1
+            entry["media_seconds"] += media_seconds
+            entry["wall_seconds"] += wall_seconds
+
+    def snapshot(self) -> Dict[str, Dict[str, float]]:
+        """
+        Returns:
+            label -> {"runs", "failures", "media_seconds", "wall_seconds", "speed"}，
+            speed 为输出媒体时长 / 耗时（实时倍数）
+        """
+        with self._lock:
+            return {label: _with_speed(entry) for label, entry in self._labels.items()}
+
+
+def _with_speed(entry: Dict[str, float]) -> Dict[str, float]:
+    result = {name: round(value, 3) if isinstance(value, float) else value for name, value in entry.items()}
+    wall = entry["wall_seconds"]
+    result["speed"] = round(entry["media_seconds"] / wall, 3) if wall > 0 else None
+    return result
+
+
+# 进程内全部 ffmpeg 调用的累计统计
+stats = FFmpegStats()
+
+
+def _parse_float(value: Optional[str]) -> Optional[float]:
+    if value is None:
+        return None
+    try:
+        return float(value.rstrip("x"))
+    except ValueError:
+        return None
+
+
+def run_ffmpeg(
+    cmd: List[str],
+    label: str = "ffmpeg",
+    duration: Optional[float] = None,
+    on_progress: Optional[Callable[[FFmpegProgress], None]] = None,
+    stderr_lines: int = 200,
+) -> subprocess.CompletedProcess:
+    """
+    运行 ffmpeg（cmd[0] 为 ffmpeg 可执行文件），用 -progress pipe:1 实时解析进度
+
+    在任务中执行时：子进程登记到当前任务（取消时被杀掉并抛出 JobCancelled），进度写入任务的
+    ffmpeg 状态，结束后累计到任务和全局的编码速度统计。
+
+    Args:
+        cmd: ffmpeg 命令
+        label: 用途（如 "segment"、"concat"、"audio"），统计按 label 汇总
+        duration: 预期输出时长（秒），用于计算完成比例；ffmpeg 没有汇报进度时作为输出时长计入统计
+        on_progress: 每次进度汇报的回调
+        stderr_lines: 保留的 stderr 行数（出错时附在异常中）
+
+    Returns:
+        subprocess.CompletedProcess（stderr 为保留的最后若干行）
+
+    Raises:
+        FFmpegError: 退出码非零
+    """
+    cmd = [cmd[0], "-hide_banner", "-nostats", "-progress", "pipe:1", *cmd[1:]]
+    job = current_job()
+    if job is not None:
+        job.raise_if_cancelled()
+    run_id = f"{label}:{uuid.uuid4().hex[:8]}"
+    stderr_tail: deque = deque(maxlen=stderr_lines)
+    last: Optional[FFmpegProgress] = None
+    started = time.monotonic()
+
+    with subprocess.Popen(
+        cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, errors="replace", bufsize=1
+    ) as proc:
+        if job is not None:
+            job.attach_process(proc)
+
+        def drain_stderr():
+            for line in proc.stderr:
+                stderr_tail.append(line.rstrip("\n"))
+
+        stderr_thread = threading.Thread(target=drain_stderr, daemon=True)
+        stderr_thread.start()
+        try:
+            block: Dict[str, str] = {}
+            for line in proc.stdout:
+                key, _, value = line.strip().partition("=")
+                if key != "progress":
+                    block[key] = value
+                    continue
+                out_us = _parse_float(block.get("out_time_us"))
+                frame = _parse_float(block.get("frame"))
+                last = FFmpegProgress(
+                    label,
+                    out_time=max(0.0, out_us / 1e6) if out_us is not None else (last.out_time if last else 0.0),
+                    duration=duration,
+                    speed=_parse_float(block.get("speed")),
+                    fps=_parse_float(block.get("fps")),
+                    frame=int(frame) if frame is not None else None,
+                    done=value == "end",
+                )
+                block = {}
+                if job is not None:
+                    job.update_ffmpeg(run_id, last.to_dict())
+                if on_progress is not None:
+                    on_progress(last)
+            proc.wait()
+        except BaseException:
+            proc.kill()
+            raise
+        finally:
+            stderr_thread.join()
+            if job is not None:
+                job.detach_process(proc)
+
+    wall = time.monotonic() - started
+    ok = proc.returncode == 0
+    if last is not None and last.out_time > 0:
+        media = last.out_time
+    else:
+        media = (duration or 0.0) if ok else 0.0
+    stats.record(label, media, wall, ok)
+    if job is not None:
+        job.finish_ffmpeg(run_id, label, media, wall)
+        job.raise_if_cancelled()
+    stderr = "\n".join(stderr_tail)
+    if not ok:
+        raise FFmpegError(proc.returncode, cmd, output="", stderr=stderr)
+    return subprocess.CompletedProcess(cmd, proc.returncode, "", stderr)
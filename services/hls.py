@@ -0,0 +1,169 @@
+"""HLS 输出：渲染过程中按镜头顺序追加分片，播放列表持续增长"""
+import hashlib
+import math
+import os
+import shutil
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple, Union
+
+from .ffmpeg_runner import run_ffmpeg
+from .image_cache import file_sha256
+from .srt_service import format_vtt
+
+
+# ffmpeg 的 mpegts 封装默认把时间戳整体后移 1.4 秒，WebVTT 的 X-TIMESTAMP-MAP 按此对齐到画面
+MPEGTS_START = 126000
+
+
+def _write_atomic(path: Path, text: str):
+    """先写临时文件再替换，播放器不会读到写了一半的播放列表"""
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    tmp.write_text(text, encoding="utf-8")
+    os.replace(tmp, path)
+
+
+def _bandwidth(rendition) -> int:
+    """master 播放列表中的 BANDWIDTH（比特/秒）：有码率上限时取上限，否则按分辨率估算；另加 128k 音频"""
+    if rendition.bitrate:
+        number = rendition.bitrate.rstrip("kKmM")
+        unit = rendition.bitrate[len(number):].lower()
+        video = float(number) * {"": 1, "k": 1000, "m": 1000 ** 2}[unit]
+    else:
+        video = rendition.width * rendition.height * 2
+    return int(video) + 128000
+
+
+class HLSWriter:
+    """
+    边编码边写 HLS
+
+    目录结构为 <hls_dir>/master.m3u8 和 <hls_dir>/<档位名>/index.m3u8。每个镜头的片段编码完成后
+    （按 episode_data["shots"] 的顺序）转封装为 MPEG-TS 分片并追加到该档位的播放列表。
+    分片按内容哈希命名，内容不变时 URL 不变，可以被长期缓存。播放列表类型为 EVENT，
+    第一个镜头编码完成即可开始播放，全部完成后写入 EXT-X-ENDLIST。
+    软字幕时另有 <hls_dir>/subs/index.m3u8 字幕播放列表，每个镜头一个 WebVTT 分片。
+    """
+
+    # 字幕播放列表的目录名（不能与档位名相同）
+    SUBTITLES_NAME = "subs"
+
+    def __init__(
+        self,
+        hls_dir: Union[str, Path],
+        renditions: List,
+        durations: List[float],
+        subtitles: bool = False,
+    ):
+        """
+        清空目录并写入空的播放列表
+
+        Args:
+            hls_dir: 输出目录
+            renditions: 输出档位（Rendition 列表）
+            durations: 每个镜头的时长，用于确定 EXT-X-TARGETDURATION
+            subtitles: 是否输出 WebVTT 字幕播放列表（片段不含烧录字幕时使用）
+        """
+        self.hls_dir = Path(hls_dir)
+        self.renditions = renditions
+        self.target_duration = max(1, math.ceil(max(durations, default=1)))
+        self.offset = 0.0
+        # 档位名 -> [(时长, 分片文件名)]
+        self.entries: Dict[str, List[Tuple[float, str]]] = {r.name: [] for r in renditions}
+        self.subtitles = subtitles
+        if subtitles:
+            if self.SUBTITLES_NAME in self.entries:
+                raise ValueError(f"输出档位名不能为 {self.SUBTITLES_NAME}")
+            self.entries[self.SUBTITLES_NAME] = []
+
+        # 旧的分片和播放列表来自上一次渲染，整体清空
+        shutil.rmtree(self.hls_dir, ignore_errors=True)
+        for name in self.entries:
+            (self.hls_dir / name).mkdir(parents=True, exist_ok=True)
+            self._write_playlist(name, ended=False)
+        lines = ["#EXTM3U", "#EXT-X-VERSION:3"]
+        stream_attrs = ""
+        if subtitles:
+            lines.append(
+                f'#EXT-X-MEDIA:TYPE=SUBTITLES,GROUP-ID="{self.SUBTITLES_NAME}",NAME="中文",LANGUAGE="zh",'
+                f'DEFAULT=YES,AUTOSELECT=YES,URI="{self.SUBTITLES_NAME}/index.m3u8"'
+            )
+            stream_attrs = f',SUBTITLES="{self.SUBTITLES_NAME}"'
+        for rendition in renditions:
+            lines.append(
+                f"#EXT-X-STREAM-INF:BANDWIDTH={_bandwidth(rendition)},"
+                f"RESOLUTION={rendition.width}x{rendition.height}{stream_attrs}"
+            )
+            lines.append(f"{rendition.name}/index.m3u8")
+        _write_atomic(self.master_path, "\n".join(lines) + "\n")
+
+    @property
+    def master_path(self) -> Path:
+        return self.hls_dir / "master.m3u8"
+
+    def add(
+        self,
+        segments: Dict[str, Path],
+        duration: float,
+        cues: Optional[List[Tuple[float, float, str]]] = None,
+    ):
+        """
+        追加下一个镜头
+
+        Args:
+            segments: 档位名 -> 该镜头编码好的 MP4 片段
+            duration: 镜头时长（秒）
+            cues: 该镜头的字幕（相对镜头开始的时间），输出字幕播放列表时使用
+        """
+        for name, segment in segments.items():
+            tmp = self.hls_dir / name / f".segment.{os.getpid()}.{threading.get_ident()}.tmp.ts"
+            # 各镜头的片段时间戳都从 0 开始，转封装时平移到镜头在整集中的位置，分片之间时间戳连续
+            cmd = [
+                "ffmpeg",
+                "-y",
+                "-i", str(segment),
+                "-c", "copy",
+                "-output_ts_offset", f"{self.offset:.3f}",
+                "-f", "mpegts",
+                str(tmp),
+            ]
+            try:
+                run_ffmpeg(cmd, label="hls", duration=duration)
+                # 按转封装后的内容命名（含时间戳偏移），相同画面出现在不同位置时不会互相覆盖
+                filename = f"{file_sha256(tmp)[:16]}.ts"
+                os.replace(tmp, self.hls_dir / name / filename)
+            finally:
+                tmp.unlink(missing_ok=True)
+            self.entries[name].append((duration, filename))
+            self._write_playlist(name, ended=False)
+        if self.subtitles:
+            # 字幕时间为整集时间，没有字幕的镜头也写一个空分片，与画面分片一一对应
+            text = format_vtt(
+                [(start + self.offset, end + self.offset, line) for start, end, line in cues or []],
+                timestamp_map=f"MPEGTS:{MPEGTS_START},LOCAL:00:00:00.000",
+            )
+            filename = f"{hashlib.sha256(text.encode('utf-8')).hexdigest()[:16]}.vtt"
+            _write_atomic(self.hls_dir / self.SUBTITLES_NAME / filename, text)
+            self.entries[self.SUBTITLES_NAME].append((duration, filename))
+            self._write_playlist(self.SUBTITLES_NAME, ended=False)
+        self.offset += duration
+
+    def finish(self):
+        """全部镜头已追加，写入 EXT-X-ENDLIST"""
+        for name in self.entries:
+            self._write_playlist(name, ended=True)
+
+    def _write_playlist(self, name: str, ended: bool):
+        lines = [
+            "#EXTM3U",
+            "#EXT-X-VERSION:3",
+            f"#EXT-X-TARGETDURATION:{self.target_duration}",
+            "#EXT-X-MEDIA-SEQUENCE:0",
+            "#EXT-X-PLAYLIST-TYPE:EVENT",
+        ]
+        for duration, filename in self.entries[name]:
+            lines.append(f"#EXTINF:{duration:.3f},")
+            lines.append(filename)
+        if ended:
+            lines.append("#EXT-X-ENDLIST")
+        _write_atomic(self.hls_dir / name / "index.m3u8", "\n".join(lines) + "\n")
@@ -0,0 +1,164 @@
+"""内容寻址的文件缓存（生成的图片、编码好的视频片段）"""
+import copy
+import hashlib
+import json
+import os
+import shutil
+import threading
+from pathlib import Path
+from typing import Dict, Any, Optional, Union
+
+
+def workflow_cache_key(workflow: Dict[str, Any]) -> str:
+    """
+    计算注入后 workflow 的稳定哈希
+
+    输出文件名前缀不影响生成结果，不参与哈希；checkpoint 名称和输出尺寸单独列入，
+    保证换模型或换分辨率时不会命中旧图。
+
+    Args:
+        workflow: inject 之后的 workflow（包含 "prompt" 键或直接是 prompt 字典）
+
+    Returns:
+        十六进制 sha256
+    """
+    prompt = workflow["prompt"] if "prompt" in workflow else workflow
+    prompt = copy.deepcopy(prompt)
+
+    checkpoints = []
+    dimensions = []
+    for node_id in sorted(prompt):
+        node = prompt[node_id]
+        inputs = node.get("inputs", {})
+        class_type = node.get("class_type")
+        if class_type == "SaveImage":
+            inputs.pop("filename_prefix", None)
+        elif class_type == "CheckpointLoaderSimple":
+            checkpoints.append(inputs.get("ckpt_name"))
+        elif class_type == "EmptyLatentImage":
+            dimensions.append([inputs.get("width"), inputs.get("height")])
+
+    material = {"prompt": prompt, "checkpoints": checkpoints, "dimensions": dimensions}
+    encoded = json.dumps(material, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+
+def link_or_copy(src: Path, dst: Path):
+    """把 src 放到 dst：优先硬链接，跨设备等失败时复制；通过临时文件原子替换"""
+    dst.parent.mkdir(parents=True, exist_ok=True)
+    if dst.exists() and os.path.samefile(src, dst):
+        return
+    tmp = dst.with_name(f".{dst.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    try:
+        os.link(src, tmp)
+    except OSError:
+        shutil.copy2(src, tmp)
+    os.replace(tmp, dst)
+
+
+class ContentCache:
+    """
+    内容寻址的文件缓存，按总大小做 LRU 淘汰
+
+    条目以 <key[:2]>/<key><suffix> 存放在 cache_dir 下，文件 mtime 作为最近使用时间。
+    """
+
+    def __init__(self, cache_dir: Union[str, Path], max_bytes: int = 2 * 1024 ** 3, suffix: str = ".png"):
+        """
+        初始化缓存
+
+        Args:
+            cache_dir: 缓存目录
+            max_bytes: 缓存总大小上限（字节）
+            suffix: 条目文件扩展名
+        """
+        self.cache_dir = Path(cache_dir)
+        self.max_bytes = max_bytes
+        self.suffix = suffix
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        # key -> (大小, 最近使用时间)，首次访问时扫描目录建立
+        self._index: Optional[Dict[str, Any]] = None
+
+    def _path(self, key: str) -> Path:
+        return self.cache_dir / key[:2] / f"{key}{self.suffix}"
+
+    def _load_index(self):
+        if self._index is not None:
+            return
+        self._index = {}
+        if self.cache_dir.exists():
+            for path in self.cache_dir.glob(f"*/*{self.suffix}"):
+                stat = path.stat()
+                self._index[path.stem] = (stat.st_size, stat.st_mtime)
+
+    def get(self, key: str, dst: Union[str, Path]) -> bool:
+        """
+        命中时把缓存文件放到 dst（硬链接或复制）
+
+        Returns:
+            是否命中
+        """
+        path = self._path(key)
+        with self._lock:
+            self._load_index()
+            if key not in self._index or not path.exists():
+                self._index.pop(key, None)
+                self.misses += 1
+                return False
+            self.hits += 1
+            os.utime(path)
+            self._index[key] = (self._index[key][0], path.stat().st_mtime)
+        link_or_copy(path, Path(dst))
+        return True
+
+    def contains(self, key: str) -> bool:
+        """是否已缓存（不计入命中统计，不更新最近使用时间）"""
+        with self._lock:
+            self._load_index()
+            return key in self._index and self._path(key).exists()
+
+    def put(self, key: str, src: Union[str, Path]):
+        """把生成好的文件存入缓存，并在超出上限时淘汰最久未使用的条目"""
+        path = self._path(key)
+        link_or_copy(Path(src), path)
+        stat = path.stat()
+        with self._lock:
+            self._load_index()
+            self._index[key] = (stat.st_size, stat.st_mtime)
+            self._evict()
+
+    def _evict(self):
+        total = sum(size for size, _ in self._index.values())
+        if total <= self.max_bytes:
+            return
+        for key, (size, _) in sorted(self._index.items(), key=lambda item: item[1][1]):
+            if total <= self.max_bytes:
+                break
+            self._path(key).unlink(missing_ok=True)
+            del self._index[key]
+            total -= size
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            self._load_index()
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "entries": len(self._index),
+                "bytes": sum(size for size, _ in self._index.values()),
+            }
+
+
+class ImageCache(ContentCache):
+    """按 workflow 哈希缓存生成的图片"""
+
+
+def file_sha256(path: Union[str, Path]) -> str:
+    """文件内容的 sha256（十六进制）"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
@@ -1,11 +1,17 @@
 """图片生成服务"""
-import json
+import hashlib
 import random
 from pathlib import Path
-from typing import Dict, Any, List
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Any, List, Optional, Tuple, Union
 
 from comfy.client import ComfyUIClient
-from comfy.workflow import inject
+from comfy.pool import ComfyUIPool
+from comfy.scheduler import AffinityScheduler
+from comfy.batch import batch_group_key, build_batch
+from comfy.workflow import CompiledWorkflow, load_template
+from .image_cache import ImageCache, workflow_cache_key
+from .jobs import Job, check_cancelled, current_job
 
 
 def build_prompt(character: Dict[str, Any], shot: Dict[str, Any]) -> str:
@@ -42,66 +48,384 @@ def build_prompt(character: Dict[str, Any], shot: Dict[str, Any]) -> str:
 class ImageService:
     """图片生成服务"""
 
-    def __init__(self, comfy_url: str = "http://127.0.0.1:8188", comfy_root: str = None):
+    def __init__(
+        self,
+        comfy_url: Union[str, List[str]] = "http://127.0.0.1:8188",
+        comfy_root: str = None,
+        download_workers: int = 4,
+        cache_dir: Optional[Union[str, Path]] = None,
+        cache_max_bytes: int = 2 * 1024 ** 3,
+        batch_size: int = 1,
+        checkpoint_affinity: bool = False,
+        affinity_inflight: int = 2,
+    ):
         """
         初始化服务
 
         Args:
-            comfy_url: ComfyUI 服务地址
+            comfy_url: ComfyUI 服务地址；传入地址列表（或逗号分隔的字符串）时使用多后端池
             comfy_root: ComfyUI 根目录（已废弃，保留用于兼容性，不再使用）
+            download_workers: 流水线模式下并发下载/保存图片的线程数
+            cache_dir: 图片缓存目录，默认 <项目根目录>/cache/images
+            cache_max_bytes: 图片缓存总大小上限（字节），为 0 时禁用缓存
+            batch_size: 合批模式下每个 prompt 最多包含的 shot 数（按 GPU 显存调整），1 表示不合批
+            checkpoint_affinity: 是否经由每个后端共享的调度器提交，让使用同一 checkpoint 的任务
+                （包括并发的其他 episode）连续执行，减少模型切换
+            affinity_inflight: 亲和性调度时每个 ComfyUI 队列中最多保留的任务数（见 AffinityScheduler）
         """
-        self.client = ComfyUIClient(comfy_url, comfy_root)
+        urls = comfy_url.split(",") if isinstance(comfy_url, str) else list(comfy_url)
+        if len(urls) > 1:
+            self.client = ComfyUIPool(urls, checkpoint_affinity=checkpoint_affinity, affinity_inflight=affinity_inflight)
+        else:
+            url = urls[0].strip()
+            scheduler = AffinityScheduler.shared(url, max_inflight=affinity_inflight) if checkpoint_affinity else None
+            self.client = ComfyUIClient(url, comfy_root, scheduler=scheduler)
+        self.download_workers = download_workers
+        self.batch_size = batch_size
         # services/ -> 项目根目录（使用绝对路径）
         self.project_root = Path(__file__).resolve().parent.parent
+        self.cache = None
+        if cache_max_bytes > 0:
+            self.cache = ImageCache(cache_dir or self.project_root / "cache" / "images", cache_max_bytes)
 
-    def generate_images(self, episode_data: Dict[str, Any]) -> List[str]:
+    def generate_images(
+        self,
+        episode_data: Dict[str, Any],
+        pipelined: bool = True,
+        use_cache: bool = True,
+        batch_size: Optional[int] = None,
+        on_image: Optional[Callable[[Path], None]] = None,
+    ) -> List[str]:
         """
         生成图片
 
         Args:
             episode_data: episode JSON 数据
+            pipelined: 是否流水线提交（一次性提交全部 shot，完成一个保存一个），
+                为 False 时逐个提交并等待
+            use_cache: 是否使用图片缓存（seed 为 -1 的 episode 始终绕过缓存）
+            batch_size: 每个 ComfyUI prompt 最多合并的 shot 数，None 时使用初始化参数
+            on_image: 每张图片保存后立即调用（缓存命中的图片最先回调，流水线模式下在下载线程中调用），
+                用于让后续处理与其余图片的生成重叠
 
         Returns:
-            生成的图片路径列表
+            生成的图片路径列表（按 shot 顺序）
         """
-        workflow_path = self.project_root / "workflows" / "image_gen.json"
-        with open(workflow_path, "r", encoding="utf-8") as f:
-            workflow_tpl = json.load(f)
+        # 模板按 mtime 缓存，只在文件修改后重新解析
+        template = load_template(self.project_root / "workflows" / "image_gen.json")
+        episode_params = episode_data.get("workflow_params", {})
 
-        generated_images = []
         base_seed = episode_data.get("seed", 123456)
         use_random_seed = (base_seed == -1)
+        # 随机 seed 的结果本就不可复现，不读也不写缓存
+        cacheable = use_cache and self.cache is not None and not use_random_seed
+        target_dir = str(self.project_root / "assets" / "images")
 
-        for shot in episode_data["shots"]:
+        # (占位符取值, workflow, 期望文件名, 缓存 key)
+        jobs = []
+        shot_ids = []
+        for index, shot in enumerate(episode_data["shots"]):
             prompt = build_prompt(episode_data["character"], shot)
-            
+
             # 为每个 shot 生成不同的 seed，确保生成的图片有变化
-            shot_id = shot.get("id", len(generated_images) + 1)
+            shot_id = shot.get("id", index + 1)
             if use_random_seed:
                 # 如果 seed 为 -1，每个 shot 都生成完全随机的 seed
                 shot_seed = random.randint(0, 2**31 - 1)
             else:
                 # 否则基于基础 seed 生成不同的 seed
                 shot_seed = base_seed + shot_id * 1000  # 每个 shot 的 seed 相差 1000
-            
-            workflow = inject(
-                workflow_tpl,
-                prompt,
-                shot_seed,  # 使用不同的 seed
-                shot["output"],
-            )
-            prompt_id = self.client.submit(workflow)
 
+            values = self._shot_values(episode_params, shot, prompt, shot_seed)
+            workflow = template.render(**values)
             # 从 output 路径中提取文件名
             expected_filename = Path(shot["output"]).name
+            cache_key = workflow_cache_key(workflow) if cacheable else None
+            jobs.append((values, workflow, expected_filename, cache_key))
+            shot_ids.append(shot_id)
+
+        batch_size = batch_size or self.batch_size
+        # 合批生成的图片按批次布局缓存：全部 shot 都未命中时会按这个布局合批
+        layout_keys = {}
+        if cacheable and batch_size > 1:
+            layout_keys = self._batch_cache_keys(self._plan_units(template, jobs, list(range(len(jobs))), batch_size))
+
+        job = current_job()
+        results: List[List[Path]] = [[] for _ in jobs]
+        misses = []
+        for index, (_, _, expected_filename, cache_key) in enumerate(jobs):
+            dst = Path(target_dir) / expected_filename
+            if cache_key and (
+                self.cache.get(cache_key, dst)
+                or (index in layout_keys and self.cache.get(layout_keys[index], dst))
+            ):
+                results[index] = [dst]
+                if job is not None:
+                    job.update_shot(shot_ids[index], image="cached")
+                if on_image is not None:
+                    on_image(dst)
+            else:
+                misses.append(index)
+
+        if misses:
+            print(f"图片缓存: 命中 {len(jobs) - len(misses)} 个，需要生成 {len(misses)} 个")
+            units = self._plan_units(template, jobs, misses, batch_size)
+            batch_keys = self._batch_cache_keys(units)
+            pending = [
+                (workflow, expected_filename, filename_map, [shot_ids[index] for index in members])
+                for workflow, expected_filename, filename_map, members in units
+            ]
+            if pipelined:
+                collected = self._generate_pipelined(pending, target_dir, on_image)
+            else:
+                collected = self._generate_sequential(pending, target_dir, on_image)
+
+            for (_, _, filename_map, members), images in zip(units, collected):
+                for index in members:
+                    if filename_map is None:
+                        results[index] = images
+                    else:
+                        # 合批 prompt：按文件名把图片拆回各自的 shot
+                        results[index] = [img for img in images if img.name == jobs[index][2]]
+                    cache_key = jobs[index][3]
+                    if cache_key and len(results[index]) == 1:
+                        self.cache.put(batch_keys.get(index, cache_key), results[index][0])
+
+        return [str(img) for images in results for img in images]
+
+    def shot_image_path(self, shot: Dict[str, Any]) -> Path:
+        """shot 图片的保存路径（generate_images 把图片保存在 assets/images 下，文件名取自 output）"""
+        return self.project_root / "assets" / "images" / Path(shot["output"]).name
+
+    @staticmethod
+    def _shot_values(episode_params: Dict[str, Any], shot: Dict[str, Any], prompt: str, seed: Any) -> Dict[str, Any]:
+        """shot 的占位符取值"""
+        # workflow_params 填充模板中的其他占位符（如 width/height/steps/negative_prompt），
+        # shot 级别覆盖 episode 级别
+        values = {**episode_params, **shot.get("workflow_params", {})}
+        values.update(
+            prompt=prompt,
+            seed=seed,  # 使用不同的 seed
+            output=shot["output"],
+        )
+        return values
+
+    def shot_fingerprints(self, episode_data: Dict[str, Any]) -> Dict[Any, str]:
+        """
+        计算各 shot 图片的输入指纹（workflow 模板、prompt、seed、workflow_params 和输出路径）
+
+        seed 为 -1 的 episode 以 "random" 参与计算：输入不变时沿用已经随机生成的图片。
+
+        Args:
+            episode_data: episode JSON 数据
+
+        Returns:
+            {shot id: 十六进制 sha256}
+        """
+        template = load_template(self.project_root / "workflows" / "image_gen.json")
+        episode_params = episode_data.get("workflow_params", {})
+        base_seed = episode_data.get("seed", 123456)
+
+        fingerprints = {}
+        for index, shot in enumerate(episode_data["shots"]):
+            shot_id = shot.get("id", index + 1)
+            seed = "random" if base_seed == -1 else base_seed + shot_id * 1000
+            prompt = build_prompt(episode_data["character"], shot)
+            workflow = template.render(**self._shot_values(episode_params, shot, prompt, seed))
+            material = f"{workflow_cache_key(workflow)}:{shot['output']}"
+            fingerprints[shot_id] = hashlib.sha256(material.encode("utf-8")).hexdigest()
+        return fingerprints
+
+    def _plan_units(
+        self,
+        template: CompiledWorkflow,
+        jobs: List[Tuple[Dict[str, Any], Dict[str, Any], str, Optional[str]]],
+        indexes: List[int],
+        batch_size: int,
+    ) -> List[Tuple[Dict[str, Any], Optional[str], Optional[Dict[str, List[str]]], List[int]]]:
+        """
+        把待生成的 shot 划分为提交单元
+
+        batch_size 大于 1 时，checkpoint、分辨率等参数相同的 shot 按 batch_size 分组，
+        每组合并为一个 prompt（见 comfy.batch.build_batch）。
+
+        Args:
+            template: 编译后的 workflow 模板
+            jobs: (占位符取值, workflow, 期望文件名, 缓存 key) 列表
+            indexes: 需要生成的 job 下标
+            batch_size: 每个 prompt 最多包含的 shot 数
+
+        Returns:
+            (workflow, 期望文件名, {输出节点 id: 文件名列表}, job 下标列表) 列表，
+            单个 shot 的单元使用期望文件名，合批单元使用文件名映射
+        """
+        if batch_size <= 1:
+            return [(jobs[index][1], jobs[index][2], None, [index]) for index in indexes]
+
+        groups: Dict[Tuple, List[int]] = {}
+        for index in indexes:
+            groups.setdefault(batch_group_key(jobs[index][0]), []).append(index)
 
-            images = self.client.collect_and_cleanup(
-                prompt_id,
-                target_dir=str(self.project_root / "assets" / "images"),
-                expected_filename=expected_filename,
+        units = []
+        for members in groups.values():
+            for start in range(0, len(members), batch_size):
+                chunk = members[start:start + batch_size]
+                if len(chunk) == 1:
+                    units.append((jobs[chunk[0]][1], jobs[chunk[0]][2], None, chunk))
+                    continue
+                workflow, outputs = build_batch(template, [jobs[index][0] for index in chunk])
+                filename_map = {
+                    node_id: [jobs[chunk[item]][2] for item in items]
+                    for node_id, items in outputs.items()
+                }
+                units.append((workflow, None, filename_map, chunk))
+
+        # 按 shot 顺序提交，先出现的 shot 先完成
+        units.sort(key=lambda unit: unit[3][0])
+        return units
+
+    @staticmethod
+    def _batch_cache_keys(
+        units: List[Tuple[Dict[str, Any], Optional[str], Optional[Dict[str, List[str]]], List[int]]],
+    ) -> Dict[int, str]:
+        """
+        合批单元中各 shot 的缓存 key
+
+        合批生成的图片与单独生成的不同（seed 偏移批次以第一个 shot 的 seed 为基准、按批次序号派生噪声），
+        不能存在单个 shot 的 key 下；key 由合批 workflow（包含批次大小和基准 seed）和 shot 在批次中的序号决定。
+
+        Args:
+            units: _plan_units 返回的提交单元
+
+        Returns:
+            {job 下标: 十六进制 sha256}，只包含合批单元中的 shot
+        """
+        keys = {}
+        for workflow, _, filename_map, members in units:
+            if filename_map is None:
+                continue
+            workflow_key = workflow_cache_key(workflow)
+            for position, index in enumerate(members):
+                material = f"{workflow_key}:batch:{len(members)}:{position}"
+                keys[index] = hashlib.sha256(material.encode("utf-8")).hexdigest()
+        return keys
+
+    def _track_prompt(self, job: Optional[Job], prompt_id: str, shot_ids: List[Any]):
+        """
+        在渲染任务中登记 ComfyUI 任务：任务取消时同时取消该 prompt，并上报 shot 状态
+
+        Returns:
+            取消 hook（不在渲染任务中执行时为 None），prompt 完成后传给 job.remove_cancel_hook
+        """
+        if job is None:
+            return None
+        for shot_id in shot_ids:
+            job.update_shot(shot_id, image="queued")
+        return job.add_cancel_hook(lambda: self.client.cancel(prompt_id))
+
+    def _generate_sequential(
+        self,
+        jobs: List[Tuple[Dict[str, Any], Optional[str], Optional[Dict[str, List[str]]], List[Any]]],
+        target_dir: str,
+        on_image: Optional[Callable[[Path], None]] = None,
+    ) -> List[List[Path]]:
+        """
+        逐个提交并等待
+
+        Args:
+            jobs: (workflow, 期望文件名, 文件名映射, shot id 列表) 列表
+            target_dir: 图片保存目录
+            on_image: 每张图片保存后的回调
+
+        Returns:
+            每个 job 收集到的图片路径列表
+        """
+        job = current_job()
+        collected = []
+        for workflow, expected_filename, filename_map, shot_ids in jobs:
+            check_cancelled()
+            prompt_id = self.client.submit(workflow)
+            hook = self._track_prompt(job, prompt_id, shot_ids)
+            on_progress = None
+            if job is not None:
+                def on_progress(value, max_value, ids=shot_ids):
+                    for shot_id in ids:
+                        job.update_shot(shot_id, image="running", image_progress=round(value / max(max_value, 1), 3))
+            history = self.client.wait_for_completion(prompt_id, on_progress=on_progress)
+            images = self.client.download_outputs(
+                history,
+                target_dir,
+                expected_filename,
+                prompt_id=prompt_id,
+                filename_map=filename_map,
             )
+            collected.append(images)
+            if on_image is not None:
+                for image in images:
+                    on_image(image)
+            if job is not None:
+                job.remove_cancel_hook(hook)
+                for shot_id in shot_ids:
+                    job.update_shot(shot_id, image="done", image_progress=1.0)
+        return collected
+
+    def _generate_pipelined(
+        self,
+        jobs: List[Tuple[Dict[str, Any], Optional[str], Optional[Dict[str, List[str]]], List[Any]]],
+        target_dir: str,
+        on_image: Optional[Callable[[Path], None]] = None,
+    ) -> List[List[Path]]:
+        """
+        一次性提交全部 workflow 保持 ComfyUI 队列满载，任务完成后立即在线程池中下载保存
 
-            generated_images.extend([str(img) for img in images])
+        Args:
+            jobs: (workflow, 期望文件名, 文件名映射, shot id 列表) 列表
+            target_dir: 图片保存目录
+            on_image: 每张图片保存后的回调（在下载线程中调用）
+
+        Returns:
+            每个 job 收集到的图片路径列表（按提交顺序）
+        """
+        # 进度回调可能在多后端池的等待线程中执行，直接持有任务对象
+        job = current_job()
+        prompt_ids = []
+        targets = {}
+        hooks = {}
+        for workflow, expected_filename, filename_map, shot_ids in jobs:
+            check_cancelled()
+            prompt_id = self.client.submit(workflow)
+            prompt_ids.append(prompt_id)
+            targets[prompt_id] = (expected_filename, filename_map, shot_ids)
+            hooks[prompt_id] = self._track_prompt(job, prompt_id, shot_ids)
+
+        on_progress = None
+        if job is not None:
+            def on_progress(prompt_id, value, max_value):
+                for shot_id in targets[prompt_id][2]:
+                    job.update_shot(shot_id, image="running", image_progress=round(value / max(max_value, 1), 3))
+
+        def download(history, prompt_id):
+            expected_filename, filename_map, shot_ids = targets[prompt_id]
+            images = self.client.download_outputs(
+                history,
+                target_dir,
+                expected_filename,
+                prompt_id=prompt_id,
+                filename_map=filename_map,
+            )
+            if job is not None:
+                for shot_id in shot_ids:
+                    job.update_shot(shot_id, image="done", image_progress=1.0)
+            if on_image is not None:
+                for image in images:
+                    on_image(image)
+            return images
 
-        return generated_images
+        downloads = {}
+        with ThreadPoolExecutor(max_workers=self.download_workers) as pool:
+            for prompt_id, history in self.client.iter_completed(prompt_ids, on_progress=on_progress):
+                if job is not None:
+                    job.remove_cancel_hook(hooks[prompt_id])
+                downloads[prompt_id] = pool.submit(download, history, prompt_id)
 
+        return [downloads[prompt_id].result() for prompt_id in prompt_ids]
@@ -0,0 +1,354 @@
+"""渲染任务：后台线程池执行、阶段与 shot 进度上报、取消"""
+import contextvars
+import subprocess
+import threading
+import time
+import traceback
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Dict, Any, Callable, List, Optional
+
+
+class JobCancelled(RuntimeError):
+    """任务已被取消"""
+
+
+_current_job: contextvars.ContextVar[Optional["Job"]] = contextvars.ContextVar("current_job", default=None)
+
+
+def current_job() -> Optional["Job"]:
+    """当前线程正在执行的任务（不在任务中执行时为 None）"""
+    return _current_job.get()
+
+
+@contextmanager
+def use_job(job: Optional["Job"]):
+    """在当前线程（上下文）中把 job 设为当前任务"""
+    token = _current_job.set(job)
+    try:
+        yield job
+    finally:
+        _current_job.reset(token)
+
+
+def check_cancelled():
+    """当前任务已取消时抛出 JobCancelled，不在任务中执行时什么也不做"""
+    job = current_job()
+    if job is not None:
+        job.raise_if_cancelled()
+
+
+@contextmanager
+def stage(name: str):
+    """记录当前任务一个阶段的开始/结束时间，不在任务中执行时什么也不做"""
+    job = current_job()
+    if job is None:
+        yield
+        return
+    job.raise_if_cancelled()
+    job.begin_stage(name)
+    try:
+        yield
+    except BaseException:
+        job.end_stage(name, "cancelled" if job.cancelled else "failed")
+        raise
+    job.end_stage(name, "done")
+
+
+def report_shot(shot_id: Any, **fields: Any):
+    """上报当前任务中某个 shot 的进度，不在任务中执行时什么也不做"""
+    job = current_job()
+    if job is not None:
+        job.update_shot(shot_id, **fields)
+
+
+def run_process(
+    cmd: List[str],
+    check: bool = False,
+    capture_output: bool = False,
+    text: bool = False,
+    **kwargs: Any,
+) -> subprocess.CompletedProcess:
+    """
+    运行子进程（参数同 subprocess.run 的常用子集）
+
+    在任务中执行时，子进程登记到当前任务，任务取消时会被立即杀掉并抛出 JobCancelled。
+
+    Returns:
+        subprocess.CompletedProcess
+    """
+    if capture_output:
+        kwargs["stdout"] = subprocess.PIPE
+        kwargs["stderr"] = subprocess.PIPE
+    job = current_job()
+    if job is not None:
+        job.raise_if_cancelled()
+
+    with subprocess.Popen(cmd, text=text, **kwargs) as proc:
+        if job is not None:
+            job.attach_process(proc)
+        try:
+            stdout, stderr = proc.communicate()
+        except BaseException:
+            proc.kill()
+            raise
+        finally:
+            if job is not None:
+                job.detach_process(proc)
+
+    if job is not None:
+        job.raise_if_cancelled()
+    if check and proc.returncode != 0:
+        raise subprocess.CalledProcessError(proc.returncode, cmd, output=stdout, stderr=stderr)
+    return subprocess.CompletedProcess(cmd, proc.returncode, stdout, stderr)
+
+
+class Job:
+    """一个后台渲染任务的状态"""
+
+    def __init__(self, kind: str, params: Optional[Dict[str, Any]] = None):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.params = params or {}
+        # queued / running / succeeded / failed / cancelled
+        self.status = "queued"
+        self.stage: Optional[str] = None
+        # 阶段名 -> {"status", "started_at", "finished_at", "seconds"}
+        self.stages: Dict[str, Dict[str, Any]] = OrderedDict()
+        # shot id -> 进度字段（如 {"image": "running", "image_progress": 0.5, "audio": "done"}）
+        self.shots: Dict[str, Dict[str, Any]] = OrderedDict()
+        # 正在运行的 ffmpeg 的进度（run id -> 进度字段）和按用途累计的编码速度
+        self.ffmpeg_running: Dict[str, Dict[str, Any]] = OrderedDict()
+        self.ffmpeg_totals: Dict[str, Dict[str, float]] = OrderedDict()
+        self.artifacts: Optional[Dict[str, Any]] = None
+        self.error: Optional[str] = None
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+
+        self._lock = threading.Lock()
+        self._cancel_event = threading.Event()
+        self._processes: List[subprocess.Popen] = []
+        self._cancel_hooks: List[Callable[[], None]] = []
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancel_event.is_set()
+
+    @property
+    def finished(self) -> bool:
+        return self.status in ("succeeded", "failed", "cancelled")
+
+    def raise_if_cancelled(self):
+        if self.cancelled:
+            raise JobCancelled(f"任务已取消: {self.id}")
+
+    def begin_stage(self, name: str):
+        with self._lock:
+            self.stage = name
+            self.stages[name] = {"status": "running", "started_at": time.time(), "finished_at": None, "seconds": None}
+
+    def end_stage(self, name: str, status: str = "done"):
+        with self._lock:
+            info = self.stages.get(name)
+            if info is None:
+                return
+            info["status"] = status
+            info["finished_at"] = time.time()
+            info["seconds"] = round(info["finished_at"] - info["started_at"], 3)
+            if self.stage == name:
+                # 并发执行的阶段中还有其他阶段在运行时，显示最早开始的那个
+                running = [stage_name for stage_name, other in self.stages.items() if other["status"] == "running"]
+                self.stage = running[0] if running else None
+
+    def update_shot(self, shot_id: Any, **fields: Any):
+        with self._lock:
+            self.shots.setdefault(str(shot_id), {}).update(fields)
+
+    def update_ffmpeg(self, run_id: str, progress: Dict[str, Any]):
+        with self._lock:
+            self.ffmpeg_running[run_id] = progress
+
+    def finish_ffmpeg(self, run_id: str, label: str, media_seconds: float, wall_seconds: float):
+        with self._lock:
+            self.ffmpeg_running.pop(run_id, None)
+            totals = self.ffmpeg_totals.setdefault(label, {"runs": 0, "media_seconds": 0.0, "wall_seconds": 0.0})
+            totals["runs"] += 1
+            totals["media_seconds"] += media_seconds
+            totals["wall_seconds"] += wall_seconds
+
+    def attach_process(self, proc: subprocess.Popen):
+        with self._lock:
+            self._processes.append(proc)
+            cancelled = self.cancelled
+        if cancelled:
+            proc.kill()
+
+    def detach_process(self, proc: subprocess.Popen):
+        with self._lock:
+            if proc in self._processes:
+                self._processes.remove(proc)
+
+    def add_cancel_hook(self, hook: Callable[[], None]) -> Callable[[], None]:
+        """登记取消时执行的清理（如取消 ComfyUI 任务），返回 hook 本身，用于 remove_cancel_hook"""
+        with self._lock:
+            self._cancel_hooks.append(hook)
+            cancelled = self.cancelled
+        if cancelled:
+            self._run_hook(hook)
+        return hook
+
+    def remove_cancel_hook(self, hook: Callable[[], None]):
+        with self._lock:
+            if hook in self._cancel_hooks:
+                self._cancel_hooks.remove(hook)
+
+    @staticmethod
+    def _run_hook(hook: Callable[[], None]):
+        try:
+            hook()
+        except Exception as e:
+            print(f"警告: 执行取消清理失败: {e}")
+
+    def cancel(self):
+        """请求取消：杀掉正在运行的子进程并执行取消清理，正在执行的阶段随后抛出 JobCancelled"""
+        with self._lock:
+            if self.finished:
+                return
+            self._cancel_event.set()
+            processes = list(self._processes)
+            hooks = list(self._cancel_hooks)
+            self._cancel_hooks.clear()
+        for proc in processes:
+            try:
+                proc.kill()
+            except OSError:
+                pass
+        for hook in hooks:
+            self._run_hook(hook)
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "job_id": self.id,
+                "kind": self.kind,
+                "params": dict(self.params),
+                "status": self.status,
+                "stage": self.stage,
+                "stages": {name: dict(info) for name, info in self.stages.items()},
+                "shots": {shot_id: dict(info) for shot_id, info in self.shots.items()},
+                "ffmpeg": {
+                    "running": [dict(info) for info in self.ffmpeg_running.values()],
+                    # speed 为输出媒体时长 / 耗时（实时倍数）
+                    "totals": {
+                        label: {
+                            "runs": info["runs"],
+                            "media_seconds": round(info["media_seconds"], 3),
+                            "wall_seconds": round(info["wall_seconds"], 3),
+                            "speed": round(info["media_seconds"] / info["wall_seconds"], 3) if info["wall_seconds"] > 0 else None,
+                        }
+                        for label, info in self.ffmpeg_totals.items()
+                    },
+                },
+                "artifacts": self.artifacts,
+                "error": self.error,
+                "created_at": self.created_at,
+                "started_at": self.started_at,
+                "finished_at": self.finished_at,
+            }
+
+
+class JobManager:
+    """
+    后台任务管理器
+
+    任务在有界线程池中执行，不阻塞 API 的事件循环；已结束的任务只保留最近 max_finished 个。
+    """
+
+    def __init__(self, max_workers: int = 2, max_finished: int = 100):
+        """
+        初始化任务管理器
+
+        Args:
+            max_workers: 同时执行的任务数
+            max_finished: 保留的已结束任务数
+        """
+        self.max_finished = max_finished
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="render-job")
+        self._jobs: Dict[str, Job] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def submit(self, kind: str, fn: Callable[..., Dict[str, Any]], *args: Any, params: Optional[Dict[str, Any]] = None, **kwargs: Any) -> Job:
+        """
+        提交任务，立即返回
+
+        Args:
+            kind: 任务类型（如 "episode_render"）
+            fn: 在后台线程中执行的函数，返回值（产物路径字典）作为任务的 artifacts
+            params: 任务参数（仅用于展示）
+
+        Returns:
+            Job
+        """
+        job = Job(kind, params)
+        with self._lock:
+            self._jobs[job.id] = job
+            self._prune()
+        self._executor.submit(self._run, job, fn, args, kwargs)
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def list(self) -> List[Job]:
+        with self._lock:
+            return list(self._jobs.values())
+
+    def cancel(self, job_id: str) -> Optional[Job]:
+        """取消任务，返回该任务（不存在时返回 None）"""
+        job = self.get(job_id)
+        if job is None:
+            return None
+        job.cancel()
+        with job._lock:
+            if job.status == "queued":
+                # 尚未开始的任务由工作线程取出时直接跳过
+                job.status = "cancelled"
+                job.finished_at = time.time()
+        return job
+
+    def _prune(self):
+        finished = [job_id for job_id, job in self._jobs.items() if job.finished]
+        for job_id in finished[:max(len(finished) - self.max_finished, 0)]:
+            del self._jobs[job_id]
+
+    def _run(self, job: Job, fn: Callable[..., Dict[str, Any]], args, kwargs):
+        with job._lock:
+            if job.status != "queued":
+                return
+            job.status = "running"
+            job.started_at = time.time()
+
+        try:
+            with use_job(job):
+                result = fn(*args, **kwargs)
+            status, error = "succeeded", None
+        except JobCancelled:
+            result, status, error = None, "cancelled", None
+        except Exception as e:
+            result = None
+            status = "cancelled" if job.cancelled else "failed"
+            error = None if job.cancelled else str(e)
+            if status == "failed":
+                print(f"错误: 任务 {job.id} 失败: {e}")
+                print(traceback.format_exc())
+
+        with job._lock:
+            job.artifacts = result
+            job.status = status
+            job.error = error
+            job.stage = None
+            job.finished_at = time.time()
@@ -0,0 +1,138 @@
+"""内存中的 PCM 音频处理：读取 WAV、重采样、静音、保持音高的变速（WSOLA）"""
+import wave
+from pathlib import Path
+from typing import Union
+
+import numpy as np
+
+
+def from_bytes(data: bytes) -> np.ndarray:
+    """16 位有符号小端单声道 PCM -> int16 数组"""
+    return np.frombuffer(data, dtype="<i2").astype(np.int16)
+
+
+def to_bytes(samples: np.ndarray) -> bytes:
+    """int16 数组 -> 16 位有符号小端单声道 PCM"""
+    return samples.astype("<i2").tobytes()
+
+
+def duration(samples: np.ndarray, rate: int) -> float:
+    """时长（秒）"""
+    return len(samples) / rate
+
+
+def silence(seconds: float, rate: int) -> np.ndarray:
+    """指定时长的静音"""
+    return np.zeros(max(0, int(round(seconds * rate))), dtype=np.int16)
+
+
+def resample(samples: np.ndarray, src_rate: int, dst_rate: int) -> np.ndarray:
+    """线性插值重采样（用于 TTS 输出的语音，不需要更高质量的滤波）"""
+    if src_rate == dst_rate or len(samples) == 0:
+        return samples.astype(np.int16)
+    length = int(round(len(samples) * dst_rate / src_rate))
+    positions = np.arange(length) * (src_rate / dst_rate)
+    return np.round(np.interp(positions, np.arange(len(samples)), samples)).astype(np.int16)
+
+
+def read_wav(path: Union[str, Path], rate: int) -> np.ndarray:
+    """
+    读取整数 PCM 编码的 WAV，混为单声道并重采样
+
+    Args:
+        path: WAV 路径
+        rate: 目标采样率
+
+    Returns:
+        int16 数组
+
+    Raises:
+        ValueError: 不是整数 PCM 编码的 WAV（如浮点、压缩编码），需要用 ffmpeg 转换
+    """
+    try:
+        with wave.open(str(path), "rb") as f:
+            channels = f.getnchannels()
+            width = f.getsampwidth()
+            src_rate = f.getframerate()
+            data = f.readframes(f.getnframes())
+    except (wave.Error, EOFError) as e:
+        raise ValueError(f"无法读取 WAV: {path}: {e}")
+
+    if width == 1:
+        samples = (np.frombuffer(data, dtype=np.uint8).astype(np.float64) - 128) * 256
+    elif width == 2:
+        samples = np.frombuffer(data, dtype="<i2").astype(np.float64)
+    elif width == 4:
+        samples = np.frombuffer(data, dtype="<i4").astype(np.float64) / 65536
+    else:
+        raise ValueError(f"不支持的 WAV 采样位宽: {width * 8} 位")
+    samples = samples[: len(samples) // channels * channels]
+    if channels > 1:
+        samples = samples.reshape(-1, channels).mean(axis=1)
+    return resample(np.round(samples).astype(np.int16), src_rate, rate)
+
+
+def write_wav(path: Union[str, Path], samples: np.ndarray, rate: int):
+    """写入 16 位单声道 WAV"""
+    with wave.open(str(path), "wb") as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(rate)
+        f.writeframes(to_bytes(samples))
+
+
+def fit_samples(samples: np.ndarray, length: int) -> np.ndarray:
+    """截断或在末尾补静音到正好 length 个采样（不变速）"""
+    if len(samples) >= length:
+        return samples[:length]
+    return np.concatenate([samples, np.zeros(length - len(samples), dtype=np.int16)])
+
+
+def fit_length(samples: np.ndarray, length: int, rate: int) -> np.ndarray:
+    """
+    变速到指定长度，保持音高（WSOLA：按速度比例取输入帧，在小范围内搜索与上一帧衔接最好的位置后叠加）
+
+    Args:
+        samples: int16 数组
+        length: 目标采样数
+        rate: 采样率（决定帧长，约 46ms）
+
+    Returns:
+        长度正好为 length 的 int16 数组
+    """
+    if length <= 0:
+        return np.zeros(0, dtype=np.int16)
+    if len(samples) == 0:
+        return np.zeros(length, dtype=np.int16)
+
+    frame = max(64, int(rate * 0.046) // 2 * 2)
+    hop = frame // 2
+    tolerance = hop // 2
+    speed = len(samples) / length
+    # 周期 Hann 窗，50% 重叠时逐点相加为 1
+    window = np.hanning(frame + 1)[:frame]
+
+    frames = length // hop + 2
+    # 第一帧从 -hop 开始，输出去掉前 hop 个采样，开头不会淡入
+    pad = hop + tolerance
+    source = np.concatenate([
+        np.zeros(pad),
+        samples.astype(np.float64),
+        np.zeros(max(0, int(frames * hop * speed) - len(samples)) + frame + 2 * pad),
+    ])
+    output = np.zeros(frames * hop + frame)
+
+    previous = None
+    for k in range(frames):
+        ideal = pad - hop + int(round(k * hop * speed))
+        if previous is None:
+            position = ideal
+        else:
+            # 上一帧的自然延续，在 ideal 附近寻找与它最相似的输入段
+            natural = source[previous + hop: previous + hop + frame]
+            region = source[ideal - tolerance: ideal + tolerance + frame]
+            position = ideal - tolerance + int(np.argmax(np.correlate(region, natural, mode="valid")))
+        output[k * hop: k * hop + frame] += source[position: position + frame] * window
+        previous = position
+
+    return np.clip(np.round(output[hop: hop + length]), -32768, 32767).astype(np.int16)
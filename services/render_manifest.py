@@ -0,0 +1,88 @@
+"""增量渲染清单：记录每个产物的输入指纹，只重建过期的产物"""
+import hashlib
+import json
+import os
+import threading
+from pathlib import Path
+from typing import Dict, Any, Optional, Union
+
+
+def fingerprint(*parts: Any) -> str:
+    """
+    计算输入的稳定指纹
+
+    Args:
+        *parts: 可 JSON 序列化的输入（字典按键排序，Path 等按字符串处理）
+
+    Returns:
+        十六进制 sha256
+    """
+    encoded = json.dumps(parts, sort_keys=True, separators=(",", ":"), ensure_ascii=False, default=str)
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+
+class RenderManifest:
+    """
+    episode 的渲染清单（output/episode_XXX.manifest.json）
+
+    键为产物名（如 "shot:1:image"、"shot:1:audio"、"video"），值为生成该产物时的输入指纹。
+    指纹一致且产物文件仍然存在时认为产物是最新的。各阶段并发记录，每次记录后原子写回文件，
+    中途失败的渲染也会保留已完成的产物。
+    """
+
+    VERSION = 1
+
+    def __init__(self, path: Union[str, Path]):
+        """
+        加载清单（文件不存在或版本不符时为空清单）
+
+        Args:
+            path: 清单文件路径
+        """
+        self.path = Path(path)
+        self.entries: Dict[str, str] = {}
+        self._lock = threading.Lock()
+        if self.path.exists():
+            try:
+                with open(self.path, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+                if data.get("version") == self.VERSION:
+                    self.entries = dict(data.get("entries", {}))
+            except (OSError, ValueError) as e:
+                print(f"警告: 渲染清单损坏，将全部重建: {self.path} ({e})")
+
+    def is_fresh(self, key: str, fp: str, artifact: Optional[Union[str, Path]] = None) -> bool:
+        """
+        产物是否是最新的
+
+        Args:
+            key: 产物名
+            fp: 当前输入的指纹
+            artifact: 产物文件路径，提供时还要求文件存在
+
+        Returns:
+            指纹与清单一致（且产物文件存在）时为 True
+        """
+        with self._lock:
+            if self.entries.get(key) != fp:
+                return False
+        return artifact is None or Path(artifact).exists()
+
+    def record(self, key: str, fp: str):
+        """记录产物已按指纹 fp 重建，并写回清单文件"""
+        with self._lock:
+            self.entries[key] = fp
+            self._save()
+
+    def invalidate(self, key: str):
+        """删除产物记录（产物生成失败时调用）"""
+        with self._lock:
+            if self.entries.pop(key, None) is not None:
+                self._save()
+
+    def _save(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_name(f".{self.path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"version": self.VERSION, "entries": self.entries}, f, ensure_ascii=False, indent=2, sort_keys=True)
+        os.replace(tmp, self.path)
@@ -1,7 +1,89 @@
 """字幕生成服务"""
 import json
 from pathlib import Path
-from typing import Dict, Any
+from typing import Dict, Any, List, Tuple
+
+
+def format_timestamp(t: float) -> str:
+    """秒数 -> SRT 时间戳（00:MM:SS,mmm）"""
+    ms = int((t - int(t)) * 1000)
+    s = int(t) % 60
+    m = int(t) // 60
+    return f"00:{m:02d}:{s:02d},{ms:03d}"
+
+
+def parse_timestamp(value: str) -> float:
+    """SRT 时间戳（HH:MM:SS,mmm） -> 秒数"""
+    hms, _, ms = value.strip().partition(",")
+    h, m, s = (int(part) for part in hms.split(":"))
+    return h * 3600 + m * 60 + s + int(ms or 0) / 1000
+
+
+def parse_srt(text: str) -> List[Tuple[float, float, str]]:
+    """
+    解析 SRT 文本
+
+    Returns:
+        [(开始秒数, 结束秒数, 字幕文本), ...]
+    """
+    cues = []
+    for block in text.replace("\r\n", "\n").split("\n\n"):
+        lines = [line for line in block.split("\n") if line.strip()]
+        if len(lines) < 2 or "-->" not in lines[1]:
+            continue
+        start, _, end = lines[1].partition("-->")
+        cues.append((parse_timestamp(start), parse_timestamp(end), "\n".join(lines[2:])))
+    return cues
+
+
+def format_srt(cues: List[Tuple[float, float, str]]) -> str:
+    """把 [(开始秒数, 结束秒数, 字幕文本), ...] 格式化为 SRT 文本"""
+    lines = []
+    for index, (start, end, text) in enumerate(cues, 1):
+        lines.append(f"{index}")
+        lines.append(f"{format_timestamp(start)} --> {format_timestamp(end)}")
+        lines.append(text)
+        lines.append("")
+    return "\n".join(lines)
+
+
+def format_vtt(cues: List[Tuple[float, float, str]], timestamp_map: str = None) -> str:
+    """
+    把 [(开始秒数, 结束秒数, 字幕文本), ...] 格式化为 WebVTT 文本
+
+    Args:
+        cues: 字幕列表
+        timestamp_map: HLS 分片的 X-TIMESTAMP-MAP 取值（如 "MPEGTS:126000,LOCAL:00:00:00.000"），可选
+    """
+
+    def timestamp(t: float) -> str:
+        ms = round(t * 1000)
+        return f"{ms // 3600000:02d}:{ms // 60000 % 60:02d}:{ms // 1000 % 60:02d}.{ms % 1000:03d}"
+
+    lines = ["WEBVTT"]
+    if timestamp_map:
+        lines.append(f"X-TIMESTAMP-MAP={timestamp_map}")
+    lines.append("")
+    for start, end, text in cues:
+        lines.append(f"{timestamp(start)} --> {timestamp(end)}")
+        lines.append(text)
+        lines.append("")
+    return "\n".join(lines)
+
+
+def slice_srt(cues: List[Tuple[float, float, str]], start: float, end: float) -> List[Tuple[float, float, str]]:
+    """
+    截取 [start, end) 时间段内的字幕，时间改为相对 start
+
+    Returns:
+        截取后的字幕列表
+    """
+    sliced = []
+    for cue_start, cue_end, text in cues:
+        if cue_end <= start or cue_start >= end:
+            continue
+        sliced.append((max(cue_start, start) - start, min(cue_end, end) - start, text))
+    return sliced
 
 
 class SRTService:
@@ -32,12 +114,6 @@ class SRTService:
         current_time = 0.0
         lines = []
 
-        def fmt(t):
-            ms = int((t - int(t)) * 1000)
-            s = int(t) % 60
-            m = int(t) // 60
-            return f"00:{m:02d}:{s:02d},{ms:03d}"
-
         for shot in episode_data["shots"]:
             duration = shot["duration"]
             subtitles = shot["subtitles"]
@@ -48,7 +124,7 @@ class SRTService:
                 end = start + per_line * 0.9
 
                 lines.append(f"{index}")
-                lines.append(f"{fmt(start)} --> {fmt(end)}")
+                lines.append(f"{format_timestamp(start)} --> {format_timestamp(end)}")
                 lines.append(text)
                 lines.append("")
                 index += 1
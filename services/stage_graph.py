@@ -0,0 +1,227 @@
+"""按依赖关系并发执行渲染阶段"""
+import contextvars
+import multiprocessing
+import os
+import signal
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import Dict, Any, Callable, List, Optional, Sequence, Tuple
+
+from .jobs import Job, current_job, stage, use_job
+
+
+class Stage:
+    """一个渲染阶段"""
+
+    def __init__(
+        self,
+        name: str,
+        fn: Callable[..., Any],
+        deps: Sequence[str] = (),
+        executor: str = "thread",
+        args: Tuple[Any, ...] = (),
+    ):
+        """
+        定义阶段
+
+        Args:
+            name: 阶段名
+            fn: 阶段函数，以 fn(*args) 调用；依赖阶段的结果通过 StageGraph.results 读取
+            deps: 依赖的阶段名，全部完成后才开始
+            executor: "thread" 适合等待远程服务/子进程的 I/O 型阶段；
+                "process" 在独立进程中执行 CPU 型阶段（fn 和 args 必须可以 pickle）
+            args: 传给 fn 的参数
+        """
+        if executor not in ("thread", "process"):
+            raise ValueError(f"未知的执行器类型: {executor}")
+        self.name = name
+        self.fn = fn
+        self.deps = tuple(deps)
+        self.executor = executor
+        self.args = args
+
+
+class _StageProcessJob(Job):
+    """阶段子进程中的任务代理：shot 进度和 ffmpeg 进度/统计转发给父进程"""
+
+    def __init__(self, conn):
+        super().__init__("stage_process")
+        self._conn = conn
+
+    def update_shot(self, shot_id: Any, **fields: Any):
+        self._conn.send(("shot", (shot_id, fields)))
+
+    def update_ffmpeg(self, run_id: str, progress: Dict[str, Any]):
+        self._conn.send(("job", ("update_ffmpeg", (run_id, progress))))
+
+    def finish_ffmpeg(self, run_id: str, label: str, media_seconds: float, wall_seconds: float):
+        self._conn.send(("job", ("finish_ffmpeg", (run_id, label, media_seconds, wall_seconds))))
+
+
+def _process_main(conn, fn: Callable[..., Any], args: Tuple[Any, ...]):
+    """阶段子进程入口：单独成组，取消时父进程可以连同 ffmpeg 等孙进程一起杀掉"""
+    if hasattr(os, "setsid"):
+        os.setsid()
+    try:
+        with use_job(_StageProcessJob(conn)):
+            result = fn(*args)
+        conn.send(("result", result))
+    except BaseException as e:
+        try:
+            conn.send(("error", e))
+        except Exception:
+            conn.send(("error", RuntimeError(repr(e))))
+    finally:
+        conn.close()
+
+
+def _kill_process_group(proc: multiprocessing.Process):
+    try:
+        if hasattr(os, "killpg"):
+            os.killpg(proc.pid, signal.SIGKILL)
+        else:
+            proc.kill()
+    except (OSError, ValueError):
+        pass
+
+
+class StageGraph:
+    """
+    阶段依赖图执行器
+
+    依赖已满足的阶段立即并发开始：thread 阶段在线程池中执行（继承当前渲染任务的上下文），
+    process 阶段在 spawn 出的独立进程中执行。每个阶段的开始/结束时间记录在 timings 中，
+    critical_path() 返回决定总耗时的阶段链。任一阶段失败时不再启动新阶段，
+    终止正在运行的进程阶段，等待线程阶段结束后抛出第一个异常。
+    """
+
+    def __init__(self, stages: List[Stage]):
+        names = [s.name for s in stages]
+        if len(set(names)) != len(names):
+            raise ValueError(f"阶段名重复: {names}")
+        for s in stages:
+            missing = [dep for dep in s.deps if dep not in names]
+            if missing:
+                raise ValueError(f"阶段 {s.name} 依赖未定义的阶段: {missing}")
+        self.stages = {s.name: s for s in stages}
+        self.results: Dict[str, Any] = {}
+        # 阶段名 -> {"started_at", "finished_at", "seconds"}
+        self.timings: Dict[str, Dict[str, float]] = {}
+        self._processes: Dict[str, multiprocessing.Process] = {}
+
+    def run(self) -> Dict[str, Any]:
+        """
+        执行全部阶段
+
+        Returns:
+            阶段名 -> 阶段函数返回值
+        """
+        job = current_job()
+        done: set = set()
+        running: Dict[Any, str] = {}
+        first_error: Optional[BaseException] = None
+        t0 = time.monotonic()
+
+        with ThreadPoolExecutor(max_workers=len(self.stages), thread_name_prefix="render-stage") as pool:
+            while True:
+                if first_error is None:
+                    started = set(running.values()) | done
+                    for name, s in self.stages.items():
+                        if name not in started and all(dep in done for dep in s.deps):
+                            ctx = contextvars.copy_context()
+                            future = pool.submit(ctx.run, self._run_stage, s, job, t0)
+                            running[future] = name
+                if not running:
+                    break
+
+                finished, _ = wait(list(running), return_when=FIRST_COMPLETED)
+                for future in finished:
+                    name = running.pop(future)
+                    error = future.exception()
+                    if error is None:
+                        self.results[name] = future.result()
+                        done.add(name)
+                    elif first_error is None:
+                        first_error = error
+                        # 不必等待进程阶段跑完
+                        for process in list(self._processes.values()):
+                            _kill_process_group(process)
+
+        if first_error is not None:
+            raise first_error
+        if len(done) < len(self.stages):
+            raise RuntimeError(f"阶段依赖存在环: {sorted(set(self.stages) - done)}")
+        return self.results
+
+    def _run_stage(self, s: Stage, job: Optional[Job], t0: float) -> Any:
+        started_at = time.monotonic() - t0
+        try:
+            with stage(s.name):
+                if s.executor == "process":
+                    return self._run_in_process(s, job)
+                return s.fn(*s.args)
+        finally:
+            finished_at = time.monotonic() - t0
+            self.timings[s.name] = {
+                "started_at": round(started_at, 3),
+                "finished_at": round(finished_at, 3),
+                "seconds": round(finished_at - started_at, 3),
+            }
+
+    def _run_in_process(self, s: Stage, job: Optional[Job]) -> Any:
+        ctx = multiprocessing.get_context("spawn")
+        parent_conn, child_conn = ctx.Pipe(duplex=False)
+        process = ctx.Process(target=_process_main, args=(child_conn, s.fn, s.args), daemon=True)
+        process.start()
+        child_conn.close()
+        self._processes[s.name] = process
+
+        hook = None
+        if job is not None:
+            hook = job.add_cancel_hook(lambda: _kill_process_group(process))
+        try:
+            while True:
+                try:
+                    kind, payload = parent_conn.recv()
+                except EOFError:
+                    if job is not None:
+                        job.raise_if_cancelled()
+                    raise RuntimeError(f"阶段 {s.name} 的进程异常退出 (exitcode={process.exitcode})")
+                if kind == "shot":
+                    if job is not None:
+                        job.update_shot(payload[0], **payload[1])
+                elif kind == "job":
+                    if job is not None:
+                        method, args = payload
+                        getattr(job, method)(*args)
+                elif kind == "result":
+                    return payload
+                else:
+                    raise payload
+        finally:
+            parent_conn.close()
+            process.join()
+            self._processes.pop(s.name, None)
+            if hook is not None:
+                job.remove_cancel_hook(hook)
+
+    def critical_path(self) -> List[str]:
+        """
+        从最后结束的阶段沿最晚完成的依赖回溯，得到决定总耗时的阶段链
+
+        Returns:
+            按执行顺序排列的阶段名列表
+        """
+        if not self.timings:
+            return []
+        # 结束时间相同时取开始更晚的（下游）阶段
+        order = lambda n: (self.timings[n]["finished_at"], self.timings[n]["started_at"])
+        name = max(self.timings, key=order)
+        path = [name]
+        while True:
+            deps = [dep for dep in self.stages[name].deps if dep in self.timings]
+            if not deps:
+                break
+            name = max(deps, key=order)
+            path.append(name)
+        return path[::-1]
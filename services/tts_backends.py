@@ -0,0 +1,370 @@
+"""
+TTS 后端：按名称注册，批量接口一次合成多句台词，返回 PCM
+
+后端在 config/voice_config.json 的 "backend" 字段中选择（"auto" 时 macOS 使用 say，其他系统使用 pyttsx3）。
+新的后端继承 TTSBackend 并用 register_backend 注册。
+"""
+import contextvars
+import hashlib
+import platform
+import re
+import shutil
+import subprocess
+import tempfile
+import threading
+import unicodedata
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Tuple, Type, Union
+
+import numpy as np
+
+from . import pcm
+from .ffmpeg_runner import run_ffmpeg
+from .jobs import JobCancelled, check_cancelled, run_process
+from .tts_pool import TTSPool
+
+
+# 一句台词：(文本, 声音配置)
+TTSItem = Tuple[str, Dict[str, Any]]
+# 合成结果：PCM（int16 数组），失败的台词对应位置为异常对象
+TTSResult = Union[np.ndarray, Exception]
+
+
+def read_audio(path: Union[str, Path], rate: int) -> np.ndarray:
+    """
+    读取 TTS 输出为单声道 PCM：整数 PCM 编码的 WAV 在进程内读取和重采样，其他格式（AIFF、浮点 WAV 等）用 ffmpeg 转换
+
+    Args:
+        path: 音频路径
+        rate: 目标采样率
+
+    Returns:
+        int16 数组
+    """
+    try:
+        return pcm.read_wav(path, rate)
+    except ValueError:
+        pass
+    with tempfile.NamedTemporaryFile(suffix=".pcm", delete=False) as tmp_file:
+        pcm_path = Path(tmp_file.name)
+    cmd = [
+        "ffmpeg",
+        "-y",
+        "-i", str(path),
+        "-f", "s16le",
+        "-acodec", "pcm_s16le",
+        "-ar", str(rate),
+        "-ac", "1",
+        str(pcm_path),
+    ]
+    try:
+        run_ffmpeg(cmd, label="audio")
+        return pcm.from_bytes(pcm_path.read_bytes())
+    except subprocess.CalledProcessError as e:
+        raise RuntimeError(f"转换为 PCM 失败: {e}")
+    finally:
+        pcm_path.unlink(missing_ok=True)
+
+
+class TTSBackend:
+    """TTS 后端基类"""
+
+    # 注册名（配置中的 "backend"）
+    name = ""
+
+    def __init__(self, workers: int = 1):
+        """
+        Args:
+            workers: 同时合成的台词数
+        """
+        self.workers = max(1, workers)
+
+    @property
+    def identity(self) -> str:
+        """后端标识（参与片段缓存键）：合成结果会变化时（引擎、系统驱动、算法版本）标识也要变化"""
+        return self.name
+
+    def synthesize_batch(self, items: List[TTSItem], rate: int) -> List[TTSResult]:
+        """
+        合成一批台词
+
+        Args:
+            items: (文本, 声音配置) 列表
+            rate: 输出采样率
+
+        Returns:
+            与 items 一一对应的 PCM（int16 数组，单声道）；某一句失败时该位置为异常对象，不影响其他台词
+
+        Raises:
+            JobCancelled: 所在任务已被取消
+        """
+        raise NotImplementedError
+
+    def close(self):
+        """释放后端持有的进程等资源"""
+
+    def _map(self, func: Callable[[Any], np.ndarray], items: List[Any]) -> List[TTSResult]:
+        """用 workers 个线程逐个处理，收集每一项的结果或异常（复制上下文，子进程登记到当前任务）"""
+        def run(item):
+            try:
+                return func(item)
+            except JobCancelled:
+                raise
+            except Exception as e:
+                return e
+
+        if self.workers == 1 or len(items) <= 1:
+            return [run(item) for item in items]
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix=f"tts-{self.name}") as pool:
+            futures = [pool.submit(contextvars.copy_context().run, run, item) for item in items]
+            return [future.result() for future in futures]
+
+
+# 注册名 -> 后端类
+BACKENDS: Dict[str, Type[TTSBackend]] = {}
+# (注册名, workers) -> 进程内共享的后端
+_shared: Dict[Tuple[str, int], TTSBackend] = {}
+_shared_lock = threading.Lock()
+
+
+def register_backend(cls: Type[TTSBackend]) -> Type[TTSBackend]:
+    """注册 TTS 后端（类装饰器），按类的 name 查找"""
+    if not cls.name:
+        raise ValueError(f"TTS 后端缺少 name: {cls.__name__}")
+    BACKENDS[cls.name] = cls
+    return cls
+
+
+def create_backend(name: str = "auto", workers: int = 1) -> TTSBackend:
+    """
+    按名称创建 TTS 后端
+
+    Args:
+        name: 注册名，"auto" 时 macOS 使用 say，其他系统使用 pyttsx3
+        workers: 同时合成的台词数
+
+    Returns:
+        TTSBackend 实例
+    """
+    return BACKENDS[_resolve_name(name)](workers=workers)
+
+
+def shared_backend(name: str = "auto", workers: int = 1) -> TTSBackend:
+    """
+    获取进程内共享的 TTS 后端：同一注册名和并发数只创建一次，pyttsx3 的工作进程在多次渲染之间复用
+
+    Args:
+        name: 注册名，"auto" 时 macOS 使用 say，其他系统使用 pyttsx3
+        workers: 同时合成的台词数
+
+    Returns:
+        TTSBackend 实例（由 close_shared_backends 统一释放）
+    """
+    key = (_resolve_name(name), max(1, workers))
+    with _shared_lock:
+        if key not in _shared:
+            _shared[key] = BACKENDS[key[0]](workers=key[1])
+        return _shared[key]
+
+
+def close_shared_backends():
+    """释放全部共享的 TTS 后端（服务关闭时调用）"""
+    with _shared_lock:
+        backends = list(_shared.values())
+        _shared.clear()
+    for backend in backends:
+        backend.close()
+
+
+def _resolve_name(name: str) -> str:
+    if name == "auto":
+        name = "say" if platform.system() == "Darwin" else "pyttsx3"
+    if name not in BACKENDS:
+        raise ValueError(f"未知的 TTS 后端: {name}（可选: auto, {', '.join(BACKENDS)}）")
+    return name
+
+
+@register_backend
+class SayBackend(TTSBackend):
+    """macOS say 命令（更可靠）：每句一个 say 进程，多句同时合成"""
+
+    name = "say"
+
+    def synthesize_batch(self, items: List[TTSItem], rate: int) -> List[TTSResult]:
+        check_cancelled()
+        return self._map(lambda item: self._synthesize(item[0], item[1], rate), items)
+
+    def _synthesize(self, text: str, config: Dict[str, Any], rate: int) -> np.ndarray:
+        # 使用临时 WAV 文件（16 位小端整数 PCM，进程内直接读取）
+        with tempfile.NamedTemporaryFile(suffix=".wav", delete=False) as tmp_file:
+            tmp_wav = Path(tmp_file.name)
+
+        try:
+            # 构建 say 命令
+            # say -v 声音名称 -r 语速 -o 输出文件 "文本"
+            cmd = ["say"]
+
+            # 设置声音（优先使用 voice_name，如果没有则尝试从 voice_id 获取）
+            voice_name = config.get("voice_name")
+
+            if not voice_name and config.get("voice_id") is not None:
+                # 尝试从 voice_id 获取声音名称（兼容旧配置）
+                try:
+                    import pyttsx3
+                    engine = pyttsx3.init("nsss")
+                    voices = engine.getProperty("voices")
+                    if voices:
+                        voice_id = config["voice_id"]
+                        if isinstance(voice_id, int) and 0 <= voice_id < len(voices):
+                            voice_name = voices[voice_id].name
+                        elif isinstance(voice_id, str):
+                            for voice in voices:
+                                if voice_id.lower() in voice.name.lower():
+                                    voice_name = voice.name
+                                    break
+                    engine.stop()
+                except:
+                    pass
+
+            if voice_name:
+                cmd.extend(["-v", voice_name])
+
+            # 设置语速（say 的 -r 参数，默认是 200）
+            speech_rate = config.get("rate", 150)
+            # 将 pyttsx3 的 rate (150) 转换为 say 的 rate (约 200)
+            say_rate = int(speech_rate * 200 / 150)
+            cmd.extend(["-r", str(say_rate)])
+
+            # 输出文件
+            cmd.extend(["-o", str(tmp_wav), "--file-format=WAVE", f"--data-format=LEI16@{rate}"])
+
+            # 文本内容
+            cmd.append(text)
+
+            # 执行 say 命令（退出时文件已经写完）
+            run_process(cmd, check=True, capture_output=True, text=True)
+
+            if not tmp_wav.exists() or tmp_wav.stat().st_size == 0:
+                raise RuntimeError(f"WAV 文件生成失败: {tmp_wav}")
+
+            return read_audio(tmp_wav, rate)
+        finally:
+            if tmp_wav.exists():
+                tmp_wav.unlink()
+
+
+@register_backend
+class Pyttsx3Backend(TTSBackend):
+    """
+    pyttsx3（非 macOS 系统）：在常驻的 TTS 工作进程中合成
+
+    每个工作进程一次接收一小批台词，全部排入引擎队列后只调用一次 runAndWait；
+    多个批次分给 workers 个工作进程同时合成。
+    """
+
+    name = "pyttsx3"
+    # 每个工作进程一次合成的台词数
+    BATCH_SIZE = 8
+
+    def __init__(self, workers: int = 1):
+        super().__init__(workers)
+        # pyttsx3 引擎在长期运行的工作进程中初始化，第一次合成时启动
+        self._pool = None
+
+    @property
+    def identity(self) -> str:
+        # 同一引擎在不同系统上使用不同的驱动（espeak、SAPI5）
+        return f"pyttsx3:{platform.system()}"
+
+    @property
+    def pool(self) -> TTSPool:
+        """pyttsx3 工作进程池（第一次使用时创建）"""
+        if self._pool is None:
+            self._pool = TTSPool(self.workers)
+        return self._pool
+
+    def synthesize_batch(self, items: List[TTSItem], rate: int) -> List[TTSResult]:
+        check_cancelled()
+        pool = self.pool
+        tmp_dir = Path(tempfile.mkdtemp(prefix="tts_"))
+        try:
+            paths = [tmp_dir / f"line_{i:04d}.wav" for i in range(len(items))]
+            requests = [(text, path, config) for (text, config), path in zip(items, paths)]
+            # 台词不多时也分给全部工作进程
+            size = max(1, min(self.BATCH_SIZE, -(-len(requests) // self.workers)))
+            chunks = [requests[i:i + size] for i in range(0, len(requests), size)]
+
+            def synthesize_chunk(chunk) -> List[TTSResult]:
+                try:
+                    # 返回时 WAV 已经完整写入
+                    errors = pool.synthesize_batch(chunk)
+                except JobCancelled:
+                    raise
+                except Exception as e:
+                    return [e] * len(chunk)
+                results = []
+                for (_, path, _), error in zip(chunk, errors):
+                    try:
+                        if error is not None:
+                            raise RuntimeError(error)
+                        results.append(read_audio(path, rate))
+                    except Exception as e:
+                        results.append(e)
+                return results
+
+            return [result for chunk_results in self._map(synthesize_chunk, chunks) for result in chunk_results]
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.close()
+            self._pool = None
+
+
+@register_backend
+class OfflineBackend(TTSBackend):
+    """
+    内置的离线合成器：不依赖系统 TTS 引擎和声卡驱动，同样的输入总是得到同样的输出，用于无头 Linux 的 CI 和测试
+
+    每个汉字（或连续的字母数字）合成一个带包络的音调，频率由字符和声音名称的哈希决定，
+    时长按语速（每分钟音节数）计算；标点为半个音节的停顿。
+    """
+
+    name = "offline"
+    # 合成算法变化时递增，使已缓存的片段失效
+    VERSION = 1
+
+    @property
+    def identity(self) -> str:
+        return f"offline:{self.VERSION}"
+
+    def synthesize_batch(self, items: List[TTSItem], rate: int) -> List[TTSResult]:
+        check_cancelled()
+        return self._map(lambda item: self._synthesize(item[0], item[1], rate), items)
+
+    @staticmethod
+    def _hash(value: str) -> int:
+        return int(hashlib.sha256(value.encode("utf-8")).hexdigest()[:8], 16)
+
+    def _synthesize(self, text: str, config: Dict[str, Any], rate: int) -> np.ndarray:
+        syllable = 60.0 / config.get("rate", 150)
+        amplitude = 12000 * config.get("volume", 1.0)
+        voice = str(config.get("voice_name") or config.get("voice_id") or "")
+        # 音色：基频 110-220 Hz
+        base = 110 + self._hash(voice) % 111
+
+        chunks = []
+        for token in re.findall(r"[A-Za-z0-9]+|\S", unicodedata.normalize("NFKC", text)):
+            if unicodedata.category(token[0])[0] in "PSZ":
+                chunks.append(pcm.silence(syllable / 2, rate))
+                continue
+            length = max(1, int(round(syllable * rate)))
+            t = np.arange(length) / rate
+            frequency = base * (1 + (self._hash(token) % 12) / 12)
+            tone = np.sin(2 * np.pi * frequency * t) * np.hanning(length) * amplitude
+            chunks.append(np.round(tone).astype(np.int16))
+        if not chunks:
+            raise ValueError(f"没有可合成的内容: {text}")
+        return np.concatenate(chunks)
@@ -0,0 +1,228 @@
+"""
+TTS 工作进程池：每个工作进程持有一个初始化好的 pyttsx3 引擎，按请求/响应合成语音
+
+协议为 stdin/stdout 上的 JSON 行：请求 {"items": [{"text", "path", "config"}, ...]}，一批台词全部排入
+引擎队列、只调用一次 runAndWait，文件完整写入后返回 {"errors": [...]}（与 items 一一对应，成功为 null，
+失败为错误信息）。工作进程由 TTSPool 启动:
+    python -m services.tts_pool
+"""
+import json
+import os
+import subprocess
+import sys
+import threading
+from pathlib import Path
+from typing import Dict, Any, List, Optional, Tuple, Union
+
+from .jobs import current_job
+
+
+class TTSPool:
+    """
+    长期运行的 TTS 工作进程池
+
+    工作进程在第一次使用时启动，此后一直复用（不再每句台词初始化一次引擎）。synthesize_batch 可以在
+    多个线程中同时调用，每个调用独占一个工作进程，最多 workers 个同时合成。在任务中执行时，
+    工作进程登记到当前任务，取消时被杀掉，下次使用时重新启动。
+    """
+
+    def __init__(self, workers: int = 2):
+        """
+        初始化进程池（不立即启动进程）
+
+        Args:
+            workers: 工作进程数
+        """
+        if workers < 1:
+            raise ValueError(f"TTS 工作进程数必须大于 0: {workers}")
+        self.workers = workers
+        # services/ -> 项目根目录（使用绝对路径）
+        self.project_root = Path(__file__).resolve().parent.parent
+        self._slots = threading.Semaphore(workers)
+        self._lock = threading.Lock()
+        self._idle: List[subprocess.Popen] = []
+        self._all: List[subprocess.Popen] = []
+
+    def _start_worker(self) -> subprocess.Popen:
+        proc = subprocess.Popen(
+            [sys.executable, "-m", "services.tts_pool"],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            text=True,
+            encoding="utf-8",
+            bufsize=1,
+            cwd=self.project_root,
+        )
+        with self._lock:
+            self._all.append(proc)
+        return proc
+
+    def _discard(self, proc: subprocess.Popen):
+        try:
+            proc.kill()
+        except OSError:
+            pass
+        proc.wait()
+        with self._lock:
+            if proc in self._all:
+                self._all.remove(proc)
+
+    def synthesize_batch(self, items: List[Tuple[str, Union[str, Path], Dict[str, Any]]]) -> List[Optional[str]]:
+        """
+        在一个工作进程中合成一批台词，返回时文件已经完整写入
+
+        Args:
+            items: (台词, 输出 WAV 路径, 声音配置) 列表，声音配置含 rate、volume、voice_name 或 voice_id
+
+        Returns:
+            与 items 一一对应的错误信息，成功的台词为 None
+
+        Raises:
+            RuntimeError: 工作进程异常退出
+            JobCancelled: 所在任务已被取消
+        """
+        job = current_job()
+        if job is not None:
+            job.raise_if_cancelled()
+        request = json.dumps(
+            {"items": [{"text": text, "path": str(path), "config": config} for text, path, config in items]},
+            ensure_ascii=False,
+        )
+
+        with self._slots:
+            with self._lock:
+                proc = self._idle.pop() if self._idle else None
+            if proc is None:
+                proc = self._start_worker()
+            if job is not None:
+                job.attach_process(proc)
+            try:
+                proc.stdin.write(request + "\n")
+                proc.stdin.flush()
+                line = proc.stdout.readline()
+            except OSError:
+                line = ""
+            finally:
+                if job is not None:
+                    job.detach_process(proc)
+
+            if not line:
+                self._discard(proc)
+                if job is not None:
+                    job.raise_if_cancelled()
+                raise RuntimeError(f"TTS 工作进程异常退出 (exitcode={proc.returncode})")
+            with self._lock:
+                self._idle.append(proc)
+
+        return json.loads(line)["errors"]
+
+    def close(self):
+        """关闭全部工作进程（关闭 stdin 后工作进程自行退出）"""
+        with self._lock:
+            procs = list(self._all)
+            self._all.clear()
+            self._idle.clear()
+        for proc in procs:
+            try:
+                proc.stdin.close()
+                proc.wait(timeout=5)
+            except (OSError, subprocess.TimeoutExpired):
+                proc.kill()
+                proc.wait()
+
+
+def _apply_voice_settings(engine, config: Dict[str, Any], defaults: Dict[str, Any]):
+    """应用声音设置到引擎；配置中没有的参数恢复为引擎的初始值（引擎在多次请求之间复用）"""
+    engine.setProperty("rate", config.get("rate", defaults["rate"]))
+    engine.setProperty("volume", config.get("volume", defaults["volume"]))
+
+    voice = defaults["voice"]
+    voices = engine.getProperty("voices") or []
+    # 设置声音（优先使用 voice_name，如果没有则尝试 voice_id）
+    voice_name = config.get("voice_name")
+    voice_id = config.get("voice_id")
+    if voice_name:
+        # 尝试通过名称匹配
+        for candidate in voices:
+            if voice_name.lower() in candidate.name.lower() or candidate.name.lower() in voice_name.lower():
+                voice = candidate.id
+                break
+    elif voice_id is not None:
+        # 兼容旧的 voice_id 配置
+        if isinstance(voice_id, int) and 0 <= voice_id < len(voices):
+            voice = voices[voice_id].id
+        elif isinstance(voice_id, str):
+            for candidate in voices:
+                if voice_id.lower() in candidate.name.lower():
+                    voice = candidate.id
+                    break
+    if voice is not None:
+        engine.setProperty("voice", voice)
+
+
+class _Engine:
+    """工作进程中的 pyttsx3 引擎：第一次使用时初始化，合成失败后丢弃，下次使用时重新初始化"""
+
+    def __init__(self):
+        self.engine = None
+        self.defaults: Dict[str, Any] = {}
+
+    def run(self, items: List[Dict[str, Any]]):
+        """把一批台词全部排入引擎队列（声音设置同样按顺序排队），只调用一次 runAndWait"""
+        if self.engine is None:
+            try:
+                import pyttsx3
+                self.engine = pyttsx3.init()
+            except Exception as e:
+                raise RuntimeError(f"无法初始化 TTS 引擎: {e}")
+            self.defaults = {name: self.engine.getProperty(name) for name in ("rate", "volume", "voice")}
+        try:
+            for item in items:
+                _apply_voice_settings(self.engine, item.get("config") or {}, self.defaults)
+                Path(item["path"]).unlink(missing_ok=True)
+                self.engine.save_to_file(item["text"], item["path"])
+            # runAndWait 在引擎处理完队列（文件写完）后返回
+            self.engine.runAndWait()
+        except Exception:
+            # 合成失败后引擎的队列状态不可信
+            try:
+                self.engine.stop()
+            except Exception:
+                pass
+            self.engine = None
+            raise
+
+
+def _synthesize_batch(engine: _Engine, items: List[Dict[str, Any]]) -> List[Optional[str]]:
+    """合成一批台词；整批失败时逐句重试，找出失败的台词"""
+    try:
+        engine.run(items)
+    except Exception as e:
+        if len(items) == 1:
+            return [str(e)]
+        return [_synthesize_batch(engine, [item])[0] for item in items]
+    return [
+        None if Path(item["path"]).exists() and Path(item["path"]).stat().st_size > 0
+        else f"WAV 文件生成失败: {item['path']}"
+        for item in items
+    ]
+
+
+def main():
+    """工作进程入口"""
+    # 响应使用原来的 stdout；引擎和驱动的输出改到 stderr，不会混入协议
+    protocol = os.fdopen(os.dup(1), "w", encoding="utf-8", buffering=1)
+    os.dup2(2, 1)
+    sys.stdout = sys.stderr
+
+    engine = _Engine()
+    for line in sys.stdin:
+        if not line.strip():
+            continue
+        items = json.loads(line)["items"]
+        response = {"errors": _synthesize_batch(engine, items)}
+        protocol.write(json.dumps(response, ensure_ascii=False) + "\n")
+
+
+if __name__ == "__main__":
+    main()
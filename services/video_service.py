@@ -1,7 +1,91 @@
 """视频渲染服务"""
+import contextvars
+import math
+import os
+import shutil
 import subprocess
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import List, Union, Optional
+from typing import Dict, Any, List, Union, Optional, Tuple
+
+from .ffmpeg_runner import run_ffmpeg
+from .hls import HLSWriter
+from .image_cache import ContentCache, file_sha256
+from .jobs import run_process
+from .render_manifest import fingerprint
+from .srt_service import format_srt, parse_srt, slice_srt
+
+
+def probe_duration(path: Union[str, Path]) -> float:
+    """
+    用 ffprobe 读取媒体文件的时长
+
+    Args:
+        path: 媒体文件路径
+
+    Returns:
+        时长（秒）
+    """
+    cmd = [
+        "ffprobe",
+        "-v", "error",
+        "-show_entries", "format=duration",
+        "-of", "default=noprint_wrappers=1:nokey=1",
+        str(path),
+    ]
+    result = run_process(cmd, check=True, capture_output=True, text=True)
+    return float(result.stdout.strip())
+
+
+class Rendition:
+    """输出档位：分辨率和码率控制"""
+
+    def __init__(
+        self,
+        name: str,
+        width: int,
+        height: int,
+        crf: Optional[int] = None,
+        bitrate: Optional[str] = None,
+        font_scale: float = 1.0,
+    ):
+        """
+        定义输出档位
+
+        Args:
+            name: 档位名（如 "720p"），非首个档位的文件名为 <输出文件名>_<name>.mp4
+            width: 宽度
+            height: 高度
+            crf: x264 CRF，默认取编码档位的值
+            bitrate: 码率上限（如 "4M"），设置后按 CRF 编码并用 maxrate/bufsize 限制峰值码率
+            font_scale: 字幕字号相对默认值的倍数。字号以字幕脚本坐标（按画面高度缩放）计，
+                默认各档位字幕占画面的比例相同；小分辨率预览可以适当放大
+        """
+        if not name or width <= 0 or height <= 0:
+            raise ValueError(f"无效的输出档位: {name} {width}x{height}")
+        self.name = name
+        self.width = width
+        self.height = height
+        self.crf = crf
+        self.bitrate = bitrate
+        self.font_scale = font_scale
+
+    @classmethod
+    def from_value(cls, value: Union["Rendition", Dict[str, Any]]) -> "Rendition":
+        """从 Rendition 或字典（API 请求）构造"""
+        return value if isinstance(value, cls) else cls(**value)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "width": self.width,
+            "height": self.height,
+            "crf": self.crf,
+            "bitrate": self.bitrate,
+            "font_scale": self.font_scale,
+        }
 
 
 class VideoService:
@@ -9,10 +93,272 @@ class VideoService:
 
     TARGET_W = 720
     TARGET_H = 1280
+    FPS = 30
+    SUBTITLE_FONT_SIZE = 24
+    SUBTITLE_STYLE = "FontName=PingFang SC,FontSize={font_size},PrimaryColour=&Hffffff,OutlineColour=&H000000,Outline=2,Shadow=1"
+    # 发布用的分辨率阶梯（VideoService(renditions=VideoService.LADDER)）
+    LADDER = [
+        {"name": "1080p", "width": 1080, "height": 1920},
+        {"name": "720p", "width": 720, "height": 1280},
+        {"name": "360p", "width": 360, "height": 640},
+    ]
+    # 片段编码命令变化时递增，使已缓存的片段失效
+    SEGMENT_VERSION = 5
+    # 编码档位：still 针对长时间停留的静态画面（每张图只缩放一次、只编码字幕变化的帧、长 GOP）
+    ENCODE_PROFILES = {
+        "standard": {"preset": "medium", "crf": 23, "tune": None, "gop": 250},
+        "still": {"preset": "veryfast", "crf": 23, "tune": "stillimage", "gop": 300},
+    }
+    # 字幕方式：burn 在编码时烧录进画面；soft 只编码画面和音频（片段缓存与字幕无关），
+    # 拼接时以流复制封装为 mov_text 字幕轨（HLS 为 WebVTT 字幕播放列表），修改字幕只需重新封装
+    SUBTITLE_MODES = ("burn", "soft")
+    # 渲染质量：final 为发布用；draft 为快速预览（低分辨率、低帧率、最快的 preset），
+    # 覆盖编码档位的默认值，显式指定的 preset/crf/tune/gop 和输出档位仍然优先
+    QUALITIES = ("final", "draft")
+    DRAFT_RENDITION = {"name": "draft", "width": 360, "height": 640, "font_scale": 1.3}
+    DRAFT_FPS = 10
+    DRAFT_ENCODE = {"preset": "ultrafast", "crf": 30}
+    # 拼接后时长允许的误差，每个片段除视频取整到帧外另加一个 AAC 帧
+    SEGMENT_DURATION_TOLERANCE = 1024 / 44100
+
+    def __init__(
+        self,
+        segment_workers: Optional[int] = None,
+        segment_threads: Optional[int] = None,
+        cache_dir: Optional[Union[str, Path]] = None,
+        cache_max_bytes: int = 4 * 1024 ** 3,
+        profile: str = "still",
+        preset: Optional[str] = None,
+        crf: Optional[int] = None,
+        tune: Optional[str] = None,
+        gop: Optional[int] = None,
+        frame_workers: int = 4,
+        frame_cache_max_bytes: int = 1024 ** 3,
+        renditions: Optional[List[Union[Rendition, Dict[str, Any]]]] = None,
+        quality: str = "final",
+        subtitles: str = "burn",
+    ):
+        """
+        初始化服务
 
-    def __init__(self):
+        Args:
+            segment_workers: 片段模式下并行编码的 ffmpeg 进程数，默认 CPU 核数的一半
+            segment_threads: 每个 ffmpeg 进程的编码线程数，默认 CPU 核数 / segment_workers，
+                使并行的进程合计用满全部核而不过度订阅
+            cache_dir: 视频片段缓存目录，默认 <项目根目录>/cache/segments
+            cache_max_bytes: 片段缓存总大小上限（字节），为 0 时禁用缓存
+            profile: 编码档位（见 ENCODE_PROFILES），"still" 为静态画面优化，"standard" 为逐帧编码
+            preset: x264 preset，覆盖档位的默认值
+            crf: x264 CRF，覆盖档位的默认值
+            tune: x264 tune（如 "stillimage"），覆盖档位的默认值
+            gop: 关键帧最大间隔（帧），覆盖档位的默认值
+            frame_workers: 预处理（缩放补边）图片的线程数
+            frame_cache_max_bytes: 缩放补边后图片的缓存（<项目根目录>/cache/frames）总大小上限，为 0 时禁用
+            renditions: 输出档位列表（Rendition 或字典），默认只输出 TARGET_W x TARGET_H。
+                片段模式下一次解码、用 split 驱动多个编码器同时输出全部档位；第一个档位写入 output_path
+            quality: 渲染质量（见 QUALITIES），"draft" 默认输出 DRAFT_RENDITION、按 DRAFT_FPS 帧率编码
+            subtitles: 字幕方式（见 SUBTITLE_MODES），"soft" 时字幕为独立的字幕轨，需要烧录的成片用 burn_subtitles 制作
+        """
+        if profile not in self.ENCODE_PROFILES:
+            raise ValueError(f"未知的编码档位: {profile}（可选: {', '.join(self.ENCODE_PROFILES)}）")
+        if quality not in self.QUALITIES:
+            raise ValueError(f"未知的渲染质量: {quality}（可选: {', '.join(self.QUALITIES)}）")
+        if subtitles not in self.SUBTITLE_MODES:
+            raise ValueError(f"未知的字幕方式: {subtitles}（可选: {', '.join(self.SUBTITLE_MODES)}）")
+        self.quality = quality
+        self.subtitles = subtitles
+        draft = quality == "draft"
+        default_renditions = [self.DRAFT_RENDITION] if draft else [Rendition("720p", self.TARGET_W, self.TARGET_H)]
+        self.renditions = [Rendition.from_value(r) for r in renditions or default_renditions]
+        names = [r.name for r in self.renditions]
+        if not names or len(set(names)) != len(names):
+            raise ValueError(f"输出档位名为空或重复: {names}")
+        # 预处理图片按最大的档位缩放补边，其他档位在滤镜中从它缩小
+        largest = max(self.renditions, key=lambda r: r.width * r.height)
+        self.frame_size = (largest.width, largest.height)
         # services/ -> 项目根目录（使用绝对路径）
         self.project_root = Path(__file__).resolve().parent.parent
+        cpu_count = os.cpu_count() or 2
+        self.segment_workers = segment_workers or max(1, cpu_count // 2)
+        self.segment_threads = segment_threads or max(1, cpu_count // self.segment_workers)
+        # 显式指定的线程数同样用于 filter 模式的单个 ffmpeg 进程
+        self.encoder_threads = segment_threads
+        self.profile = profile
+        self.fps = self.DRAFT_FPS if draft else self.FPS
+        overrides = {"preset": preset, "crf": crf, "tune": tune, "gop": gop}
+        self.encode = {
+            **self.ENCODE_PROFILES[profile],
+            **(self.DRAFT_ENCODE if draft else {}),
+            **{name: value for name, value in overrides.items() if value is not None},
+        }
+        self.segment_cache = None
+        if cache_max_bytes > 0:
+            self.segment_cache = ContentCache(
+                cache_dir or self.project_root / "cache" / "segments", cache_max_bytes, suffix=".mp4"
+            )
+        self.frame_workers = frame_workers
+        self.frame_cache = None
+        if frame_cache_max_bytes > 0:
+            self.frame_cache = ContentCache(self.project_root / "cache" / "frames", frame_cache_max_bytes, suffix=".png")
+
+    def render_params(self) -> Dict[str, Any]:
+        """影响输出内容的渲染参数，参与增量渲染的视频指纹"""
+        return {
+            "renditions": [r.to_dict() for r in self.renditions],
+            "profile": self.profile,
+            "fps": self.fps,
+            "subtitles": self.subtitles,
+            **self.encode,
+        }
+
+    def rendition_paths(self, output_path: Union[str, Path]) -> Dict[str, Path]:
+        """
+        各输出档位的文件路径
+
+        Args:
+            output_path: 第一个档位的输出路径
+
+        Returns:
+            档位名 -> 路径（第一个档位为 output_path，其余为 <文件名>_<档位名><扩展名>）
+        """
+        output_path = Path(output_path)
+        paths = {}
+        for index, rendition in enumerate(self.renditions):
+            if index == 0:
+                paths[rendition.name] = output_path
+            else:
+                paths[rendition.name] = output_path.with_name(f"{output_path.stem}_{rendition.name}{output_path.suffix}")
+        return paths
+
+    def _frame_key(self, image: Path, width: int, height: int) -> str:
+        return fingerprint("frame", file_sha256(image), width, height)
+
+    def _letterbox(self, image: Path, dst: Path, width: int, height: int):
+        """等比缩放并补边到 width x height，写入 dst（先写临时文件再原子替换）"""
+        tmp = dst.with_name(f".{dst.stem}.{os.getpid()}.{threading.get_ident()}.tmp.png")
+        cmd = [
+            "ffmpeg",
+            "-y",
+            "-i", str(image),
+            "-vf",
+            f"scale={width}:{height}:force_original_aspect_ratio=decrease,"
+            f"pad={width}:{height}:(ow-iw)/2:(oh-ih)/2,setsar=1",
+            "-frames:v", "1",
+            str(tmp),
+        ]
+        try:
+            run_ffmpeg(cmd, label="frame")
+            os.replace(tmp, dst)
+        finally:
+            tmp.unlink(missing_ok=True)
+
+    def normalize_image(
+        self,
+        image: Union[str, Path],
+        dst: Union[str, Path],
+        width: Optional[int] = None,
+        height: Optional[int] = None,
+    ) -> Path:
+        """
+        把图片缩放补边到目标分辨率并放到 dst，结果按源图片哈希和目标尺寸缓存
+
+        Args:
+            image: 源图片路径
+            dst: 输出路径（.png）
+            width: 目标宽度，默认为最大输出档位的宽度
+            height: 目标高度，默认为最大输出档位的高度
+
+        Returns:
+            dst
+        """
+        image, dst = Path(image), Path(dst)
+        width, height = width or self.frame_size[0], height or self.frame_size[1]
+        key = self._frame_key(image, width, height)
+        if self.frame_cache is not None and self.frame_cache.get(key, dst):
+            return dst
+        dst.parent.mkdir(parents=True, exist_ok=True)
+        self._letterbox(image, dst, width, height)
+        if self.frame_cache is not None:
+            self.frame_cache.put(key, dst)
+        return dst
+
+    def prepare_frame(self, image: Union[str, Path], width: Optional[int] = None, height: Optional[int] = None):
+        """
+        预先把图片缩放补边到缓存，渲染时 normalize_image 直接命中（在收集 ComfyUI 图片的同时调用）
+
+        Args:
+            image: 源图片路径
+            width: 目标宽度，默认为最大输出档位的宽度
+            height: 目标高度，默认为最大输出档位的高度
+        """
+        if self.frame_cache is None:
+            return
+        image = Path(image)
+        width, height = width or self.frame_size[0], height or self.frame_size[1]
+        key = self._frame_key(image, width, height)
+        if self.frame_cache.contains(key):
+            return
+        staging = self.frame_cache.cache_dir / "staging" / f"{key}.{os.getpid()}.{threading.get_ident()}.png"
+        staging.parent.mkdir(parents=True, exist_ok=True)
+        try:
+            self._letterbox(image, staging, width, height)
+            self.frame_cache.put(key, staging)
+        finally:
+            staging.unlink(missing_ok=True)
+
+    def placeholder_frame(self) -> Path:
+        """
+        占位画面（深灰色纯色图，最大输出档位的尺寸），预览时代替还没有生成的图片
+
+        Returns:
+            占位图片路径（<项目根目录>/cache/placeholders/ 下，只生成一次）
+        """
+        width, height = self.frame_size
+        path = self.project_root / "cache" / "placeholders" / f"placeholder_{width}x{height}.png"
+        if path.exists():
+            return path
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(f".{path.stem}.{os.getpid()}.{threading.get_ident()}.tmp.png")
+        cmd = [
+            "ffmpeg",
+            "-y",
+            "-f", "lavfi",
+            "-i", f"color=c=0x303030:s={width}x{height}",
+            "-frames:v", "1",
+            str(tmp),
+        ]
+        try:
+            run_ffmpeg(cmd, label="frame")
+            os.replace(tmp, path)
+        finally:
+            tmp.unlink(missing_ok=True)
+        return path
+
+    def _video_codec_args(self, threads: Optional[int], rendition: Optional[Rendition] = None) -> List[str]:
+        """x264 编码参数（档位指定的 CRF/码率上限优先）"""
+        crf = rendition.crf if rendition is not None and rendition.crf is not None else self.encode["crf"]
+        args = ["-c:v", "libx264", "-preset", self.encode["preset"], "-crf", str(crf)]
+        if rendition is not None and rendition.bitrate:
+            args += ["-maxrate", rendition.bitrate, "-bufsize", self._double_bitrate(rendition.bitrate)]
+        if self.encode["tune"]:
+            args += ["-tune", self.encode["tune"]]
+        args += ["-g", str(self.encode["gop"])]
+        if threads:
+            args += ["-threads", str(threads)]
+        return args
+
+    @staticmethod
+    def _double_bitrate(bitrate: str) -> str:
+        """bufsize 取两倍码率（"4M" -> "8M"）"""
+        number = bitrate.rstrip("kKmM")
+        unit = bitrate[len(number):]
+        return f"{float(number) * 2:g}{unit}"
+
+    def _subtitle_filter(self, srt_path: Path, font_scale: float = 1.0) -> str:
+        """构建字幕滤镜，指定中文字体（路径中的特殊字符需要转义）"""
+        srt_path_escaped = str(srt_path).replace(":", "\\:").replace("'", "\\'")
+        style = self.SUBTITLE_STYLE.format(font_size=round(self.SUBTITLE_FONT_SIZE * font_scale))
+        return f"subtitles='{srt_path_escaped}':force_style='{style}'"
 
     def render_video(
         self,
@@ -20,7 +366,9 @@ class VideoService:
         durations: List[float],
         srt_path: Union[str, Path],
         output_path: Union[str, Path],
-        audio_files: Optional[List[Union[str, Path]]] = None,
+        audio_files: Optional[List[Optional[Union[str, Path]]]] = None,
+        mode: str = "segments",
+        audio_track: Optional[Union[str, Path]] = None,
     ) -> Path:
         """
         渲染视频
@@ -30,16 +378,36 @@ class VideoService:
             durations: 每个图片的时长列表
             srt_path: 字幕文件路径
             output_path: 输出视频路径
-            audio_files: 音频文件路径列表（可选），如果提供则合并到视频中
+            audio_files: 音频文件路径列表（可选），如果提供则合并到视频中；
+                与 images 一一对应时可以用 None 表示该镜头没有配音
+            mode: "segments" 每个镜头单独编码为片段（按内容缓存、并行编码），
+                再用 concat demuxer 无损拼接；"filter" 用一个 filter_complex 整集重新编码
+            audio_track: 整集音轨（可选，见 AudioService.build_episode_track），提供时忽略 audio_files，
+                音轨作为唯一的音频输入（AAC 直接流复制，WAV 编码为 AAC）
 
         Returns:
-            生成的视频文件路径
+            生成的视频文件路径（多个输出档位时为第一个档位的路径，全部路径见 render_renditions）
         """
+        if mode == "segments":
+            outputs = self.render_renditions(images, durations, srt_path, output_path, audio_files, audio_track=audio_track)
+            return outputs[self.renditions[0].name]
+        if mode != "filter":
+            raise ValueError(f"未知的渲染模式: {mode}")
+        if len(self.renditions) > 1:
+            raise ValueError("filter 模式只支持单个输出档位")
+        if self.subtitles != "burn":
+            raise ValueError("filter 模式只支持烧录字幕")
+        rendition = self.renditions[0]
+
         # 转换为 Path 对象
         images = [Path(img) for img in images]
         srt_path = Path(srt_path)
         output_path = Path(output_path)
         output_path.parent.mkdir(parents=True, exist_ok=True)
+        if audio_track is not None:
+            audio_files = None
+        if audio_files:
+            audio_files = [audio for audio in audio_files if audio is not None]
 
         inputs = []
         filter_parts = []
@@ -49,8 +417,8 @@ class VideoService:
             inputs += ["-loop", "1", "-t", str(dur), "-i", str(img)]
             # 关键：统一 scale + pad
             filter_parts.append(
-                f"[{i}:v]scale={self.TARGET_W}:{self.TARGET_H}:force_original_aspect_ratio=decrease,"
-                f"pad={self.TARGET_W}:{self.TARGET_H}:(ow-iw)/2:(oh-ih)/2,setsar=1[v{i}]"
+                f"[{i}:v]scale={rendition.width}:{rendition.height}:force_original_aspect_ratio=decrease,"
+                f"pad={rendition.width}:{rendition.height}:(ow-iw)/2:(oh-ih)/2,setsar=1[v{i}]"
             )
 
         # 添加音频输入（如果有）
@@ -78,11 +446,8 @@ class VideoService:
             audio_streams = [f"[{video_input_count + i}:a]" for i in range(audio_input_count)]
             concat_audio_inputs = "".join(audio_streams)
             
-            # 构建字幕滤镜，指定中文字体
-            # 使用 force_style 参数指定字体，避免字体查找错误
-            # 注意：路径中的特殊字符需要转义
-            srt_path_escaped = str(srt_path).replace(":", "\\:").replace("'", "\\'")
-            subtitle_filter = f"subtitles='{srt_path_escaped}':force_style='FontName=PingFang SC,FontSize=24,PrimaryColour=&Hffffff,OutlineColour=&H000000,Outline=2,Shadow=1'"
+            # 构建字幕滤镜，使用 force_style 参数指定字体，避免字体查找错误
+            subtitle_filter = self._subtitle_filter(srt_path, rendition.font_scale)
             
             filter_complex = (
                 ";".join(filter_parts)
@@ -99,8 +464,9 @@ class VideoService:
                 filter_complex,
                 "-map", "[vsub]",
                 "-map", "[outa]",
-                "-r", "30",
+                "-r", str(self.fps),
                 "-pix_fmt", "yuv420p",
+                *self._video_codec_args(self.encoder_threads, rendition),
                 "-c:a", "aac",
                 "-b:a", "128k",  # 降低比特率，避免 "Too many bits" 错误
                 "-ar", "44100",  # 设置采样率
@@ -109,13 +475,22 @@ class VideoService:
         else:
             # 无音频：只处理视频
             # 构建字幕滤镜，指定中文字体
-            srt_path_escaped = str(srt_path).replace(":", "\\:").replace("'", "\\'")
-            subtitle_filter = f"subtitles='{srt_path_escaped}':force_style='FontName=PingFang SC,FontSize=24,PrimaryColour=&Hffffff,OutlineColour=&H000000,Outline=2,Shadow=1'"
+            subtitle_filter = self._subtitle_filter(srt_path, rendition.font_scale)
             
             filter_complex = (
                 ";".join(filter_parts)
                 + f";{concat_video_inputs}concat=n={video_input_count}:v=1:a=0,{subtitle_filter}"
             )
+            track_args = []
+            if audio_track is not None:
+                # 整集音轨：一个音频输入，AAC 直接流复制，其他格式（WAV）编码一次
+                inputs += ["-i", str(audio_track)]
+                filter_complex += "[vsub]"
+                track_args = [
+                    "-map", "[vsub]",
+                    "-map", f"{video_input_count}:a",
+                    *self._track_codec_args(Path(audio_track)),
+                ]
             
             cmd = [
                 "ffmpeg",
@@ -123,11 +498,419 @@ class VideoService:
                 *inputs,
                 "-filter_complex",
                 filter_complex,
-                "-r", "30",
+                *track_args,
+                "-r", str(self.fps),
                 "-pix_fmt", "yuv420p",
+                *self._video_codec_args(self.encoder_threads, rendition),
                 str(output_path),
             ]
 
-        subprocess.run(cmd, check=True)
+        run_ffmpeg(cmd, label="render", duration=sum(float(d) for d in durations[:len(images)]))
         return output_path
 
+    def render_renditions(
+        self,
+        images: List[Union[str, Path]],
+        durations: List[float],
+        srt_path: Union[str, Path],
+        output_path: Union[str, Path],
+        audio_files: Optional[List[Optional[Union[str, Path]]]] = None,
+        hls_dir: Optional[Union[str, Path]] = None,
+        audio_track: Optional[Union[str, Path]] = None,
+    ) -> Dict[str, Path]:
+        """
+        片段模式渲染全部输出档位：每个镜头（缩放后的图片、该镜头时间段的字幕、该镜头的配音）单独编码，
+        一次 ffmpeg 调用用 split 同时输出各档位的片段；片段按内容哈希缓存，修改一个镜头只重新编码一个片段；
+        最后每个档位用 concat demuxer 以 -c copy 拼接。按镜头的配音不编码进片段，而是拼接为一条整集音轨
+        只编码一次 AAC，拼接时流复制（各片段单独编码 AAC 时，编码器的前导和补齐采样会在镜头边界留下空隙）
+
+        Args:
+            images: 图片路径列表
+            durations: 每个图片的时长列表
+            srt_path: 字幕文件路径
+            output_path: 第一个档位的输出路径，其余档位见 rendition_paths
+            audio_files: 与 images 一一对应的配音路径列表（可选，None 表示该镜头没有配音）。
+                输出 HLS 时配音仍编码进每个片段（HLS 分片按镜头封装）
+            hls_dir: 同时输出 HLS 的目录（可选）。片段按镜头顺序完成后立即追加到播放列表，
+                第一个镜头编码完成即可开始播放（见 HLSWriter）
+            audio_track: 整集音轨（可选，见 AudioService.build_episode_track），提供时忽略 audio_files：
+                片段只编码画面（缓存与配音无关），拼接时音轨作为唯一的音频输入流复制
+                （WAV 音轨先编码一次 AAC，PCM 不能可靠地封装进 MP4）。
+                HLS 分片需要按镜头的配音，不能同时使用
+
+        Returns:
+            档位名 -> 生成的视频路径
+        """
+        if audio_track is not None and hls_dir:
+            raise ValueError("整集音轨不能与 HLS 输出同时使用（HLS 分片需要按镜头的配音）")
+        images = [Path(img) for img in images]
+        srt_path = Path(srt_path)
+        outputs = self.rendition_paths(output_path)
+        output_path = outputs[self.renditions[0].name]
+        output_path.parent.mkdir(parents=True, exist_ok=True)
+
+        audios: List[Optional[Path]] = [None] * len(images)
+        for i, audio in enumerate(((audio_files or []) if audio_track is None else [])[:len(images)]):
+            if audio is not None and Path(audio).exists():
+                audios[i] = Path(audio)
+        # concat -c copy 要求所有片段的流布局一致：只要有一个镜头有配音，其余镜头补静音
+        has_audio = any(audio is not None for audio in audios)
+        # 不输出 HLS 时配音在拼接后整体编码一次，片段只编码画面
+        mux_audio = has_audio and not hls_dir
+        cues = parse_srt(srt_path.read_text(encoding="utf-8")) if srt_path.exists() else []
+
+        tasks = []
+        start = 0.0
+        for i, (image, duration) in enumerate(zip(images, durations)):
+            tasks.append((
+                i, image, float(duration), slice_srt(cues, start, start + duration), None if mux_audio else audios[i]
+            ))
+            start += duration
+        expected = sum(task[2] for task in tasks)
+
+        soft = self.subtitles == "soft"
+        hls = HLSWriter(hls_dir, self.renditions, [task[2] for task in tasks], subtitles=soft) if hls_dir else None
+        work_dir = Path(tempfile.mkdtemp(prefix=f".{output_path.stem}_segments_", dir=output_path.parent))
+        try:
+            with ThreadPoolExecutor(max_workers=self.segment_workers) as pool:
+                # 片段在线程中启动 ffmpeg，复制上下文使子进程登记到当前渲染任务（可被取消）
+                futures = [
+                    pool.submit(
+                        contextvars.copy_context().run, self._encode_segment, work_dir, has_audio and not mux_audio, *task
+                    )
+                    for task in tasks
+                ]
+                # 整集音轨与片段同时编码
+                audio_future = None
+                if mux_audio:
+                    audio_future = pool.submit(
+                        contextvars.copy_context().run,
+                        self._shot_audio_track, audios, [task[2] for task in tasks], work_dir, expected,
+                    )
+                # 按镜头顺序等待：前面的镜头都完成后立即追加到 HLS 播放列表
+                segments = []
+                for future, task in zip(futures, tasks):
+                    segments.append(future.result())
+                    if hls is not None:
+                        hls.add(segments[-1], task[2], task[3] if soft else None)
+                if audio_future is not None:
+                    audio_track = audio_future.result()
+            if hls is not None:
+                hls.finish()
+
+            track_input = []
+            if audio_track is not None:
+                track_input = ["-i", str(self._mp4_audio_track(Path(audio_track), work_dir, expected))]
+            # 软字幕：只保留实际渲染的时间段内的字幕，与拼接一起以流复制封装
+            episode_cues = slice_srt(cues, 0.0, expected) if soft else []
+            subtitle_input = []
+            if episode_cues:
+                episode_srt = work_dir / "episode.srt"
+                episode_srt.write_text(format_srt(episode_cues), encoding="utf-8")
+                subtitle_input = ["-i", str(episode_srt)]
+            for rendition in self.renditions:
+                concat_list = work_dir / f"segments_{rendition.name}.txt"
+                concat_list.write_text(
+                    "".join(
+                        "file '{}'\n".format(str(segment[rendition.name]).replace("'", "'\\''"))
+                        for segment in segments
+                    ),
+                    encoding="utf-8",
+                )
+                cmd = [
+                    "ffmpeg",
+                    "-y",
+                    "-f", "concat",
+                    "-safe", "0",
+                    "-i", str(concat_list),
+                    *track_input,
+                    *subtitle_input,
+                    "-map", "0",
+                ]
+                if track_input:
+                    cmd += ["-map", "1:a"]
+                cmd += ["-c", "copy"]
+                if subtitle_input:
+                    cmd += [
+                        "-map", "2" if track_input else "1",
+                        "-c:s", "mov_text", "-metadata:s:s:0", "language=chi",
+                    ]
+                cmd += [
+                    "-movflags", "+faststart",
+                    str(outputs[rendition.name]),
+                ]
+                run_ffmpeg(cmd, label="concat", duration=expected)
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+        for path in outputs.values():
+            self._verify_duration(path, expected, len(tasks))
+        return outputs
+
+    # 可以直接流复制进 MP4 的整集音轨扩展名（AAC）
+    MP4_TRACK_SUFFIXES = (".m4a", ".aac")
+
+    def _track_codec_args(self, audio_track: Path) -> List[str]:
+        """整集音轨封装进 MP4 的音频编码参数：AAC 流复制，其他格式（PCM 的 WAV 多数播放器不支持）编码为 AAC"""
+        if audio_track.suffix.lower() in self.MP4_TRACK_SUFFIXES:
+            return ["-c:a", "copy"]
+        return ["-c:a", "aac", "-b:a", "128k", "-ar", "44100"]
+
+    def _mp4_audio_track(self, audio_track: Path, work_dir: Path, duration: float) -> Path:
+        """
+        可以流复制进 MP4 的整集音轨：AAC 音轨原样返回，其他格式在 work_dir 中编码一次 AAC（各输出档位共用）
+
+        Args:
+            audio_track: 整集音轨
+            work_dir: 临时目录
+            duration: 音轨时长（秒），用于进度
+
+        Returns:
+            AAC 音轨路径
+        """
+        if audio_track.suffix.lower() in self.MP4_TRACK_SUFFIXES:
+            return audio_track
+        encoded = work_dir / "episode_audio.m4a"
+        cmd = [
+            "ffmpeg",
+            "-y",
+            "-i", str(audio_track),
+            "-vn",
+            *self._track_codec_args(audio_track),
+            str(encoded),
+        ]
+        run_ffmpeg(cmd, label="audio", duration=duration)
+        return encoded
+
+    def _shot_audio_track(
+        self, audios: List[Optional[Path]], durations: List[float], work_dir: Path, duration: float
+    ) -> Path:
+        """
+        把按镜头的配音拼接为一条整集 AAC 音轨（只编码一次）：每个镜头的配音补静音或截断到镜头时长，
+        镜头起点按累计时间取整到采样，误差不随镜头数累积；没有配音的镜头为静音
+
+        Args:
+            audios: 与镜头一一对应的配音路径（None 表示该镜头没有配音）
+            durations: 镜头时长列表（秒）
+            work_dir: 临时目录
+            duration: 镜头时长之和（秒），用于进度
+
+        Returns:
+            AAC 音轨路径
+        """
+        rate = 44100
+        inputs = []
+        graph = []
+        start = 0.0
+        start_sample = 0
+        for i, (audio, shot_duration) in enumerate(zip(audios, durations)):
+            start += shot_duration
+            end_sample = int(round(start * rate))
+            if audio is not None:
+                inputs += ["-i", str(audio)]
+            else:
+                inputs += ["-f", "lavfi", "-t", str(shot_duration), "-i", f"anullsrc=r={rate}:cl=stereo"]
+            graph.append(
+                f"[{i}:a]aresample={rate},aformat=sample_rates={rate}:channel_layouts=stereo,"
+                f"apad,atrim=end_sample={end_sample - start_sample}[a{i}]"
+            )
+            start_sample = end_sample
+        graph.append("".join(f"[a{i}]" for i in range(len(audios))) + f"concat=n={len(audios)}:v=0:a=1[aout]")
+
+        encoded = work_dir / "episode_audio.m4a"
+        cmd = [
+            "ffmpeg",
+            "-y",
+            *inputs,
+            "-filter_complex", ";".join(graph),
+            "-map", "[aout]",
+            "-c:a", "aac",
+            "-b:a", "128k",
+            "-ar", str(rate),
+            "-ac", "2",
+            str(encoded),
+        ]
+        run_ffmpeg(cmd, label="audio", duration=duration)
+        return encoded
+
+    def burn_subtitles(
+        self,
+        video_path: Union[str, Path],
+        srt_path: Union[str, Path],
+        output_path: Union[str, Path],
+        rendition: Optional[str] = None,
+    ) -> Path:
+        """
+        成片制作：把字幕烧录进软字幕模式渲染的视频（重新编码画面，音频流复制，去掉字幕轨）
+
+        Args:
+            video_path: 软字幕模式渲染的视频
+            srt_path: 字幕文件路径
+            output_path: 输出视频路径
+            rendition: 视频对应的输出档位名（决定字号和 CRF），默认为第一个档位
+
+        Returns:
+            output_path
+        """
+        video_path, srt_path, output_path = Path(video_path), Path(srt_path), Path(output_path)
+        matched = [r for r in self.renditions if r.name == rendition]
+        if rendition is not None and not matched:
+            raise ValueError(f"未知的输出档位: {rendition}")
+        target = matched[0] if matched else self.renditions[0]
+        output_path.parent.mkdir(parents=True, exist_ok=True)
+        cmd = [
+            "ffmpeg",
+            "-y",
+            "-i", str(video_path),
+            "-map", "0:v",
+            "-map", "0:a?",
+            # still 档位的软字幕视频每个镜头只有首尾两帧，按固定帧率补齐后字幕才能在出现的时刻叠加
+            "-vf", self._subtitle_filter(srt_path, target.font_scale),
+            "-r", str(self.fps),
+            "-pix_fmt", "yuv420p",
+            *self._video_codec_args(self.encoder_threads, target),
+            "-c:a", "copy",
+            "-movflags", "+faststart",
+            str(output_path),
+        ]
+        run_ffmpeg(cmd, label="burn")
+        return output_path
+
+    def _verify_duration(self, video_path: Path, expected: float, segment_count: int):
+        """
+        校验拼接结果的时长等于各镜头时长之和（片段缺帧或流布局不一致时 concat 会静默截断）
+
+        Args:
+            video_path: 视频路径
+            expected: 各镜头时长之和（秒）
+            segment_count: 片段数，决定允许的误差
+        """
+        try:
+            actual = probe_duration(video_path)
+        except (OSError, ValueError, subprocess.CalledProcessError) as e:
+            print(f"警告: 无法获取视频时长，跳过时长校验: {e}")
+            return
+        tolerance = max(0.1, segment_count * (1 / self.fps + self.SEGMENT_DURATION_TOLERANCE))
+        if abs(actual - expected) > tolerance:
+            raise RuntimeError(
+                f"视频时长校验失败: {video_path} 时长 {actual:.3f}s，镜头时长之和 {expected:.3f}s（允许误差 {tolerance:.3f}s）"
+            )
+
+    def _encode_segment(
+        self,
+        work_dir: Path,
+        has_audio: bool,
+        index: int,
+        image: Path,
+        duration: float,
+        cues: List[Tuple[float, float, str]],
+        audio: Optional[Path],
+    ) -> Dict[str, Path]:
+        """编码（或从缓存取出）一个镜头在各输出档位的片段，返回档位名 -> 片段路径"""
+        if self.subtitles != "burn":
+            # 软字幕的片段不含字幕，缓存键与字幕无关，修改字幕时片段全部命中缓存
+            cues = []
+        subtitle_text = format_srt(cues)
+        base_key = fingerprint(
+            self.SEGMENT_VERSION,
+            self.profile,
+            self.fps,
+            self.encode,
+            file_sha256(image),
+            file_sha256(audio) if audio is not None else None,
+            has_audio,
+            duration,
+            subtitle_text,
+        )
+        segments = {}
+        missing = []
+        for rendition in self.renditions:
+            key = fingerprint(base_key, rendition.to_dict())
+            segment = work_dir / f"segment_{index:04d}_{rendition.name}.mp4"
+            segments[rendition.name] = segment
+            if self.segment_cache is None or not self.segment_cache.get(key, segment):
+                missing.append((rendition, key, segment))
+        if not missing:
+            return segments
+
+        # 使用预先缩放补边好的图片（最大档位的尺寸），只解码一次，split 给各档位的编码器
+        frame = self.normalize_image(image, work_dir / f"frame_{index:04d}.png")
+        still = self.profile == "still"
+        if cues:
+            segment_srt = work_dir / f"segment_{index:04d}.srt"
+            segment_srt.write_text(subtitle_text, encoding="utf-8")
+
+        count = len(missing)
+        graph = ["[0:v]setsar=1" + (f",split={count}" if count > 1 else "") + "".join(f"[f{i}]" for i in range(count))]
+        for i, (rendition, _, _) in enumerate(missing):
+            filters = []
+            if (rendition.width, rendition.height) != self.frame_size:
+                # 在循环之前缩放，每个档位每张图只缩放一次
+                filters.append(
+                    f"scale={rendition.width}:{rendition.height}:force_original_aspect_ratio=decrease,"
+                    f"pad={rendition.width}:{rendition.height}:(ow-iw)/2:(oh-ih)/2,setsar=1"
+                )
+            if still:
+                # 图片只解码一次，再按帧率复制引用；只保留首帧、字幕变化的帧和末帧（可变帧率），
+                # 字幕只叠加在保留的帧上，画面与逐帧编码相同
+                frame_count = max(1, round(duration * self.fps))
+                filters.append(
+                    f"loop=loop={frame_count - 1}:size=1:start=0,setpts=N/{self.fps}/TB,"
+                    f"select='{self._keyframe_select(cues, frame_count)}'"
+                )
+            if cues:
+                filters.append(self._subtitle_filter(segment_srt, rendition.font_scale))
+            graph.append(f"[f{i}]{','.join(filters) or 'null'}[v{i}]")
+
+        if still:
+            # 输入帧率决定时间基，setpts 才能把帧放到 1/fps 的网格上（默认 25 时会取整到 1/25 秒）
+            cmd = ["ffmpeg", "-y", "-framerate", str(self.fps), "-i", str(frame)]
+        else:
+            cmd = ["ffmpeg", "-y", "-loop", "1", "-framerate", str(self.fps), "-t", str(duration), "-i", str(frame)]
+        if audio is not None:
+            cmd += ["-i", str(audio)]
+        elif has_audio:
+            cmd += ["-f", "lavfi", "-t", str(duration), "-i", "anullsrc=r=44100:cl=stereo"]
+        if has_audio:
+            # 配音比镜头短时补静音，片段时长严格等于镜头时长
+            graph.append("[1:a]apad" + (f",asplit={count}" if count > 1 else "") + "".join(f"[a{i}]" for i in range(count)))
+        cmd += ["-filter_complex", ";".join(graph)]
+
+        # 多个编码器共享这个进程的线程预算
+        threads = max(1, self.segment_threads // count)
+        for i, (rendition, _, segment) in enumerate(missing):
+            cmd += ["-map", f"[v{i}]"]
+            if has_audio:
+                cmd += ["-map", f"[a{i}]", "-c:a", "aac", "-b:a", "128k", "-ar", "44100", "-ac", "2"]
+            cmd += ["-t", str(duration)]
+            # 可变帧率的片段保留 select 后的时间戳；所有片段使用相同的时间基，保证 concat -c copy 正确
+            cmd += ["-fps_mode", "passthrough"] if still else ["-r", str(self.fps)]
+            cmd += [
+                "-video_track_timescale", "90000",
+                "-pix_fmt", "yuv420p",
+                *self._video_codec_args(threads, rendition),
+                str(segment),
+            ]
+        run_ffmpeg(cmd, label="segment", duration=duration)
+
+        if self.segment_cache is not None:
+            for _, key, segment in missing:
+                self.segment_cache.put(key, segment)
+        return segments
+
+    def _keyframe_select(self, cues: List[Tuple[float, float, str]], frame_count: int) -> str:
+        """
+        构建 select 表达式：保留首帧、每条字幕出现/消失后的第一帧和末帧
+
+        Args:
+            cues: 片段内的字幕（相对片段开始的时间）
+            frame_count: 片段的总帧数
+
+        Returns:
+            select 滤镜表达式（逗号已转义）
+        """
+        frames = {0, frame_count - 1}
+        for start, end, _ in cues:
+            for t in (start, end):
+                frames.add(min(frame_count - 1, max(0, math.ceil(t * self.fps - 1e-6))))
+        return "+".join(f"eq(n\\,{n})" for n in sorted(frames))
@@ -0,0 +1,21 @@
+"""测试共用的 fixture"""
+import pytest
+
+from scripts.fake_comfy_server import serve
+
+
+@pytest.fixture
+def fake_comfy():
+    """启动假 ComfyUI 服务（自动分配端口），返回创建函数，测试结束时全部关闭"""
+    servers = []
+
+    def start(**kwargs):
+        server = serve(port=0, **kwargs)
+        servers.append(server)
+        return server
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
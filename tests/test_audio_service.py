@@ -0,0 +1,83 @@
+"""AudioService 测试（离线 TTS 后端，不需要系统 TTS 引擎和 ffmpeg）"""
+import numpy as np
+import pytest
+
+from services import pcm, tts_backends
+from services.audio_service import AudioService
+
+EPISODE = {
+    "episode_id": 7,
+    "character": {},
+    "shots": [
+        {"id": 1, "duration": 2.0, "subtitles": ["你好", "今天天气很好"]},
+        {"id": 2, "duration": 1.5, "subtitles": ["……"]},
+        {"id": 3, "duration": 3.0, "subtitles": ["我们出发吧"]},
+    ],
+}
+
+
+@pytest.fixture
+def audio_service(tmp_path):
+    """离线后端、WAV 整集音轨，配音和片段缓存写入临时目录"""
+    service = AudioService(clip_cache_dir=tmp_path / "cache", backend="offline", track_format="wav")
+    service.audio_dir = tmp_path / "audio"
+    service.audio_dir.mkdir()
+    yield service
+    tts_backends.close_shared_backends()
+
+
+def test_generate_audio_matches_shot_durations(audio_service):
+    paths = audio_service.generate_audio(EPISODE)
+
+    assert paths == [audio_service.shot_audio_path(7, shot["id"]) for shot in EPISODE["shots"]]
+    for path, shot in zip(paths, EPISODE["shots"]):
+        samples = pcm.read_wav(path, AudioService.PCM_RATE)
+        assert abs(pcm.duration(samples, AudioService.PCM_RATE) - shot["duration"]) < 0.1
+
+
+def test_second_run_hits_clip_cache(audio_service, monkeypatch):
+    synthesized = []
+    synthesize_batch = audio_service.backend.synthesize_batch
+
+    def record(items, rate):
+        synthesized.extend(text for text, _ in items)
+        return synthesize_batch(items, rate)
+
+    monkeypatch.setattr(audio_service.backend, "synthesize_batch", record)
+    first = [pcm.read_wav(path, AudioService.PCM_RATE) for path in audio_service.generate_audio(EPISODE)]
+    assert sorted(synthesized) == sorted(["你好", "今天天气很好", "我们出发吧"])
+
+    synthesized.clear()
+    second = [pcm.read_wav(path, AudioService.PCM_RATE) for path in audio_service.generate_audio(EPISODE)]
+    assert synthesized == []
+    for a, b in zip(first, second):
+        assert np.array_equal(a, b)
+
+
+def test_episode_track_round_trip_and_staleness(audio_service):
+    audio_service.generate_audio(EPISODE)
+    track = audio_service.build_episode_track(EPISODE)
+
+    assert track == audio_service.track_path(7)
+    assert audio_service.load_episode_track(EPISODE) == track
+    samples = pcm.read_wav(track, AudioService.PCM_RATE)
+    assert len(samples) == round(sum(shot["duration"] for shot in EPISODE["shots"]) * AudioService.PCM_RATE)
+
+    # 一个 shot 的配音变化后音轨过期
+    shot_path = audio_service.shot_audio_path(7, 3)
+    pcm.write_wav(shot_path, pcm.silence(3.0, AudioService.PCM_RATE), AudioService.PCM_RATE)
+    assert audio_service.load_episode_track(EPISODE) is None
+    assert audio_service.build_episode_track(EPISODE) == track
+    assert audio_service.load_episode_track(EPISODE) == track
+
+
+@pytest.mark.parametrize("length", [5000, 30000], ids=["speed-up", "slow-down"])
+def test_fit_length_returns_exact_length(length):
+    rate = AudioService.PCM_RATE
+    t = np.arange(12000) / rate
+    samples = (np.sin(2 * np.pi * 220 * t) * 8000).astype(np.int16)
+
+    fitted = pcm.fit_length(samples, length, rate)
+
+    assert fitted.dtype == np.int16
+    assert len(fitted) == length
@@ -0,0 +1,64 @@
+"""ComfyUIClient 测试（使用 scripts/fake_comfy_server.py）"""
+import socket
+import time
+
+from comfy.client import ComfyUIClient
+
+WORKFLOW = {
+    "prompt": {
+        "1": {"class_type": "KSampler", "inputs": {"seed": 1}},
+        "2": {"class_type": "SaveImage", "inputs": {"filename_prefix": "test", "images": ["1", 0]}},
+    }
+}
+
+
+def make_client(server) -> ComfyUIClient:
+    return ComfyUIClient(f"http://127.0.0.1:{server.server_address[1]}")
+
+
+def test_completion_via_websocket_events(fake_comfy, capsys):
+    client = make_client(fake_comfy(delay=0.2))
+    progress = []
+
+    prompt_id = client.submit(WORKFLOW)
+    entry = client.wait_for_completion(prompt_id, timeout=5, on_progress=lambda value, max_value: progress.append((value, max_value)))
+
+    assert entry["status"]["completed"]
+    assert entry["outputs"]["2"]["images"][0]["filename"].startswith("test_")
+    # 进度只在 WebSocket 模式下回调
+    assert progress == [(1, 4), (2, 4), (3, 4), (4, 4)]
+    assert "回退到轮询" not in capsys.readouterr().out
+
+
+def test_websocket_drop_falls_back_to_polling(fake_comfy, capsys):
+    server = fake_comfy(delay=0.4)
+    client = make_client(server)
+    progress = []
+
+    def drop_connection(value, max_value):
+        progress.append(value)
+        if value == 1:
+            # 服务端断开这个客户端的 WebSocket
+            with server.state.lock:
+                sock = server.state.sockets[client.client_id]
+            sock.shutdown(socket.SHUT_RDWR)
+
+    prompt_id = client.submit(WORKFLOW)
+    entry = client.wait_for_completion(prompt_id, timeout=5, on_progress=drop_connection)
+
+    assert entry["status"]["completed"]
+    assert progress == [1]
+    assert "回退到轮询" in capsys.readouterr().out
+
+
+def test_events_during_handshake_are_not_lost(fake_comfy, capsys):
+    # 任务在握手完成后、连接注册前结束，完成事件不会推送给这个客户端
+    client = make_client(fake_comfy(delay=0.1, ws_register_delay=0.5))
+
+    prompt_id = client.submit(WORKFLOW)
+    started = time.monotonic()
+    entry = client.wait_for_completion(prompt_id, timeout=3)
+
+    assert entry["status"]["completed"]
+    assert time.monotonic() - started < 2
+    assert "回退到轮询" not in capsys.readouterr().out
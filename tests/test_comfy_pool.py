@@ -0,0 +1,83 @@
+"""ComfyUIPool 测试（两个 scripts/fake_comfy_server.py 实例）"""
+from comfy.client import ComfyUIClient
+from comfy.pool import ComfyUIPool
+from comfy.transport import HTTPTransport
+
+WORKFLOW = {
+    "prompt": {
+        "1": {"class_type": "KSampler", "inputs": {"seed": 1}},
+        "2": {"class_type": "SaveImage", "inputs": {"filename_prefix": "test", "images": ["1", 0]}},
+    }
+}
+
+
+def url(server) -> str:
+    return f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def test_routes_to_least_loaded_backend(fake_comfy):
+    busy, idle = fake_comfy(delay=0.5), fake_comfy(delay=0.2)
+    transport = HTTPTransport()
+    # busy 上已经排了 4 个任务
+    direct = ComfyUIClient(url(busy), use_websocket=False, transport=transport)
+    for _ in range(4):
+        direct.submit(WORKFLOW)
+
+    pool = ComfyUIPool([url(busy), url(idle)], queue_poll_interval=0, transport=transport)
+    prompt_ids = [pool.submit(WORKFLOW) for _ in range(2)]
+
+    assert busy.state.counter == 4
+    assert idle.state.counter == 2
+    completed = dict(pool.iter_completed(prompt_ids, timeout=5))
+    assert set(completed) == set(prompt_ids)
+    assert all(entry["status"]["completed"] for entry in completed.values())
+
+
+def test_spreads_submissions_across_idle_backends(fake_comfy):
+    first, second = fake_comfy(delay=0.2), fake_comfy(delay=0.2)
+    pool = ComfyUIPool([url(first), url(second)], queue_poll_interval=60, transport=HTTPTransport())
+
+    prompt_ids = [pool.submit(WORKFLOW) for _ in range(4)]
+
+    # 队列深度缓存期间按本地提交数计算负载，交替提交
+    assert first.state.counter == 2
+    assert second.state.counter == 2
+    assert len(dict(pool.iter_completed(prompt_ids, timeout=5))) == 4
+
+
+def test_fails_over_when_backend_circuit_opens(fake_comfy, capsys):
+    down, up = fake_comfy(delay=0.1), fake_comfy(delay=0.1)
+    down_url = url(down)
+    down.shutdown()
+    down.server_close()
+    transport = HTTPTransport(max_retries=0, failure_threshold=1, reset_timeout=60)
+    pool = ComfyUIPool([down_url, url(up)], max_failures=3, probe_interval=60, transport=transport)
+
+    prompt_ids = [pool.submit(WORKFLOW) for _ in range(3)]
+
+    # 熔断打开后请求直接被拒绝，提交转到另一个后端
+    assert transport.circuit_states()[down_url] == "open"
+    assert up.state.counter == 3
+    assert pool.healthy_nodes() == [url(up)]
+    assert "已剔除" in capsys.readouterr().out
+    completed = dict(pool.iter_completed(prompt_ids, timeout=5))
+    assert set(completed) == set(prompt_ids)
+
+
+def test_affinity_scheduler_reroutes_failed_submissions(fake_comfy):
+    down, up = fake_comfy(delay=0.1), fake_comfy(delay=0.1)
+    down_url = url(down)
+    down.shutdown()
+    down.server_close()
+    transport = HTTPTransport(max_retries=0, failure_threshold=1, reset_timeout=60)
+    pool = ComfyUIPool(
+        [down_url, url(up)], max_failures=3, probe_interval=60, transport=transport, checkpoint_affinity=True
+    )
+
+    # 提交只进入调度队列，真正的 POST 在调度线程中失败后改投另一个节点
+    prompt_ids = [pool.submit(WORKFLOW) for _ in range(3)]
+    completed = dict(pool.iter_completed(prompt_ids, timeout=10))
+
+    assert set(completed) == set(prompt_ids)
+    assert up.state.counter == 3
+    assert pool.healthy_nodes() == [url(up)]
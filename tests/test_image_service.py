@@ -0,0 +1,50 @@
+"""ImageService 测试（使用 scripts/fake_comfy_server.py）"""
+import shutil
+from pathlib import Path
+
+import pytest
+
+from services.image_service import ImageService
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+
+
+@pytest.fixture
+def server(fake_comfy):
+    return fake_comfy(delay=0.05)
+
+
+@pytest.fixture
+def service(server, tmp_path):
+    shutil.copytree(PROJECT_ROOT / "workflows", tmp_path / "workflows")
+    service = ImageService(f"http://127.0.0.1:{server.server_address[1]}", cache_dir=tmp_path / "cache")
+    service.project_root = tmp_path
+    return service
+
+
+def make_episode(shot_count: int):
+    shot = {"scene": "modern office interior", "emotion": "suppressed", "framing": "medium"}
+    return {
+        "seed": 123456,
+        "character": {"fingerprint": "young man"},
+        "shots": [{**shot, "id": i, "output": f"assets/images/shot_{i}.png"} for i in range(1, shot_count + 1)],
+    }
+
+
+def test_batched_images_are_cached_by_batch_layout(server, service):
+    episode = make_episode(2)
+
+    assert len(service.generate_images(episode, batch_size=2)) == 2
+    assert len(server.state.history) == 1
+
+    # 同样的批次布局：全部命中缓存
+    service.generate_images(episode, batch_size=2)
+    assert len(server.state.history) == 1
+
+    # 合批的图片（seed 偏移批次）不能当作单独生成的结果
+    service.generate_images(episode, batch_size=1)
+    assert len(server.state.history) == 3
+
+    # 单独生成的图片对任何批次布局都有效
+    service.generate_images(episode, batch_size=2)
+    assert len(server.state.history) == 3
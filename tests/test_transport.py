@@ -0,0 +1,67 @@
+"""HTTPTransport 测试"""
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import requests
+
+from comfy.transport import HTTPTransport, Timeouts
+
+
+@pytest.fixture
+def server():
+    """统计收到的 POST 数：/slow 等待 0.5 秒后才响应，其他路径返回 503"""
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+        def do_POST(self):
+            self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            self.server.posts += 1
+            if self.path == "/slow":
+                time.sleep(0.5)
+            self.send_response(503)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+
+    srv = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    srv.daemon_threads = True
+    srv.posts = 0
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    yield srv
+    srv.shutdown()
+    srv.server_close()
+
+
+def make_transport() -> HTTPTransport:
+    return HTTPTransport(max_retries=2, backoff_base=0, failure_threshold=100, timeouts=Timeouts(read=0.2))
+
+
+def test_idempotent_requests_are_retried_on_5xx(server):
+    response = make_transport().post(f"http://127.0.0.1:{server.server_address[1]}/queue", "queue", json={})
+
+    assert response.status_code == 503
+    assert server.posts == 3
+
+
+def test_non_idempotent_requests_are_not_resent_after_reaching_the_server(server):
+    transport = make_transport()
+    base = f"http://127.0.0.1:{server.server_address[1]}"
+
+    assert transport.post(f"{base}/prompt", "submit", idempotent=False, json={}).status_code == 503
+    assert server.posts == 1
+    with pytest.raises(requests.ReadTimeout):
+        transport.post(f"{base}/slow", "submit", idempotent=False, json={})
+    assert server.posts == 2
+
+
+def test_non_idempotent_requests_are_retried_when_connection_is_refused(server):
+    transport = make_transport()
+    port = server.server_address[1]
+    server.shutdown()
+    server.server_close()
+
+    with pytest.raises(requests.ConnectionError):
+        transport.post(f"http://127.0.0.1:{port}/prompt", "submit", idempotent=False, json={})
+    assert transport.stats.snapshot()["submit"]["retries"] == 2
@@ -0,0 +1,14 @@
+from services import tts_backends
+from services.audio_service import AudioService
+
+
+def test_audio_services_share_one_backend():
+    first = AudioService(backend="offline", tts_workers=2)
+    second = AudioService(backend="offline", tts_workers=2)
+    try:
+        assert first.backend is second.backend
+        assert AudioService(backend="offline", tts_workers=1).backend is not first.backend
+    finally:
+        tts_backends.close_shared_backends()
+    assert AudioService(backend="offline", tts_workers=2).backend is not first.backend
+    tts_backends.close_shared_backends()
@@ -0,0 +1,139 @@
+"""VideoService 测试"""
+import math
+import shutil
+import subprocess
+from pathlib import Path
+
+import pytest
+
+from services import video_service
+from services.srt_service import format_srt
+from services.video_service import VideoService
+
+
+@pytest.fixture
+def fake_ffmpeg(monkeypatch):
+    """替换 ffmpeg/ffprobe：记录命令，并创建命令中的输出文件"""
+    commands = []
+
+    def run_ffmpeg(cmd, label="ffmpeg", duration=None):
+        commands.append(cmd)
+        for arg in cmd[1:]:
+            path = Path(arg)
+            if path.suffix in (".mp4", ".png") and not path.exists() and path.parent.is_dir():
+                path.write_bytes(b"stub")
+
+    monkeypatch.setattr(video_service, "run_ffmpeg", run_ffmpeg)
+    monkeypatch.setattr(video_service, "probe_duration", lambda path: 3.0)
+    return commands
+
+
+def test_render_renditions_without_audio(tmp_path, fake_ffmpeg):
+    images = []
+    for i in range(2):
+        image = tmp_path / f"shot_{i}.png"
+        image.write_bytes(b"image %d" % i)
+        images.append(image)
+    service = VideoService(segment_workers=1, cache_max_bytes=0, frame_cache_max_bytes=0)
+
+    outputs = service.render_renditions(images, [1.0, 2.0], tmp_path / "missing.srt", tmp_path / "out.mp4", audio_files=None)
+
+    assert outputs == {"720p": tmp_path / "out.mp4"}
+    segment_cmds = [cmd for cmd in fake_ffmpeg if "-filter_complex" in cmd]
+    assert len(segment_cmds) == 2
+    assert all("anullsrc=r=44100:cl=stereo" not in cmd and "-c:a" not in cmd for cmd in segment_cmds)
+
+
+def test_still_segment_input_uses_output_frame_rate(tmp_path, fake_ffmpeg):
+    image = tmp_path / "shot.png"
+    image.write_bytes(b"image")
+    service = VideoService(segment_workers=1, cache_max_bytes=0, frame_cache_max_bytes=0, profile="still")
+
+    service.render_renditions([image, image], [1.0, 2.0], tmp_path / "missing.srt", tmp_path / "out.mp4")
+
+    for cmd in (cmd for cmd in fake_ffmpeg if "-filter_complex" in cmd):
+        assert cmd[cmd.index("-framerate") + 1] == str(service.fps)
+        assert cmd.index("-framerate") < cmd.index("-i")
+
+
+def _gray_frame(video: Path, t: float) -> bytes:
+    """解码 t 秒处的一帧，缩小为 64x64 灰度"""
+    result = subprocess.run(
+        ["ffmpeg", "-v", "error", "-i", str(video), "-ss", f"{t:.4f}", "-frames:v", "1",
+         "-vf", "scale=64:64", "-f", "rawvideo", "-pix_fmt", "gray", "-"],
+        check=True, capture_output=True,
+    )
+    return result.stdout
+
+
+@pytest.mark.skipif(shutil.which("ffmpeg") is None, reason="需要 ffmpeg")
+def test_still_profile_matches_standard_at_cue_boundaries(tmp_path):
+    image = tmp_path / "shot.png"
+    subprocess.run(
+        ["ffmpeg", "-v", "error", "-f", "lavfi", "-i", "testsrc=s=360x640", "-frames:v", "1", str(image)],
+        check=True,
+    )
+    # 字幕边界不在 1/25 秒的网格上
+    cues = [(0.3, 0.9, "第一句"), (1.1, 1.7, "第二句")]
+    srt_path = tmp_path / "episode.srt"
+    srt_path.write_text(format_srt(cues), encoding="utf-8")
+
+    videos = {}
+    for profile in ("still", "standard"):
+        service = VideoService(
+            segment_workers=1, cache_max_bytes=0, frame_cache_max_bytes=0, profile=profile,
+            renditions=[{"name": "360p", "width": 360, "height": 640}],
+        )
+        videos[profile] = service.render_video([image], [2.0], srt_path, tmp_path / f"{profile}.mp4")
+
+    fps = VideoService.FPS
+    for start, end, _ in cues:
+        for t in (start, end):
+            # 边界前后各一帧的中间时刻
+            first = math.ceil(t * fps - 1e-6)
+            for n in (first - 1, first):
+                still = _gray_frame(videos["still"], (n + 0.5) / fps)
+                standard = _gray_frame(videos["standard"], (n + 0.5) / fps)
+                diff = sum(abs(a - b) for a, b in zip(still, standard)) / len(standard)
+                assert diff < 4, f"{t}s 附近第 {n} 帧不同（平均差 {diff:.1f}）"
+
+
+@pytest.mark.parametrize("suffix, encoded", [(".m4a", False), (".wav", True)])
+def test_episode_track_is_muxed_as_aac(tmp_path, fake_ffmpeg, suffix, encoded):
+    image = tmp_path / "shot.png"
+    image.write_bytes(b"image")
+    track = tmp_path / f"episode_001_audio{suffix}"
+    track.write_bytes(b"audio")
+    service = VideoService(segment_workers=1, cache_max_bytes=0, frame_cache_max_bytes=0)
+
+    service.render_renditions([image, image], [1.0, 2.0], tmp_path / "missing.srt", tmp_path / "out.mp4", audio_track=track)
+
+    concat = next(cmd for cmd in fake_ffmpeg if "concat" in cmd)
+    muxed = Path(concat[concat.index("-i", concat.index("-i") + 1) + 1])
+    assert muxed.suffix == ".m4a"
+    assert (muxed == track) is not encoded
+    encodes = [cmd for cmd in fake_ffmpeg if str(track) in cmd and "concat" not in cmd]
+    assert len(encodes) == (1 if encoded else 0)
+    if encoded:
+        assert encodes[0][encodes[0].index("-c:a") + 1] == "aac"
+
+
+def test_shot_audio_is_encoded_once_over_the_episode(tmp_path, fake_ffmpeg):
+    image = tmp_path / "shot.png"
+    image.write_bytes(b"image")
+    audio = tmp_path / "shot_1.mp3"
+    audio.write_bytes(b"audio")
+    service = VideoService(segment_workers=1, cache_max_bytes=0, frame_cache_max_bytes=0)
+
+    service.render_renditions([image, image], [1.0, 2.0], tmp_path / "missing.srt", tmp_path / "out.mp4", [audio, None])
+
+    # 片段只编码画面，配音按采样数补齐/截断后拼接为一条音轨，只编码一次 AAC
+    segments = [cmd for cmd in fake_ffmpeg if Path(cmd[-1]).name.startswith("segment_")]
+    assert segments and all("-c:a" not in cmd for cmd in segments)
+    encodes = [cmd for cmd in fake_ffmpeg if str(audio) in cmd]
+    assert len(encodes) == 1
+    graph = encodes[0][encodes[0].index("-filter_complex") + 1]
+    assert "atrim=end_sample=44100[a0]" in graph and "atrim=end_sample=88200[a1]" in graph
+    concat = next(cmd for cmd in fake_ffmpeg if "concat" in cmd)
+    assert concat[concat.index("-map", concat.index("-map") + 1) + 1] == "1:a"
+    assert concat[concat.index("-i", concat.index("-i") + 1) + 1] == encodes[0][-1]